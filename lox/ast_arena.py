@@ -0,0 +1,256 @@
+from array import array
+from typing import Callable
+from expr import (
+    Expr,
+    Binary,
+    Grouping,
+    Literal,
+    Unary,
+    Variable,
+    Assign,
+    Logical,
+    Call,
+    Get,
+    Set,
+    This,
+    Super,
+)
+from stmt import Stmt, Expression, Var, Block, If, While, Break, Function, Return, Class
+
+# What a field of a node holds, and so how it is encoded in the arena
+NODE = 0  # Another node, by index
+TOKEN = 1  # A token, by index into AstArena.tokens
+NODES = 2  # A list of nodes, by offset into AstArena.lists
+TOKENS = 3  # A list of tokens, by offset into AstArena.lists
+VALUE = 4  # A literal value, by index into AstArena.constants
+INT = 5  # A small int or None, stored as itself (-1 for None) and writable
+
+FIELDS: dict[type, tuple[tuple[str, int], ...]] = {
+    Binary: (("left", NODE), ("operator", TOKEN), ("right", NODE), ("quick", VALUE)),
+    Grouping: (("expression", NODE),),
+    Literal: (("value", VALUE),),
+    Unary: (("operator", TOKEN), ("right", NODE), ("quick", VALUE)),
+    Variable: (("name", TOKEN), ("access", INT), ("slot", INT)),
+    Assign: (("name", TOKEN), ("value", NODE), ("access", INT), ("slot", INT)),
+    Logical: (("left", NODE), ("operator", TOKEN), ("right", NODE), ("quick", VALUE)),
+    Call: (("callee", NODE), ("paren", TOKEN), ("arguments", NODES), ("inline", VALUE)),
+    Get: (("object", NODE), ("name", TOKEN)),
+    Set: (("object", NODE), ("name", TOKEN), ("value", NODE)),
+    This: (("keyword", TOKEN), ("access", INT), ("slot", INT)),
+    Super: (
+        ("keyword", TOKEN),
+        ("method", TOKEN),
+        ("this", NODE),
+        ("access", INT),
+        ("slot", INT),
+    ),
+    Expression: (("expression", NODE),),
+    Var: (("name", TOKEN), ("initializer", NODE), ("slot", INT), ("captured", INT)),
+    Block: (("statements", NODES),),
+    If: (("condition", NODE), ("then_branch", NODE), ("else_branch", NODE)),
+    While: (("condition", NODE), ("body", NODE)),
+    Break: (),
+    Function: (
+        ("name", TOKEN),
+        ("params", TOKENS),
+        ("body", NODES),
+        ("slot", INT),
+        ("captured", INT),
+        ("size", INT),
+        ("upvalues", VALUE),
+        ("cells", VALUE),
+    ),
+    Return: (("keyword", TOKEN), ("value", NODE), ("tail", INT)),
+    Class: (
+        ("name", TOKEN),
+        ("superclass", NODE),
+        ("methods", NODES),
+        ("slot", INT),
+        ("captured", INT),
+        ("super_slot", INT),
+    ),
+}
+
+# Inline caches the interpreter keeps on nodes. Views are made afresh on every
+# access, so they can't keep one: on a view it always reads as None and
+# writing it does nothing.
+CACHES: dict[type, tuple[str, ...]] = {Call: ("checked_callee",), Function: ("heat",)}
+# Fields every node of a class has the same value for, kept once on the arena.
+# A resolver pins the same global slots on every function it resolves, and
+# all of an arena's functions are resolved together.
+SHARED: dict[type, tuple[str, ...]] = {Function: ("globals",)}
+
+NODE_CLASSES: list[type] = list(FIELDS)
+WIDTH: int = max(len(fields) for fields in FIELDS.values())  # Fields stored per node
+
+
+class AstArena:
+    # Flat storage for a whole AST. Rather than one object per node, each node
+    # is a kind (its class) and WIDTH int fields in parallel arrays. The tree
+    # is read back through views: short-lived objects that are instances of
+    # the ordinary node classes, so every Visitor works on them unchanged.
+    def __init__(self, statements: list[Stmt]):
+        self.kinds: array = array('B')  # Index into NODE_CLASSES
+        self.fields: array = array('i')  # WIDTH per node, -1 for None
+        self.lists: array = array('i')  # Each list is its length followed by its items
+        self.tokens: list = []
+        self.constants: list = []
+        self.globals: tuple = ()  # Function.globals (see SHARED)
+        self.token_indexes: dict[int, int] = {}  # Only used while packing
+        self.node_indexes: dict[int, int] = {}  # Likewise, by id of the node packed
+        self.inlines: list[int] = []  # Likewise, constants holding a Call.inline
+        self.roots: array = array('i', [self.pack(statement) for statement in statements])
+        self.link_inlines()
+        del self.token_indexes, self.node_indexes, self.inlines
+
+    @property
+    def statements(self) -> list[Stmt]:
+        return [self.node(index) for index in self.roots]
+
+    def node(self, index: int) -> "Expr | Stmt":
+        return VIEW_CLASSES[self.kinds[index]](self, index)
+
+    def node_list(self, offset: int) -> list:
+        return [self.node(index) for index in self.list_items(offset)]
+
+    def token_list(self, offset: int) -> list:
+        return [self.tokens[index] for index in self.list_items(offset)]
+
+    def list_items(self, offset: int) -> array:
+        return self.lists[offset + 1:offset + 1 + self.lists[offset]]
+
+    def pack(self, node: "Expr | Stmt") -> int:
+        if node is None:
+            return -1
+        node_class: type = type(node)
+        encoded: list[int] = [-1] * WIDTH
+        for position, (field, kind) in enumerate(FIELDS[node_class]):
+            value: object = getattr(node, field)
+            if kind == NODE:
+                encoded[position] = self.pack(value)
+            elif kind == TOKEN:
+                encoded[position] = self.pack_token(value)
+            elif kind == NODES:
+                encoded[position] = self.pack_list([self.pack(item) for item in value])
+            elif kind == TOKENS:
+                encoded[position] = self.pack_list([self.pack_token(item) for item in value])
+            elif kind == INT:
+                encoded[position] = -1 if value is None else int(value)
+            else:
+                if field == "inline" and value is not None:
+                    self.inlines.append(len(self.constants))
+                encoded[position] = len(self.constants)
+                self.constants.append(value)
+        for field in SHARED.get(node_class, ()):
+            setattr(self, field, getattr(node, field))
+
+        index: int = len(self.kinds)
+        self.kinds.append(NODE_CLASSES.index(node_class))
+        self.fields.extend(encoded)
+        self.node_indexes[id(node)] = index
+        return index
+
+    def link_inlines(self) -> None:
+        # An inlined call runs its copy of the function only while the callee
+        # is a closure of the function's declaration, which in the arena is a
+        # view of it, so the declaration an inline holds becomes one too
+        for constant in self.inlines:
+            declaration, body = self.constants[constant]
+            index: int = self.node_indexes.get(id(declaration))
+            if index is not None:
+                self.constants[constant] = (self.node(index), body)
+
+    def pack_token(self, token) -> int:
+        if token is None:
+            return -1
+        index: int = self.token_indexes.get(id(token))
+        if index is None:
+            index = self.token_indexes[id(token)] = len(self.tokens)
+            self.tokens.append(token)
+        return index
+
+    def pack_list(self, items: list[int]) -> int:
+        offset: int = len(self.lists)
+        self.lists.append(len(items))
+        self.lists.extend(items)
+        return offset
+
+
+def field_getter(position: int, kind: int) -> Callable:
+    if kind == NODE:
+        def get(view):
+            index: int = view.arena.fields[view.index * WIDTH + position]
+            return None if index < 0 else view.arena.node(index)
+    elif kind == TOKEN:
+        def get(view):
+            index: int = view.arena.fields[view.index * WIDTH + position]
+            return None if index < 0 else view.arena.tokens[index]
+    elif kind == NODES:
+        def get(view):
+            return view.arena.node_list(view.arena.fields[view.index * WIDTH + position])
+    elif kind == TOKENS:
+        def get(view):
+            return view.arena.token_list(view.arena.fields[view.index * WIDTH + position])
+    elif kind == INT:
+        def get(view):
+            value: int = view.arena.fields[view.index * WIDTH + position]
+            return None if value < 0 else value
+    else:
+        def get(view):
+            return view.arena.constants[view.arena.fields[view.index * WIDTH + position]]
+    return get
+
+
+def field_setter(position: int, kind: int) -> Callable:
+    # INT and VALUE fields are the only ones written after packing, by the
+    # resolver, and by the interpreter quickening nodes. Packing gives every
+    # VALUE field a constant of its own, which writes replace, so however
+    # often a field is written the arena doesn't grow.
+    if kind == INT:
+        def set(view, value: int) -> None:
+            view.arena.fields[view.index * WIDTH + position] = -1 if value is None else value
+    else:
+        def set(view, value: object) -> None:
+            view.arena.constants[view.arena.fields[view.index * WIDTH + position]] = value
+    return set
+
+
+def view_class(node_class: type) -> type:
+    # A subclass of node_class whose fields are read from an arena. Views of
+    # the same node compare and hash equal.
+    def __init__(self, arena: AstArena, index: int):
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return (
+            type(other) is type(self) and other.arena is self.arena and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return self.index
+
+    def __reduce__(self) -> tuple:
+        return self.arena.node, (self.index,)
+
+    namespace: dict = {
+        "__slots__": ("arena", "index"),
+        "__init__": __init__,
+        "__eq__": __eq__,
+        "__hash__": __hash__,
+        "__reduce__": __reduce__,
+    }
+    for position, (field, kind) in enumerate(FIELDS[node_class]):
+        setter: Callable = field_setter(position, kind) if kind in (INT, VALUE) else None
+        namespace[field] = property(field_getter(position, kind), setter)
+    for cache in CACHES.get(node_class, ()):
+        namespace[cache] = property(lambda view: None, lambda view, value: None)
+    for field in SHARED.get(node_class, ()):
+        namespace[field] = property(
+            lambda view, field=field: getattr(view.arena, field),
+            lambda view, value, field=field: setattr(view.arena, field, value),
+        )
+    return type(node_class.__name__ + "View", (node_class,), namespace)
+
+
+VIEW_CLASSES: list[type] = [view_class(node_class) for node_class in NODE_CLASSES]
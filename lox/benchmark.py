@@ -0,0 +1,377 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from scanner import Scanner, CharacterScanner
+from parser import Parser
+from resolver import Resolver
+from interpreter import Interpreter
+from token_type import TokenType
+from incremental import IncrementalParser
+from lox import Lox
+from program import Program, ENGINES
+from ast_arena import AstArena, FIELDS, NODE, NODES, TOKENS
+
+BENCHMARK_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+
+SAMPLE: str = """// Generated benchmark input
+class Doughnut {
+  init(flavor, price) {
+    this.flavor = flavor;
+    this.price = price * 1.25;
+  }
+
+  describe() {
+    print("A " + this.flavor + " doughnut");
+  }
+}
+
+fun total(items, count) {
+  var sum = 0;
+  for (var i = 0; i < count; i = i + 1) {
+    if (i >= 10 and sum != 42.5) sum = sum + items / 2;
+  }
+  return sum;
+}
+"""
+
+
+def generate_source(size: int) -> str:
+    # Repeats the sample until the source is at least size characters long
+    return SAMPLE * (size // len(SAMPLE) + 1)
+
+
+def scanner_throughput(scanner_class: type, source: str, repeat: int = 3) -> float:
+    # Best of repeat runs, in MB/s
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        scanner_class(source).scan_tokens()
+        best = min(best, time.perf_counter() - start)
+    return len(source) / best / 1e6
+
+
+def bench_scanner(size: int = 2_000_000) -> None:
+    source: str = generate_source(size)
+    for scanner_class in (CharacterScanner, Scanner):
+        rate: float = scanner_throughput(scanner_class, source)
+        print(f"{scanner_class.__name__:<20} {rate:8.2f} MB/s")
+
+
+def parse_list(source: str) -> list:
+    return Parser(Scanner(source).scan_tokens()).parse()
+
+
+def parse_stream(source: str) -> list:
+    return Parser(Scanner(source).stream_tokens()).parse()
+
+
+def peak_rss(function, *args) -> int:
+    # Runs function in a forked child and returns the child's peak RSS in KB.
+    # (tracemalloc can't be used here, as our token module shadows the stdlib one.)
+    pid: int = os.fork()
+    if pid == 0:
+        try:
+            function(*args)
+        finally:
+            os._exit(0)
+    return os.wait4(pid, 0)[2].ru_maxrss
+
+
+def bench_pipeline(size: int = 2_000_000) -> None:
+    source: str = generate_source(size)
+    baseline: int = peak_rss(len, source)
+    for function in (parse_list, parse_stream):
+        peak: int = peak_rss(function, source) - baseline
+        print(f"{function.__name__:<20} {peak / 1024:8.2f} MB peak")
+
+
+def scan_list(source: str) -> None:
+    Scanner(source).scan_tokens()
+
+
+def scan_buffer(source: str) -> None:
+    Scanner(source).scan_buffer()
+
+
+def bench_parser(size: int = 1_000_000, repeat: int = 3) -> None:
+    source: str = generate_source(size)
+    best: float = float("inf")
+    for _ in range(repeat):
+        tokens: list = Scanner(source).scan_tokens()
+        start: float = time.perf_counter()
+        Parser(tokens).parse()
+        best = min(best, time.perf_counter() - start)
+    print(f"{'Parser':<20} {len(tokens) / best / 1e3:8.1f} k tokens/s")
+
+
+def bench_buffer(size: int = 2_000_000) -> None:
+    source: str = generate_source(size)
+    baseline: int = peak_rss(len, source)
+    for function in (scan_list, scan_buffer):
+        start: float = time.perf_counter()
+        function(source)
+        elapsed: float = time.perf_counter() - start
+        peak: int = peak_rss(function, source) - baseline
+        print(f"{function.__name__:<20} {elapsed:8.3f} s {peak / 1024:8.2f} MB peak")
+
+
+def read_benchmark(name: str) -> str:
+    with open(os.path.join(BENCHMARK_DIR, name + ".lox"), "rt") as file:
+        return file.read()
+
+
+def run_tokens(tokens: list) -> float:
+    # Parses, resolves and interprets tokens, returning the run time in seconds
+    statements: list = Parser(tokens).parse()
+    interpreter: Interpreter = Interpreter()
+    resolver: Resolver = Resolver()  # Pins the globals' slots while the tokens run
+    frame_size: int = resolver.resolve_script(statements)
+    start: float = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        interpreter.interpret(statements, frame_size)
+    return time.perf_counter() - start
+
+
+def identifier_memory(tokens: list) -> tuple[int, int]:
+    # Number of distinct identifier string objects, and their total size in bytes
+    lexemes: dict = {
+        id(token.lexeme): token.lexeme
+        for token in tokens
+        if token.type == TokenType.IDENTIFIER
+    }
+    return len(lexemes), sum(sys.getsizeof(lexeme) for lexeme in lexemes.values())
+
+
+def bench_interning(copies: int = 1000, repeat: int = 5) -> None:
+    source: str = read_benchmark("classes")
+    scanner_classes: tuple = (CharacterScanner, Scanner)
+    # Runs are interleaved so both scanners see the same machine conditions
+    times: dict = {scanner_class: [] for scanner_class in scanner_classes}
+    for _ in range(repeat):
+        for scanner_class in scanner_classes:
+            times[scanner_class].append(run_tokens(scanner_class(source).scan_tokens()))
+
+    for scanner_class in scanner_classes:
+        count, size = identifier_memory(scanner_class(source * copies).scan_tokens())
+        print(
+            f"{scanner_class.__name__:<20} {count:8} identifier strings "
+            f"{size / 1e6:8.2f} MB {min(times[scanner_class]):8.3f} s run"
+        )
+
+
+def bench_incremental(lines: int = 20_000) -> None:
+    source: str = SAMPLE * (lines // SAMPLE.count("\n") + 1)
+    start: float = time.perf_counter()
+    document: IncrementalParser = IncrementalParser(source)
+    print(f"{'full parse':<20} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    # Type a character, then a newline, inside a function in the middle of the file
+    middle: int = source.index("var sum = 0;", len(source) // 2) + len("var sum")
+    for label, offset, text in (("keystroke", middle, "s"), ("newline", middle + 1, "\n")):
+        start = time.perf_counter()
+        document.edit(offset, offset, text)
+        print(f"{label:<20} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+
+def run_text(path: str) -> None:
+    # How Lox.run_file used to load scripts: decode the whole file up front
+    with open(path, "rt", encoding="utf-8") as file:
+        Lox.run(file.read())
+
+
+def run_mapped(path: str) -> None:
+    Lox.run_file(path)
+
+
+def bench_mmap(size: int = 50_000_000) -> None:
+    # A data-embedding script: mostly long string literals. A single character
+    # outside Latin-1 makes a decoded copy of the whole script 4 bytes a character.
+    row: str = 'var row = "' + "data " * 1000 + '";\n'
+    with tempfile.NamedTemporaryFile("wt", encoding="utf-8", suffix=".lox", delete=False) as file:
+        file.write(row * (size // len(row) + 1))
+        file.write('print("done \U0001F680");\n')
+    try:
+        baseline: int = peak_rss(len, "")
+        for function in (run_text, run_mapped):
+            start: float = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                peak: int = peak_rss(function, file.name) - baseline
+            elapsed: float = time.perf_counter() - start
+            print(f"{function.__name__:<20} {elapsed:8.3f} s {peak / 1024:8.2f} MB peak")
+    finally:
+        os.remove(file.name)
+
+
+def timed_child(function, *args) -> float:
+    # Wall time of running function in a forked child, so each run starts
+    # from the same interpreter state
+    start: float = time.perf_counter()
+    peak_rss(function, *args)
+    return time.perf_counter() - start
+
+
+def bench_cache(size: int = 2_000_000) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path: str = os.path.join(directory, "large.lox")
+        with open(path, "wt") as file:
+            file.write(generate_source(size))
+        cold: float = timed_child(Lox.run_file, path)
+        warm: float = timed_child(Lox.run_file, path)
+        print(f"{'cold start':<20} {cold:8.3f} s")
+        print(f"{'warm start':<20} {warm:8.3f} s")
+
+
+def tree_size(node, counts: list) -> int:
+    # Bytes taken by the node objects of a tree and their child lists. Tokens
+    # and literal values are left out, as both representations share them.
+    if node is None:
+        return 0
+    counts[0] += 1
+    size: int = sys.getsizeof(node)
+    if hasattr(node, "__dict__"):
+        size += sys.getsizeof(node.__dict__)
+    for field, kind in FIELDS[type(node)]:
+        value = getattr(node, field)
+        if kind == NODE:
+            size += tree_size(value, counts)
+        elif kind == NODES:
+            size += sys.getsizeof(value) + sum(tree_size(item, counts) for item in value)
+        elif kind == TOKENS:
+            size += sys.getsizeof(value)
+    return size
+
+
+def bench_ast(size: int = 1_000_000) -> None:
+    statements: list = Parser(Scanner(generate_source(size)).stream_tokens()).parse()
+    counts: list = [0]
+    objects: int = sys.getsizeof(statements) + sum(tree_size(node, counts) for node in statements)
+    arena: AstArena = AstArena(statements)
+    packed: int = sum(
+        sys.getsizeof(part)
+        for part in (arena.kinds, arena.fields, arena.lists, arena.roots, arena.tokens, arena.constants)
+    )
+    print(f"{counts[0]} nodes")
+    print(f"{'objects':<20} {objects / 1e6:8.2f} MB")
+    print(f"{'arena':<20} {packed / 1e6:8.2f} MB")
+
+
+LIBRARY_FUNCTION: str = """fun helper{0}(a, b) {{
+  var total = 0;
+  for (var i = 0; i < a; i = i + 1) {{
+    if (i > b and total < 100) {{
+      total = total + i * {0};
+    }} else {{
+      total = total - 1;
+    }}
+  }}
+  return total;
+}}
+"""
+
+
+def startup(source: str, lazy: bool) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        Lox.run(source, lazy=lazy)
+
+
+def bench_lazy(functions: int = 5_000, repeat: int = 3) -> None:
+    # A large library of which the script only calls a handful of functions
+    source: str = "".join(LIBRARY_FUNCTION.format(index) for index in range(functions))
+    source += "".join(f"print(helper{index}(10, 5));\n" for index in range(5))
+    for lazy in (False, True):
+        elapsed: float = min(timed_child(startup, source, lazy) for _ in range(repeat))
+        print(f"{'lazy' if lazy else 'eager':<20} {elapsed:8.3f} s")
+
+
+RULE: str = """
+fun score(value, limit) {
+  if (value > limit) return limit;
+  return value * 2;
+}
+var result = 0;
+for (var i = 0; i < 10; i = i + 1) {
+  result = result + score(input + i, 50);
+}
+"""
+
+
+def bench_program(runs: int = 20_000) -> None:
+    # One rule script evaluated over and over with different inputs
+    start: float = time.perf_counter()
+    for run in range(runs):
+        Lox.run(f"var input = {run % 100};" + RULE)
+    every_run: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    program: Program = Lox.compile(RULE)
+    for run in range(runs):
+        program.run(globals={"input": float(run % 100)})
+    compiled_once: float = time.perf_counter() - start
+    print(f"{'Lox.run':<20} {every_run:8.3f} s")
+    print(f"{'Program.run':<20} {compiled_once:8.3f} s")
+
+
+def bench_engines(repeat: int = 3) -> None:
+    # Each standard benchmark script, compiled once and run on every engine
+    names: list[str] = sorted(name[:-4] for name in os.listdir(BENCHMARK_DIR) if name.endswith(".lox"))
+    engines: list[str] = ["tree", *ENGINES]
+    print(f"{'':<20}" + "".join(f"{engine:>10}" for engine in engines))
+    for name in names:
+        program: Program = Lox.compile(read_benchmark(name))
+        times: list[float] = []
+        for engine in engines:
+            best: float = float("inf")
+            for _ in range(repeat):
+                start: float = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    program.run(engine=engine)
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+        print(f"{name:<20}" + "".join(f"{elapsed:9.3f}s" for elapsed in times))
+
+
+def bench_optimizer(repeat: int = 3) -> None:
+    # Each standard benchmark script on the tree-walker, as parsed and as
+    # rewritten by the Optimizer
+    names: list[str] = sorted(name[:-4] for name in os.listdir(BENCHMARK_DIR) if name.endswith(".lox"))
+    print(f"{'':<20}{'plain':>10}{'optimized':>10}")
+    for name in names:
+        times: list[float] = []
+        for optimize in (False, True):
+            program: Program = Lox.compile(read_benchmark(name), optimize=optimize)
+            best: float = float("inf")
+            for _ in range(repeat):
+                start: float = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    program.run()
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+        print(f"{name:<20}" + "".join(f"{elapsed:9.3f}s" for elapsed in times))
+
+
+BENCHMARKS: dict = {
+    "scanner": bench_scanner,
+    "pipeline": bench_pipeline,
+    "parser": bench_parser,
+    "buffer": bench_buffer,
+    "interning": bench_interning,
+    "incremental": bench_incremental,
+    "mmap": bench_mmap,
+    "cache": bench_cache,
+    "ast": bench_ast,
+    "lazy": bench_lazy,
+    "program": bench_program,
+    "engines": bench_engines,
+    "optimizer": bench_optimizer,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: benchmark.py [{'|'.join(BENCHMARKS)}] [args...]")
+        sys.exit(64)
+    BENCHMARKS[sys.argv[1]](*(int(arg) for arg in sys.argv[2:]))
@@ -0,0 +1,138 @@
+import math
+from array import array
+from enum import IntEnum
+from token import Token
+
+
+class OpCode(IntEnum):
+    # Operands follow the opcode in the code stream, as many as OPERANDS says
+    CONSTANT = 0  # constant index
+    NIL = 1
+    TRUE = 2
+    FALSE = 3
+    POP = 4
+    DUP = 5
+    GET_LOCAL = 6  # slot
+    SET_LOCAL = 7  # slot; leaves the value on the stack, as assignments do
+    STORE_LOCAL = 8  # slot; pops the value, for declarations
+    GET_CELL = 9  # slot of a Cell in the frame
+    SET_CELL = 10  # slot
+    DEFINE_CELL = 11  # slot; pops the value into a new Cell
+    GET_UPVALUE = 12  # upvalue index
+    SET_UPVALUE = 13  # upvalue index
+    GET_GLOBAL = 14  # global slot
+    SET_GLOBAL = 15  # global slot
+    DEFINE_GLOBAL = 16  # constant index of the name
+    GET_PROPERTY = 17  # constant index of the name
+    SET_PROPERTY = 18  # constant index of the name
+    GET_SUPER = 19  # constant index of the method name
+    EQUAL = 20
+    NOT_EQUAL = 21
+    GREATER = 22
+    GREATER_EQUAL = 23
+    LESS = 24
+    LESS_EQUAL = 25
+    ADD = 26
+    SUBTRACT = 27
+    MULTIPLY = 28
+    DIVIDE = 29
+    NOT = 30
+    NEGATE = 31
+    JUMP = 32  # target offset
+    JUMP_IF_FALSE = 33  # target offset; pops the condition
+    JUMP_IF_FALSE_OR_POP = 34  # target offset; keeps the value if it jumps
+    JUMP_IF_TRUE_OR_POP = 35  # target offset
+    CALL = 36  # argument count
+    # A call of a property: the property is looked up (as by GET_PROPERTY)
+    # before the arguments are evaluated, but a method is left unbound, with
+    # its instance pushed after it, and CALL_METHOD passes the instance on
+    GET_METHOD = 37  # constant index of the name
+    CALL_METHOD = 38  # argument count
+    CLOSURE = 39  # constant index of the FunctionProto
+    CLASS = 40  # constant index of the name, method count
+    CHECK_SUPERCLASS = 41
+    CHECK_INSTANCE = 42  # checks the object of a property assignment
+    RETURN = 43
+    BREAK_OUT = 44  # break outside any loop of the function
+
+
+OPERANDS: dict[OpCode, int] = {opcode: 0 for opcode in OpCode} | {
+    OpCode.CONSTANT: 1,
+    OpCode.GET_LOCAL: 1,
+    OpCode.SET_LOCAL: 1,
+    OpCode.STORE_LOCAL: 1,
+    OpCode.GET_CELL: 1,
+    OpCode.SET_CELL: 1,
+    OpCode.DEFINE_CELL: 1,
+    OpCode.GET_UPVALUE: 1,
+    OpCode.SET_UPVALUE: 1,
+    OpCode.GET_GLOBAL: 1,
+    OpCode.SET_GLOBAL: 1,
+    OpCode.DEFINE_GLOBAL: 1,
+    OpCode.GET_PROPERTY: 1,
+    OpCode.SET_PROPERTY: 1,
+    OpCode.GET_SUPER: 1,
+    OpCode.JUMP: 1,
+    OpCode.JUMP_IF_FALSE: 1,
+    OpCode.JUMP_IF_FALSE_OR_POP: 1,
+    OpCode.JUMP_IF_TRUE_OR_POP: 1,
+    OpCode.CALL: 1,
+    OpCode.GET_METHOD: 1,
+    OpCode.CALL_METHOD: 1,
+    OpCode.CLOSURE: 1,
+    OpCode.CLASS: 2,
+}
+
+
+class Chunk:
+    # The bytecode of one function (or of top-level code): a flat stream of
+    # opcodes and their operands, the constants they refer to, and the
+    # source line of every entry in the stream
+    __slots__ = ("code", "constants", "constant_indexes", "lines", "tokens", "loop_exits")
+
+    def __init__(self):
+        self.code: array = array('i')
+        self.constants: list = []
+        self.constant_indexes: dict[tuple[type, object], int] = {}  # For numbers and strings
+        self.lines: array = array('I')  # One per entry of code
+        # The token an instruction reports its runtime errors at, by offset
+        self.tokens: dict[int, Token] = {}
+        # Where the innermost loop around a call ends, by the offset the call
+        # returns to. A break in a function outside any of its own loops
+        # ends the caller's loop, as it does in the tree-walker.
+        self.loop_exits: dict[int, int] = {}
+
+    def write(self, opcode: OpCode, *operands: int, line: int = 0) -> int:
+        # Appends an instruction and returns its offset
+        offset: int = len(self.code)
+        self.code.append(opcode)
+        self.code.extend(operands)
+        self.lines.extend([line] * (1 + len(operands)))
+        return offset
+
+    def add_constant(self, value: object) -> int:
+        # Numbers and strings are shared; anything else gets an entry of its own
+        if type(value) in (float, str):
+            # -0.0 == 0.0, so the sign keeps the two zeros apart
+            sign: float = math.copysign(1.0, value) if type(value) is float else 1.0
+            key: tuple[type, object, float] = (type(value), value, sign)
+            index: int = self.constant_indexes.get(key)
+            if index is None:
+                index = self.constant_indexes[key] = len(self.constants)
+                self.constants.append(value)
+            return index
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def disassemble(self) -> str:
+        lines: list[str] = []
+        offset: int = 0
+        while offset < len(self.code):
+            opcode: OpCode = OpCode(self.code[offset])
+            operands: array = self.code[offset + 1:offset + 1 + OPERANDS[opcode]]
+            lines.append(
+                f"{offset:04} {self.lines[offset]:4} {opcode.name:<20} "
+                + " ".join(str(operand) for operand in operands)
+            )
+            offset += 1 + OPERANDS[opcode]
+        return "\n".join(lines)
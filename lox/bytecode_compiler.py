@@ -0,0 +1,345 @@
+from typing import Callable
+from bytecode import OpCode, Chunk
+from environment import global_slot, LOCAL, CELL, UPVALUE
+from stmt import Expression, Stmt, Var, Block, If, While, Break, Function, Return, Class
+from token_type import TokenType
+from visitor import Visitor
+from expr import (
+    Expr,
+    Literal,
+    Grouping,
+    Unary,
+    Binary,
+    Variable,
+    Assign,
+    Logical,
+    Call,
+    Get,
+    Set,
+    This,
+    Super,
+)
+from token import Token
+from resolver import Resolver
+from vm import VM
+
+BINARY_OPCODES: dict[TokenType, OpCode] = {
+    TokenType.EQUAL_EQUAL: OpCode.EQUAL,
+    TokenType.BANG_EQUAL: OpCode.NOT_EQUAL,
+    TokenType.GREATER: OpCode.GREATER,
+    TokenType.GREATER_EQUAL: OpCode.GREATER_EQUAL,
+    TokenType.LESS: OpCode.LESS,
+    TokenType.LESS_EQUAL: OpCode.LESS_EQUAL,
+    TokenType.PLUS: OpCode.ADD,
+    TokenType.MINUS: OpCode.SUBTRACT,
+    TokenType.STAR: OpCode.MULTIPLY,
+    TokenType.SLASH: OpCode.DIVIDE,
+}
+
+# How a resolved node's variable is read and written
+GET_OPCODES: dict[int, OpCode] = {
+    LOCAL: OpCode.GET_LOCAL,
+    CELL: OpCode.GET_CELL,
+    UPVALUE: OpCode.GET_UPVALUE,
+}
+SET_OPCODES: dict[int, OpCode] = {
+    LOCAL: OpCode.SET_LOCAL,
+    CELL: OpCode.SET_CELL,
+    UPVALUE: OpCode.SET_UPVALUE,
+}
+
+
+class FunctionProto:
+    # A function declaration compiled to bytecode, shared by every closure
+    # made from it. A lazily parsed body is parsed, resolved and compiled on
+    # the first call.
+    __slots__ = ("declaration", "name", "arity", "is_initializer", "upvalues", "size", "cells", "chunk")
+
+    def __init__(self, declaration: Function, is_initializer: bool):
+        self.declaration: Function = declaration
+        self.name: str = declaration.name.lexeme
+        self.arity: int = len(declaration.params)
+        self.is_initializer: bool = is_initializer
+        self.upvalues: tuple[tuple[bool, int], ...] = tuple(declaration.upvalues)
+        self.size: int = 0
+        self.cells: tuple[int, ...] = ()
+        self.chunk: Chunk = None
+        if declaration.body is not None:
+            self.compile()
+
+    def compile(self) -> Chunk:
+        declaration: Function = self.declaration
+        if declaration.body is None:
+            Resolver.resolve_lazy_body(declaration)
+        self.size = declaration.size
+        self.cells = declaration.cells
+        self.chunk = BytecodeCompiler().compile_function(declaration, self.is_initializer)
+        return self.chunk
+
+
+class Loop:
+    # The loop being compiled, for the breaks and calls in its body
+    __slots__ = ("breaks", "calls")
+
+    def __init__(self):
+        self.breaks: list[int] = []  # Offsets of jumps to patch to the exit
+        self.calls: list[int] = []  # Offsets calls return to
+
+
+class BytecodeCompiler(Visitor):
+    # Compiles a resolved tree into a Chunk per function, for the VM. As
+    # with the other engines, locals live in a frame list laid out by the
+    # resolver, so the operand stack only ever holds temporaries.
+    def __init__(self):
+        self.chunk: Chunk = Chunk()
+        self.loops: list[Loop] = []
+        self.line: int = 0  # Line of the last token seen, for nodes with none
+        self.is_initializer: bool = False
+        self.this_opcode: OpCode = OpCode.GET_LOCAL  # How an initializer reads "this"
+
+    def compile(self, statements: list[Stmt]) -> Callable:
+        # Compiles top-level code into what Program runs
+        for statement in statements:
+            statement.accept(self)
+        self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+        chunk: Chunk = self.chunk
+
+        def script(interpreter, frame, upvalues):
+            VM(interpreter).run(chunk, frame, upvalues)
+
+        return script
+
+    def compile_function(self, function: Function, is_initializer: bool) -> Chunk:
+        self.is_initializer = is_initializer
+        # "this" is in slot 0, in a cell if closures capture it
+        self.this_opcode = OpCode.GET_CELL if 0 in function.cells else OpCode.GET_LOCAL
+        self.line = function.name.line
+        for statement in function.body:
+            statement.accept(self)
+        self.emit_return(None)
+        return self.chunk
+
+    def emit(self, opcode: OpCode, *operands: int, token: Token = None) -> int:
+        if token is not None:
+            self.line = token.line
+        offset: int = self.chunk.write(opcode, *operands, line=self.line)
+        if token is not None:
+            self.chunk.tokens[offset] = token
+        return offset
+
+    def emit_jump(self, opcode: OpCode) -> int:
+        # Emits a jump to be patched, returning the offset of its operand
+        return self.emit(opcode, -1) + 1
+
+    def patch_jump(self, operand: int) -> None:
+        # Points the jump whose operand is at operand to the next instruction
+        self.chunk.code[operand] = len(self.chunk.code)
+
+    def emit_call(self, opcode: OpCode, argument_count: int, token: Token) -> None:
+        self.emit(opcode, argument_count, token=token)
+        if self.loops:
+            self.loops[-1].calls.append(len(self.chunk.code))
+
+    def emit_return(self, value: Expr) -> None:
+        if self.is_initializer:
+            # An initializer always returns its instance
+            self.emit(self.this_opcode, 0)
+        elif value is None:
+            self.emit(OpCode.NIL)
+        else:
+            value.accept(self)
+        self.emit(OpCode.RETURN)
+
+    def emit_get(self, name: Token, expr: Expr) -> None:
+        if expr.access is not None:
+            self.emit(GET_OPCODES[expr.access], expr.slot)
+        else:
+            self.emit(OpCode.GET_GLOBAL, global_slot(name.lexeme).index, token=name)
+
+    def emit_define(self, stmt: Var | Function | Class) -> None:
+        # Pops the value on top of the stack into the declared variable
+        if stmt.slot is None:
+            self.emit(OpCode.DEFINE_GLOBAL, self.chunk.add_constant(stmt.name.lexeme), token=stmt.name)
+        elif stmt.captured:
+            # A new cell on every run, as in the tree-walker
+            self.emit(OpCode.DEFINE_CELL, stmt.slot)
+        else:
+            self.emit(OpCode.STORE_LOCAL, stmt.slot)
+
+    def visit_literal_expr(self, expr: Literal) -> None:
+        if expr.value is None:
+            self.emit(OpCode.NIL)
+        elif expr.value is True:
+            self.emit(OpCode.TRUE)
+        elif expr.value is False:
+            self.emit(OpCode.FALSE)
+        else:
+            self.emit(OpCode.CONSTANT, self.chunk.add_constant(expr.value))
+
+    def visit_grouping_expr(self, expr: Grouping) -> None:
+        expr.expression.accept(self)
+
+    def visit_variable_expr(self, expr: Variable) -> None:
+        self.emit_get(expr.name, expr)
+
+    def visit_this_expr(self, expr: This) -> None:
+        self.emit_get(expr.keyword, expr)
+
+    def visit_assign_expr(self, expr: Assign) -> None:
+        expr.value.accept(self)
+        if expr.access is not None:
+            self.emit(SET_OPCODES[expr.access], expr.slot)
+        else:
+            self.emit(OpCode.SET_GLOBAL, global_slot(expr.name.lexeme).index, token=expr.name)
+
+    def visit_unary_expr(self, expr: Unary) -> None:
+        expr.right.accept(self)
+        if expr.operator.type == TokenType.BANG:
+            self.emit(OpCode.NOT, token=expr.operator)
+        else:
+            self.emit(OpCode.NEGATE, token=expr.operator)
+
+    def visit_binary_expr(self, expr: Binary) -> None:
+        expr.left.accept(self)
+        expr.right.accept(self)
+        self.emit(BINARY_OPCODES[expr.operator.type], token=expr.operator)
+
+    def visit_logical_expr(self, expr: Logical) -> None:
+        expr.left.accept(self)
+        if expr.operator.type == TokenType.OR:
+            jump: int = self.emit_jump(OpCode.JUMP_IF_TRUE_OR_POP)
+        else:
+            jump = self.emit_jump(OpCode.JUMP_IF_FALSE_OR_POP)
+        expr.right.accept(self)
+        self.patch_jump(jump)
+
+    def visit_call_expr(self, expr: Call) -> None:
+        if isinstance(expr.callee, Get):
+            # Calling a method doesn't bind it
+            expr.callee.object.accept(self)
+            name: Token = expr.callee.name
+            self.emit(OpCode.GET_METHOD, self.chunk.add_constant(name.lexeme), token=name)
+            for argument in expr.arguments:
+                argument.accept(self)
+            self.emit_call(OpCode.CALL_METHOD, len(expr.arguments), expr.paren)
+            return
+
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+        self.emit_call(OpCode.CALL, len(expr.arguments), expr.paren)
+
+    def visit_get_expr(self, expr: Get) -> None:
+        expr.object.accept(self)
+        self.emit(OpCode.GET_PROPERTY, self.chunk.add_constant(expr.name.lexeme), token=expr.name)
+
+    def visit_set_expr(self, expr: Set) -> None:
+        expr.object.accept(self)
+        name: int = self.chunk.add_constant(expr.name.lexeme)
+        # The object is checked before the value is evaluated
+        self.emit(OpCode.CHECK_INSTANCE, token=expr.name)
+        expr.value.accept(self)
+        self.emit(OpCode.SET_PROPERTY, name, token=expr.name)
+
+    def visit_super_expr(self, expr: Super) -> None:
+        self.emit_get(expr.keyword, expr)
+        self.emit_get(expr.this.keyword, expr.this)
+        self.emit(OpCode.GET_SUPER, self.chunk.add_constant(expr.method.lexeme), token=expr.method)
+
+    def visit_expression_stmt(self, stmt: Expression) -> None:
+        stmt.expression.accept(self)
+        self.emit(OpCode.POP)
+
+    def visit_var_stmt(self, stmt: Var) -> None:
+        self.line = stmt.name.line
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        else:
+            self.emit(OpCode.NIL)
+        self.emit_define(stmt)
+
+    def visit_function_stmt(self, stmt: Function) -> None:
+        proto: int = self.chunk.add_constant(FunctionProto(stmt, False))
+        if stmt.captured:
+            # The closure may capture its own cell, so the cell comes first
+            self.emit(OpCode.NIL)
+            self.emit(OpCode.DEFINE_CELL, stmt.slot)
+            self.emit(OpCode.CLOSURE, proto, token=stmt.name)
+            self.emit(OpCode.SET_CELL, stmt.slot)
+            self.emit(OpCode.POP)
+        else:
+            self.emit(OpCode.CLOSURE, proto, token=stmt.name)
+            self.emit_define(stmt)
+
+    def visit_return_stmt(self, stmt: Return) -> None:
+        self.line = stmt.keyword.line
+        self.emit_return(stmt.value)
+
+    def visit_while_stmt(self, stmt: While) -> None:
+        loop: Loop = Loop()
+        self.loops.append(loop)
+        start: int = len(self.chunk.code)
+        stmt.condition.accept(self)
+        exit_jump: int = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        stmt.body.accept(self)
+        self.emit(OpCode.JUMP, start)
+        self.patch_jump(exit_jump)
+        self.loops.pop()
+
+        end: int = len(self.chunk.code)
+        for jump in loop.breaks:
+            self.chunk.code[jump] = end
+        for call in loop.calls:
+            self.chunk.loop_exits[call] = end
+
+    def visit_break_stmt(self, stmt: Break) -> None:
+        if self.loops:
+            self.loops[-1].breaks.append(self.emit_jump(OpCode.JUMP))
+        else:
+            self.emit(OpCode.BREAK_OUT)
+
+    def visit_block_stmt(self, stmt: Block) -> None:
+        for statement in stmt.statements:
+            statement.accept(self)
+
+    def visit_if_stmt(self, stmt: If) -> None:
+        stmt.condition.accept(self)
+        else_jump: int = self.emit_jump(OpCode.JUMP_IF_FALSE)
+        stmt.then_branch.accept(self)
+        if stmt.else_branch is None:
+            self.patch_jump(else_jump)
+            return
+
+        end_jump: int = self.emit_jump(OpCode.JUMP)
+        self.patch_jump(else_jump)
+        stmt.else_branch.accept(self)
+        self.patch_jump(end_jump)
+
+    def visit_class_stmt(self, stmt: Class) -> None:
+        if stmt.superclass is not None:
+            stmt.superclass.accept(self)
+            self.emit(OpCode.CHECK_SUPERCLASS, token=stmt.superclass.name)
+
+        # Declared before the methods are made, which may capture it
+        self.emit(OpCode.NIL)
+        self.emit_define(stmt)
+
+        if stmt.superclass is not None:
+            self.emit(OpCode.DUP)
+            self.emit(OpCode.DEFINE_CELL, stmt.super_slot)
+        else:
+            self.emit(OpCode.NIL)
+
+        for method in stmt.methods:
+            proto: FunctionProto = FunctionProto(method, method.name.lexeme == "init")
+            self.emit(OpCode.CLOSURE, self.chunk.add_constant(proto), token=method.name)
+        self.emit(OpCode.CLASS, self.chunk.add_constant(stmt.name.lexeme), len(stmt.methods), token=stmt.name)
+
+        if stmt.slot is None:
+            self.emit(OpCode.DEFINE_GLOBAL, self.chunk.add_constant(stmt.name.lexeme), token=stmt.name)
+        elif stmt.captured:
+            self.emit(OpCode.SET_CELL, stmt.slot)
+            self.emit(OpCode.POP)
+        else:
+            self.emit(OpCode.STORE_LOCAL, stmt.slot)
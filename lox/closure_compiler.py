@@ -0,0 +1,635 @@
+from typing import Callable
+from environment import Cell, global_slot, UNDEFINED, LOCAL, CELL, UPVALUE
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from stmt import Expression, Stmt, Var, Block, If, While, Break, Function, Return, Class
+from token_type import TokenType
+from visitor import Visitor
+from expr import (
+    Expr,
+    Literal,
+    Grouping,
+    Unary,
+    Binary,
+    Variable,
+    Assign,
+    Logical,
+    Call,
+    Get,
+    Set,
+    This,
+    Super,
+)
+from token import Token
+from exceptions import LoxRuntimeError, LoxBreakException
+from resolver import Resolver
+
+# Every compiled node is a closure taking (interpreter, frame, upvalues), the
+# same state the tree-walking Interpreter keeps on itself. An expression's
+# closure returns its value. A statement's returns None to carry on, BREAK to
+# leave the innermost loop, or a 1-tuple holding the value of a return.
+Code = Callable[["Interpreter", list, list[Cell]], object]
+
+BREAK: object = object()
+RETURN_NIL: tuple = (None,)
+
+
+class FunctionCode:
+    # The compiled body of a function declaration, shared by every closure
+    # made from it. A lazily parsed body is parsed, resolved and compiled on
+    # the first call.
+    __slots__ = ("declaration", "body", "size", "cells")
+
+    def __init__(self, declaration: Function):
+        self.declaration: Function = declaration
+        self.body: Code = None
+        self.size: int = 0
+        self.cells: tuple[int, ...] = ()
+        if declaration.body is not None:
+            self.compile()
+
+    def compile(self) -> Code:
+        declaration: Function = self.declaration
+        if declaration.body is None:
+            Resolver.resolve_lazy_body(declaration)
+        self.size = declaration.size
+        self.cells = declaration.cells
+        self.body = ClosureCompiler().compile_block(declaration.body)
+        return self.body
+
+
+class CompiledFunction(LoxCallable):
+    # A closure made from a FunctionCode, standing in for LoxFunction
+    def __init__(
+        self,
+        code: FunctionCode,
+        upvalues: list[Cell],
+        is_initializer: bool,
+        this: LoxInstance = None,
+    ):
+        self.code: FunctionCode = code
+        self.upvalues: list[Cell] = upvalues
+        self.is_initializer: bool = is_initializer
+        self.this: LoxInstance = this
+
+    def call(self, interpreter: "Interpreter", arguments: list):
+        code: FunctionCode = self.code
+        body: Code = code.body
+        if body is None:
+            body = code.compile()
+
+        # The arguments become the frame, laid out as for LoxFunction
+        if self.this is not None:
+            arguments.insert(0, self.this)
+        size: int = code.size
+        if size > len(arguments):
+            arguments.extend([None] * (size - len(arguments)))
+        for slot in code.cells:
+            arguments[slot] = Cell(arguments[slot])
+
+        completion = body(interpreter, arguments, self.upvalues)
+        if self.is_initializer:
+            return self.this
+        if completion is None:
+            return None
+        if completion is BREAK:
+            # As in the tree-walker, a break outside any loop of the function
+            # ends the caller's loop
+            raise LoxBreakException()
+        return completion[0]
+
+    def bind(self, instance: LoxInstance) -> "CompiledFunction":
+        return CompiledFunction(self.code, self.upvalues, self.is_initializer, instance)
+
+    def arity(self) -> int:
+        return len(self.code.declaration.params)
+
+    def __str__(self) -> str:
+        return f"<fun {self.code.declaration.name.lexeme}>"
+
+
+def check_number_operand(operator: Token, *operands: object) -> None:
+    for operand in operands:
+        if not isinstance(operand, float) and not isinstance(operand, int):
+            raise LoxRuntimeError(operator, "Operands must be numbers.")
+
+
+def is_equal(left, right) -> bool:
+    if left is None and right is None:
+        return True
+    elif left is None:
+        return False
+    elif type(left) is not type(right):
+        return False
+    return left == right
+
+
+class ClosureCompiler(Visitor):
+    # An alternative to Interpreter that turns a resolved tree into nested
+    # Python closures, once. Everything the tree-walker decides on each visit
+    # (which node type, which operator, which slot, which constant) is decided
+    # here instead, so running the program is just calling closures.
+    def compile(self, statements: list[Stmt]) -> Code:
+        body: Code = self.compile_block(statements)
+
+        def script(interpreter, frame, upvalues):
+            if body(interpreter, frame, upvalues) is BREAK:
+                raise LoxBreakException()
+
+        return script
+
+    def compile_block(self, statements: list[Stmt]) -> Code:
+        compiled: tuple[Code, ...] = tuple(statement.accept(self) for statement in statements)
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def block(interpreter, frame, upvalues):
+            for statement in compiled:
+                completion = statement(interpreter, frame, upvalues)
+                if completion is not None:
+                    return completion
+
+        return block
+
+    def visit_literal_expr(self, expr: Literal) -> Code:
+        value: object = expr.value
+
+        def literal(interpreter, frame, upvalues):
+            return value
+
+        return literal
+
+    def visit_grouping_expr(self, expr: Grouping) -> Code:
+        return expr.expression.accept(self)
+
+    def visit_variable_expr(self, expr: Variable) -> Code:
+        return self.variable(expr.name, expr)
+
+    def visit_this_expr(self, expr: This) -> Code:
+        return self.variable(expr.keyword, expr)
+
+    def variable(self, name: Token, expr: Expr) -> Code:
+        slot: int = expr.slot
+        access: int = expr.access
+        if access == LOCAL:
+            def local(interpreter, frame, upvalues):
+                return frame[slot]
+            return local
+        if access == CELL:
+            def cell(interpreter, frame, upvalues):
+                return frame[slot].value
+            return cell
+        if access == UPVALUE:
+            def upvalue(interpreter, frame, upvalues):
+                return upvalues[slot].value
+            return upvalue
+
+        slot = global_slot(name.lexeme).index
+
+        def global_(interpreter, frame, upvalues):
+            try:
+                value = interpreter.globals.values[slot]
+            except IndexError:
+                value = UNDEFINED
+            if value is UNDEFINED:
+                raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+            return value
+
+        return global_
+
+    def visit_assign_expr(self, expr: Assign) -> Code:
+        value: Code = expr.value.accept(self)
+        name: Token = expr.name
+        slot: int = expr.slot
+        access: int = expr.access
+        if access == LOCAL:
+            def local(interpreter, frame, upvalues):
+                frame[slot] = result = value(interpreter, frame, upvalues)
+                return result
+            return local
+        if access == CELL:
+            def cell(interpreter, frame, upvalues):
+                frame[slot].value = result = value(interpreter, frame, upvalues)
+                return result
+            return cell
+        if access == UPVALUE:
+            def upvalue(interpreter, frame, upvalues):
+                upvalues[slot].value = result = value(interpreter, frame, upvalues)
+                return result
+            return upvalue
+
+        slot = global_slot(name.lexeme).index
+
+        def global_(interpreter, frame, upvalues):
+            result = value(interpreter, frame, upvalues)
+            interpreter.globals.assign(name, slot, result)
+            return result
+
+        return global_
+
+    def visit_unary_expr(self, expr: Unary) -> Code:
+        right: Code = expr.right.accept(self)
+        operator: Token = expr.operator
+
+        if operator.type == TokenType.BANG:
+            def bang(interpreter, frame, upvalues):
+                value = right(interpreter, frame, upvalues)
+                return value is None or value is False
+            return bang
+
+        def minus(interpreter, frame, upvalues):
+            value = right(interpreter, frame, upvalues)
+            check_number_operand(operator, value)
+            return -float(value)
+
+        return minus
+
+    def visit_binary_expr(self, expr: Binary) -> Code:
+        left: Code = expr.left.accept(self)
+        right: Code = expr.right.accept(self)
+        operator: Token = expr.operator
+
+        # Each operator gets its own closure. Two floats, by far the most
+        # common operands, take the fast path; anything else goes through
+        # the same checks and conversions as in the tree-walker.
+        match operator.type:
+            case TokenType.GREATER:
+                def greater(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a > b
+                    check_number_operand(operator, a, b)
+                    return float(a) > float(b)
+                return greater
+            case TokenType.GREATER_EQUAL:
+                def greater_equal(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a >= b
+                    check_number_operand(operator, a, b)
+                    return float(a) >= float(b)
+                return greater_equal
+            case TokenType.LESS:
+                def less(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a < b
+                    check_number_operand(operator, a, b)
+                    return float(a) < float(b)
+                return less
+            case TokenType.LESS_EQUAL:
+                def less_equal(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a <= b
+                    check_number_operand(operator, a, b)
+                    return float(a) <= float(b)
+                return less_equal
+            case TokenType.MINUS:
+                def minus(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a - b
+                    check_number_operand(operator, a, b)
+                    return float(a) - float(b)
+                return minus
+            case TokenType.PLUS:
+                def plus(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if isinstance(a, float) and isinstance(b, float):
+                        return a + b
+                    elif isinstance(a, str) and isinstance(b, str):
+                        return str(a) + str(b)
+                    raise LoxRuntimeError(
+                        operator, "Operands must be two numbers or two strings."
+                    )
+                return plus
+            case TokenType.SLASH:
+                def slash(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    check_number_operand(operator, a, b)
+                    if float(b) == 0:
+                        raise LoxRuntimeError(operator, "Cannot divide by zero.")
+                    return float(a) / float(b)
+                return slash
+            case TokenType.STAR:
+                def star(interpreter, frame, upvalues):
+                    a = left(interpreter, frame, upvalues)
+                    b = right(interpreter, frame, upvalues)
+                    if type(a) is float and type(b) is float:
+                        return a * b
+                    check_number_operand(operator, a, b)
+                    return float(a) * float(b)
+                return star
+            case TokenType.BANG_EQUAL:
+                def bang_equal(interpreter, frame, upvalues):
+                    return not is_equal(
+                        left(interpreter, frame, upvalues), right(interpreter, frame, upvalues)
+                    )
+                return bang_equal
+            case TokenType.EQUAL_EQUAL:
+                def equal_equal(interpreter, frame, upvalues):
+                    return is_equal(
+                        left(interpreter, frame, upvalues), right(interpreter, frame, upvalues)
+                    )
+                return equal_equal
+
+        def nil(interpreter, frame, upvalues):
+            left(interpreter, frame, upvalues)
+            right(interpreter, frame, upvalues)
+
+        return nil
+
+    def visit_logical_expr(self, expr: Logical) -> Code:
+        left: Code = expr.left.accept(self)
+        right: Code = expr.right.accept(self)
+
+        if expr.operator.type == TokenType.OR:
+            def or_(interpreter, frame, upvalues):
+                value = left(interpreter, frame, upvalues)
+                if value is not None and value is not False:
+                    return value
+                return right(interpreter, frame, upvalues)
+            return or_
+
+        def and_(interpreter, frame, upvalues):
+            value = left(interpreter, frame, upvalues)
+            if value is None or value is False:
+                return value
+            return right(interpreter, frame, upvalues)
+
+        return and_
+
+    def visit_call_expr(self, expr: Call) -> Code:
+        callee: Code = expr.callee.accept(self)
+        arguments: tuple[Code, ...] = tuple(argument.accept(self) for argument in expr.arguments)
+        paren: Token = expr.paren
+        # As in the tree-walker, the checks only need to pass once for the
+        # callable a call site keeps calling, and functions are checked by
+        # their code, so no instance or cell is kept alive
+        checked_callee: object = None
+
+        def call(interpreter, frame, upvalues, function=UNDEFINED):
+            # function is the callee, when it is already evaluated
+            nonlocal checked_callee
+            if function is UNDEFINED:
+                function = callee(interpreter, frame, upvalues)
+            values: list = [argument(interpreter, frame, upvalues) for argument in arguments]
+
+            checked: object = function.code if type(function) is CompiledFunction else function
+            if checked is not checked_callee:
+                if not isinstance(function, LoxCallable):
+                    raise LoxRuntimeError(paren, "Can only call functions and classes.")
+
+                if len(values) != function.arity():
+                    raise LoxRuntimeError(
+                        paren,
+                        f"Expected {function.arity()} arguments but got {len(values)}.",
+                    )
+                checked_callee = checked
+
+            return function.call(interpreter, values)
+
+        if expr.inline is None:
+            return call
+
+        declaration, body = expr.inline
+        inlined: Code = body.accept(self)
+
+        def inline_call(interpreter, frame, upvalues):
+            function = callee(interpreter, frame, upvalues)
+            if type(function) is CompiledFunction and function.code.declaration == declaration:
+                return inlined(interpreter, frame, upvalues)
+            return call(interpreter, frame, upvalues, function)
+
+        return inline_call
+
+    def visit_get_expr(self, expr: Get) -> Code:
+        object_: Code = expr.object.accept(self)
+        name: Token = expr.name
+
+        def get(interpreter, frame, upvalues):
+            instance = object_(interpreter, frame, upvalues)
+            if isinstance(instance, LoxInstance):
+                return instance.get(name)
+
+            raise LoxRuntimeError(name, "Only instances have properties.")
+
+        return get
+
+    def visit_set_expr(self, expr: Set) -> Code:
+        object_: Code = expr.object.accept(self)
+        value: Code = expr.value.accept(self)
+        name: Token = expr.name
+
+        def set(interpreter, frame, upvalues):
+            instance = object_(interpreter, frame, upvalues)
+
+            if not isinstance(instance, LoxInstance):
+                raise LoxRuntimeError(name, "Only instances have fields.")
+
+            result = value(interpreter, frame, upvalues)
+            instance.set(name, result)
+            return result
+
+        return set
+
+    def visit_super_expr(self, expr: Super) -> Code:
+        superclass: Code = self.variable(expr.keyword, expr)
+        this: Code = self.variable(expr.this.keyword, expr.this)
+        method_name: Token = expr.method
+
+        def super_(interpreter, frame, upvalues):
+            klass: LoxClass = superclass(interpreter, frame, upvalues)
+            instance: LoxInstance = this(interpreter, frame, upvalues)
+            method: CompiledFunction = klass.find_method(method_name.lexeme)
+
+            if method is None:
+                raise LoxRuntimeError(
+                    method_name, f'Undefined property "{method_name.lexeme}".'
+                )
+
+            return method.bind(instance)
+
+        return super_
+
+    def visit_expression_stmt(self, stmt: Expression) -> Code:
+        expression: Code = stmt.expression.accept(self)
+
+        def statement(interpreter, frame, upvalues):
+            expression(interpreter, frame, upvalues)
+
+        return statement
+
+    def visit_var_stmt(self, stmt: Var) -> Code:
+        if stmt.initializer is not None:
+            initializer: Code = stmt.initializer.accept(self)
+        else:
+            initializer = self.visit_literal_expr(Literal(None))
+        return self.define(stmt, initializer)
+
+    def define(self, stmt: Var | Function | Class, value: Code) -> Code:
+        # Stores what value evaluates to as the declared variable
+        slot: int = stmt.slot
+        if slot is None:
+            name: str = stmt.name.lexeme
+
+            def global_(interpreter, frame, upvalues):
+                interpreter.globals.define(name, value(interpreter, frame, upvalues))
+            return global_
+        if stmt.captured:
+            # A new cell on every run, as in the tree-walker
+            def cell(interpreter, frame, upvalues):
+                frame[slot] = Cell(value(interpreter, frame, upvalues))
+            return cell
+
+        def local(interpreter, frame, upvalues):
+            frame[slot] = value(interpreter, frame, upvalues)
+
+        return local
+
+    def visit_function_stmt(self, stmt: Function) -> Code:
+        closure: Code = self.closure(stmt, False)
+        if stmt.captured:
+            slot: int = stmt.slot
+
+            def recursive(interpreter, frame, upvalues):
+                # The closure may capture its own cell, so it is made first
+                cell: Cell = Cell(None)
+                frame[slot] = cell
+                cell.value = closure(interpreter, frame, upvalues)
+            return recursive
+
+        return self.define(stmt, closure)
+
+    def closure(self, declaration: Function, is_initializer: bool) -> Code:
+        # Makes a CompiledFunction, capturing the cells the declaration uses
+        code: FunctionCode = FunctionCode(declaration)
+        captures: tuple[tuple[bool, int], ...] = tuple(declaration.upvalues)
+
+        def closure(interpreter, frame, upvalues):
+            return CompiledFunction(
+                code,
+                [frame[index] if is_local else upvalues[index] for is_local, index in captures],
+                is_initializer,
+            )
+
+        return closure
+
+    def visit_return_stmt(self, stmt: Return) -> Code:
+        if stmt.value is None:
+            def return_nil(interpreter, frame, upvalues):
+                return RETURN_NIL
+            return return_nil
+
+        value: Code = stmt.value.accept(self)
+
+        def return_(interpreter, frame, upvalues):
+            return (value(interpreter, frame, upvalues),)
+
+        return return_
+
+    def visit_while_stmt(self, stmt: While) -> Code:
+        condition: Code = stmt.condition.accept(self)
+        body: Code = stmt.body.accept(self)
+
+        def while_(interpreter, frame, upvalues):
+            try:
+                while True:
+                    value = condition(interpreter, frame, upvalues)
+                    if value is None or value is False:
+                        return None
+                    completion = body(interpreter, frame, upvalues)
+                    if completion is not None:
+                        if completion is BREAK:
+                            return None
+                        return completion
+            except LoxBreakException:
+                # A break in a function called from the loop
+                return None
+
+        return while_
+
+    def visit_break_stmt(self, stmt: Break) -> Code:
+        def break_(interpreter, frame, upvalues):
+            return BREAK
+
+        return break_
+
+    def visit_block_stmt(self, stmt: Block) -> Code:
+        return self.compile_block(stmt.statements)
+
+    def visit_if_stmt(self, stmt: If) -> Code:
+        condition: Code = stmt.condition.accept(self)
+        then_branch: Code = stmt.then_branch.accept(self)
+        if stmt.else_branch is None:
+            def if_(interpreter, frame, upvalues):
+                value = condition(interpreter, frame, upvalues)
+                if value is not None and value is not False:
+                    return then_branch(interpreter, frame, upvalues)
+            return if_
+
+        else_branch: Code = stmt.else_branch.accept(self)
+
+        def if_else(interpreter, frame, upvalues):
+            value = condition(interpreter, frame, upvalues)
+            if value is not None and value is not False:
+                return then_branch(interpreter, frame, upvalues)
+            return else_branch(interpreter, frame, upvalues)
+
+        return if_else
+
+    def visit_class_stmt(self, stmt: Class) -> Code:
+        superclass: Code = None
+        if stmt.superclass is not None:
+            superclass = stmt.superclass.accept(self)
+        superclass_name: Token = stmt.superclass.name if stmt.superclass is not None else None
+        methods: tuple[tuple[str, Code], ...] = tuple(
+            (method.name.lexeme, self.closure(method, method.name.lexeme == "init"))
+            for method in stmt.methods
+        )
+        name: str = stmt.name.lexeme
+        slot: int = stmt.slot
+        captured: bool = stmt.captured
+        super_slot: int = stmt.super_slot
+
+        def class_(interpreter, frame, upvalues):
+            base = None
+            if superclass is not None:
+                base = superclass(interpreter, frame, upvalues)
+                if not isinstance(base, LoxClass):
+                    raise LoxRuntimeError(superclass_name, "Superclass must be a class.")
+
+            # Declared before the methods are made, which may capture it
+            cell: Cell = None
+            if slot is None:
+                interpreter.globals.define(name, None)
+            elif captured:
+                cell = frame[slot] = Cell(None)
+            else:
+                frame[slot] = None
+
+            if base is not None:
+                frame[super_slot] = Cell(base)
+
+            klass: LoxClass = LoxClass(
+                name,
+                base,
+                {method: closure(interpreter, frame, upvalues) for method, closure in methods},
+            )
+            if cell is not None:
+                cell.value = klass
+            elif slot is None:
+                interpreter.globals.define(name, klass)
+            else:
+                frame[slot] = klass
+
+        return class_
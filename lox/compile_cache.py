@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pickle
+import sys
+from typing import Optional
+import token
+import token_type
+import scanner
+import parser
+import expr
+import stmt
+import environment
+import ast_arena
+import resolver
+import optimizer
+import transpiler
+import interpreter
+from program import Program
+
+# Like __pycache__: compiled scripts are stored next to their source as
+# __loxcache__/<name>.loxc, holding the resolved Stmt tree and whatever it
+# was compiled to by the engines in program.PERSISTENT_ENGINES
+
+CACHE_DIRECTORY: str = "__loxcache__"
+MAGIC: bytes = b"LOXC"
+
+# Modules whose code decides what a script compiles to. Editing any of them
+# changes the interpreter version and invalidates every cached script.
+FRONT_END_MODULES: tuple = (
+    token,
+    token_type,
+    scanner,
+    parser,
+    expr,
+    stmt,
+    environment,  # The access codes the resolver stores
+    ast_arena,  # The layout of packed trees
+    resolver,
+    optimizer,
+    transpiler,
+    interpreter,  # What runs the trees, and the caches it keeps on their nodes
+)
+# Likewise, but hashed by name, as they import this module: lox.py decides
+# which of the passes above a script goes through
+FRONT_END_FILES: tuple = ("lox.py",)
+
+_interpreter_version: bytes = None
+
+
+def interpreter_version() -> bytes:
+    global _interpreter_version
+    if _interpreter_version is None:
+        digest = hashlib.sha256(sys.version.encode())
+        directory: str = os.path.dirname(os.path.abspath(__file__))
+        paths: list[str] = [module.__file__ for module in (*FRONT_END_MODULES, sys.modules[__name__])]
+        for path in (*paths, *(os.path.join(directory, name) for name in FRONT_END_FILES)):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+        _interpreter_version = digest.digest()
+    return _interpreter_version
+
+
+def cache_path(path: str) -> str:
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIRECTORY, os.path.splitext(name)[0] + ".loxc")
+
+
+def cache_key(source: bytes, optimize: bool = False) -> bytes:
+    # Header a cache entry must start with to be valid for source, compiled
+    # with or without the optimizer
+    return MAGIC + interpreter_version() + bytes([optimize]) + hashlib.sha256(source).digest()
+
+
+def load(path: str, key: bytes) -> Optional[Program]:
+    # Returns the cached Program for the script at path, or None if there is
+    # no entry for this exact source and interpreter
+    try:
+        with open(cache_path(path), "rb") as file:
+            data: bytes = file.read()
+    except OSError:
+        return None
+
+    if not data.startswith(key):
+        return None
+    try:
+        statements, frame_size, global_slots, compiled = pickle.loads(data[len(key):])
+        program: Program = Program(statements, frame_size, global_slots)
+        program.compiled.update(compiled)
+        return program
+    except Exception:
+        # A truncated or otherwise unreadable entry is just a miss
+        return None
+
+
+def store(path: str, key: bytes, program: Program) -> None:
+    # Caching is best effort: an unwritable directory or a tree too deep to
+    # pickle only means the script gets compiled again next time
+    target: str = cache_path(path)
+    try:
+        data: bytes = key + pickle.dumps(
+            (program.statements, program.frame_size, program.global_slots, program.persistent()),
+            pickle.HIGHEST_PROTOCOL,
+        )
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary: str = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, target)
+    except (OSError, RecursionError, pickle.PicklingError):
+        pass
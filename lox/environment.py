@@ -1,45 +1,116 @@
+from heapq import heappop, heappush
+from threading import Lock
+from weakref import WeakValueDictionary, finalize
 from token import Token
 from exceptions import LoxRuntimeError
 
 
-class Environment:
-    def __init__(self, enclosing: "Environment" = None):
-        self.values: dict = {}
-        self.enclosing: Environment = enclosing
+# How a resolved node reaches its variable (see Variable.access)
+LOCAL = 0  # The value is in a slot of the current frame
+CELL = 1  # A slot of the current frame holds a Cell with the value
+UPVALUE = 2  # One of the current closure's cells holds the value
 
-    def define(self, name: str, value: object) -> None:
-        self.values[name] = value
 
-    def get_at(self, distance: int, name: str) -> object:
-        # Returns the value of the variable in the corrent environment's dict
-        return self.ancestor(distance).values.get(name)
+class Cell:
+    # A local variable closures capture. The frame that declares it and every
+    # closure capturing it share the cell, so they see each other's writes,
+    # and a closure keeps only the cells it uses alive.
+    __slots__ = ("value",)
 
-    def ancestor(self, distance: int) -> "Environment":
-        # Returns the environment at distance away from this environment
-        environment: Environment = self
-        for i in range(distance):
-            environment = environment.enclosing
-        return environment
+    def __init__(self, value: object):
+        self.value: object = value
 
-    def get(self, name: Token) -> object:
-        if name.lexeme in self.values:
-            return self.values.get(name.lexeme)
 
-        if self.enclosing:
-            return self.enclosing.get(name)
+# Every global name gets a slot, the same in every GlobalEnvironment while
+# anything can still use it. A global access caches its name's slot on the
+# node, and since the slot doesn't change the cache can't go stale, even when
+# the REPL redefines the global or another interpreter runs the same tree.
+# Code holds on to the GlobalSlot of each global it names (see
+# Resolver.pin_globals), and environments to those of the globals they
+# define, so once none do, the name is dropped and its slot is reused.
+GLOBAL_SLOTS: WeakValueDictionary = WeakValueDictionary()
+global_slots_lock: Lock = Lock()
+free_slots: list[int] = []  # A heap, so the lowest free slot is reused first
+released_slots: list[int] = []  # Freed, but not yet in free_slots
+next_slot: int = 0
 
-        raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+# What a global slot holds until its name is defined
+UNDEFINED: object = object()
 
-    def assign_at(self, distance: int, name: Token, value: object) -> None:
-        self.ancestor(distance).values[name.lexeme] = value
 
-    def assign(self, name: Token, value: object) -> None:
-        if name.lexeme in self.values:
-            self.values[name.lexeme] = value
-            return
+class GlobalSlot:
+    __slots__ = ("name", "index", "__weakref__")
+
+    def __init__(self, name: str, index: int):
+        self.name: str = name
+        self.index: int = index
+
+    def __reduce__(self):
+        # Slots differ between processes, so the compile cache stores names
+        return global_slot, (self.name,)
+
+
+def global_slot(name: str) -> GlobalSlot:
+    global next_slot
+    slot: GlobalSlot = GLOBAL_SLOTS.get(name)
+    if slot is None:
+        with global_slots_lock:
+            slot = GLOBAL_SLOTS.get(name)
+            if slot is None:
+                # Released from a finalizer, which may run while the lock is
+                # held, so it only appends
+                while released_slots:
+                    heappush(free_slots, released_slots.pop())
+                if free_slots:
+                    index: int = heappop(free_slots)
+                else:
+                    index = next_slot
+                    next_slot += 1
+                slot = GLOBAL_SLOTS[name] = GlobalSlot(name, index)
+                finalize(slot, released_slots.append, index)
+    return slot
+
+
+class GlobalEnvironment:
+    # The global scope. Globals aren't resolved, as they can be defined after
+    # the code that uses them, so they are kept by name, in their global slot.
+    __slots__ = ("values", "slots")
 
-        if self.enclosing:
-            self.enclosing.assign(name, value)
+    def __init__(self):
+        self.values: list = []
+        self.slots: dict[str, GlobalSlot] = {}  # Of the globals values may hold
+
+    def slot(self, name: str) -> int:
+        # The global slot of name, which values is long enough to hold
+        slot: GlobalSlot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = global_slot(name)
+            if slot.index >= len(self.values):
+                self.values.extend([UNDEFINED] * (slot.index + 1 - len(self.values)))
+        return slot.index
+
+    def define(self, name: str, value: object) -> None:
+        self.values[self.slot(name)] = value
+
+    def get(self, name: Token, slot: int) -> object:
+        if slot < len(self.values):
+            value: object = self.values[slot]
+            if value is not UNDEFINED:
+                return value
+
+        raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+
+    def assign(self, name: Token, slot: int, value: object) -> None:
+        if slot < len(self.values) and self.values[slot] is not UNDEFINED:
+            self.values[slot] = value
             return
 
         raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+
+    def to_dict(self) -> dict[str, object]:
+        # The defined globals, by name
+        return {
+            name: self.values[slot.index]
+            for name, slot in list(self.slots.items())
+            if self.values[slot.index] is not UNDEFINED
+        }
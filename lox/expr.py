@@ -2,14 +2,20 @@ from token import Token
 
 
 class Expr:
-    pass
+    __slots__ = ()
 
 
 class Binary(Expr):
+    __slots__ = ("left", "operator", "right", "quick")
+
     def __init__(self, left: Expr, operator: Token, right: Expr):
         self.left = left
         self.operator = operator
         self.right = right
+        # Set by the interpreter on the first run: the operand types seen and
+        # the operation specialized to them, as (left type, right type,
+        # operation), or GENERIC
+        self.quick: tuple = None
 
     def accept(self, visitor):
         return visitor.visit_binary_expr(self)
@@ -19,6 +25,8 @@ class Binary(Expr):
 
 
 class Grouping(Expr):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: Expr):
         self.expression = expression
 
@@ -30,6 +38,8 @@ class Grouping(Expr):
 
 
 class Literal(Expr):
+    __slots__ = ("value",)
+
     def __init__(self, value: object):
         self.value = value
 
@@ -41,9 +51,12 @@ class Literal(Expr):
 
 
 class Unary(Expr):
+    __slots__ = ("operator", "right", "quick")
+
     def __init__(self, operator: Token, right: Expr):
         self.operator = operator
         self.right = right
+        self.quick: tuple = None  # (operand type, operation), as for Binary
 
     def accept(self, visitor):
         return visitor.visit_unary_expr(self)
@@ -53,8 +66,16 @@ class Unary(Expr):
 
 
 class Variable(Expr):
+    __slots__ = ("name", "access", "slot")
+
     def __init__(self, name: Token):
         self.name = name
+        # Where the resolver found the variable: LOCAL or CELL for a slot of
+        # the current frame (holding the value, or a Cell with it), UPVALUE
+        # for one of the current closure's cells. For globals access stays
+        # None and the interpreter caches the global's slot in slot.
+        self.access: int = None
+        self.slot: int = None
 
     def accept(self, visitor):
         return visitor.visit_variable_expr(self)
@@ -64,19 +85,28 @@ class Variable(Expr):
 
 
 class Assign(Expr):
+    __slots__ = ("name", "value", "access", "slot")
+
     def __init__(self, name: Token, value: Expr):
         self.name = name
         self.value = value
+        self.access: int = None  # Set by the resolver for locals, as for Variable
+        self.slot: int = None
 
     def accept(self, visitor):
         return visitor.visit_assign_expr(self)
 
 
 class Logical(Expr):
+    __slots__ = ("left", "operator", "right", "quick")
+
     def __init__(self, left: Expr, operator: Token, right: Expr):
         self.left = left
         self.operator = operator
         self.right = right
+        # The type of left operand seen on the first run, if its values are
+        # truthy exactly when they are True, or GENERIC
+        self.quick: type | tuple = None
 
     def accept(self, visitor):
         return visitor.visit_logical_expr(self)
@@ -86,16 +116,28 @@ class Logical(Expr):
 
 
 class Call(Expr):
+    __slots__ = ("callee", "paren", "arguments", "checked_callee", "inline")
+
     def __init__(self, callee: Expr, paren: Token, arguments: list[Expr]):
         self.callee = callee
         self.paren = paren  # Used to store this token's location to report function call errors better
         self.arguments = arguments
+        # The last callee called here, or for a function its declaration,
+        # which is known to be a callable taking this many arguments
+        self.checked_callee: object = None
+        # Set by the Optimizer when the callee is a global function it could
+        # inline: the function's declaration, and what it returns with the
+        # arguments in place of its parameters. It only stands in for the
+        # call while the callee is a closure of that declaration.
+        self.inline: tuple["Function", Expr] = None
 
     def accept(self, visitor):
         return visitor.visit_call_expr(self)
 
 
 class Get(Expr):
+    __slots__ = ("object", "name")
+
     def __init__(self, object: Expr, name: Token):
         self.object = object
         self.name = name
@@ -105,6 +147,8 @@ class Get(Expr):
 
 
 class Set(Expr):
+    __slots__ = ("object", "name", "value")
+
     def __init__(self, object: Expr, name: Token, value: Expr):
         self.object = object
         self.name = name
@@ -115,17 +159,27 @@ class Set(Expr):
 
 
 class This(Expr):
+    __slots__ = ("keyword", "access", "slot")
+
     def __init__(self, keyword: Token):
         self.keyword = keyword
+        self.access: int = None  # Set by the resolver, as for Variable
+        self.slot: int = None
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_this_expr(self)
 
 
 class Super(Expr):
-    def __init__(self, keyword: Token, method: Token):
+    __slots__ = ("keyword", "method", "this", "access", "slot")
+
+    def __init__(self, keyword: Token, method: Token, this: This = None):
         self.keyword = keyword
         self.method = method
+        # The method found is bound to the enclosing method's "this"
+        self.this = This(keyword) if this is None else this
+        self.access: int = None  # Set by the resolver, as for Variable
+        self.slot: int = None
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_super_expr(self)
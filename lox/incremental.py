@@ -0,0 +1,129 @@
+from bisect import bisect_left
+from typing import Iterator
+from token import Token
+from stmt import Stmt
+from scanner import Scanner
+from parser import Parser
+from exceptions import LoxScannerError
+
+
+class Declaration:
+    # One top-level declaration of a document: the statement parsed from it,
+    # the tokens it was parsed from and the source span those tokens cover
+    def __init__(
+        self, statement: Stmt, tokens: list[Token], start: int, end: int, had_error: bool
+    ):
+        self.statement: Stmt = statement
+        self.tokens: list[Token] = tokens
+        self.start: int = start  # Offset of the first character of the first token
+        self.end: int = end  # Offset just past the last token
+        self.had_error: bool = had_error
+
+
+class IncrementalParser:
+    # Front end for editors: keeps the parse of a whole document and, on each
+    # edit, re-lexes and re-parses only the top-level declarations around the
+    # edit. Every other declaration keeps its tokens and Stmt subtree.
+    def __init__(self, source: str = "", symbols: dict[str, str] = None):
+        self.source: str = source
+        self.symbols: dict[str, str] = {} if symbols is None else symbols
+        self.declarations: list[Declaration] = []
+        self.had_scanner_error: bool = False
+        self.reparse(0, source, 0, 0)
+
+    @property
+    def statements(self) -> list[Stmt]:
+        return [declaration.statement for declaration in self.declarations]
+
+    @property
+    def had_error(self) -> bool:
+        return self.had_scanner_error or any(
+            declaration.had_error for declaration in self.declarations
+        )
+
+    def edit(self, start: int, end: int, text: str) -> None:
+        # Replaces source[start:end] with text
+        source: str = self.source[:start] + text + self.source[end:]
+        if self.had_scanner_error:
+            # The old tokens can't be trusted, so start over
+            self.reparse(0, source, 0, 0)
+            return
+
+        # The first declaration the edit can touch. The one before it is
+        # re-parsed as well, since the parser may have looked one token past
+        # its end (for an "else").
+        first: int = bisect_left(self.declarations, start, key=lambda d: d.end)
+        self.reparse(max(first - 1, 0), source, start + len(text), len(text) - (end - start))
+
+    def reparse(self, first: int, source: str, edit_end: int, delta: int) -> None:
+        # Re-lexes and re-parses source from declaration first onwards, until
+        # a declaration boundary past edit_end lines up with an old one.
+        # delta is how much longer the source got.
+        old: list[Declaration] = self.declarations
+        restart: int = old[first - 1].end if first > 0 else 0
+        line: int = old[first - 1].tokens[-1].line if first > 0 else 1
+
+        scanner: Scanner = Scanner(source, self.symbols)
+        scanner.current = restart
+        scanner.line = line
+        tokens: list[Token] = []
+        spans: list[tuple[int, int]] = []
+
+        def stream() -> Iterator[Token]:
+            for token in scanner.stream_tokens():
+                tokens.append(token)
+                spans.append((scanner.start, scanner.current))
+                yield token
+
+        self.source = source
+        new: list[Declaration] = []
+        tail: list[Declaration] = []
+        try:
+            parser: Parser = Parser(stream())
+            while not parser.is_at_end:
+                begin: int = parser.current
+                next_start: int = spans[begin][0]
+                if next_start >= edit_end:
+                    resync: int = self.find_declaration(next_start - delta, first)
+                    if resync is not None:
+                        tail = old[resync:]
+                        self.shift(tail, delta, parser.peek().line - tail[0].tokens[0].line)
+                        break
+
+                parser.had_error = False
+                statement: Stmt = parser.declaration()
+                new.append(
+                    Declaration(
+                        statement,
+                        tokens[begin:parser.current],
+                        next_start,
+                        spans[parser.current - 1][1],
+                        parser.had_error,
+                    )
+                )
+        except LoxScannerError as error:
+            error.what()
+            self.had_scanner_error = True
+            self.declarations = []
+            return
+
+        self.had_scanner_error = False
+        self.declarations = old[:first] + new + tail
+
+    def find_declaration(self, start: int, first: int) -> int:
+        # Index of the old declaration at or after first that starts at start
+        index: int = bisect_left(self.declarations, start, lo=first, key=lambda d: d.start)
+        if index < len(self.declarations) and self.declarations[index].start == start:
+            return index
+        return None
+
+    @staticmethod
+    def shift(declarations: list[Declaration], delta: int, line_delta: int) -> None:
+        # Moves reused declarations to their place in the edited source. Lines
+        # only change when the edit added or removed newlines.
+        for declaration in declarations:
+            declaration.start += delta
+            declaration.end += delta
+            if line_delta:
+                for token in declaration.tokens:
+                    token.line += line_delta
@@ -1,4 +1,4 @@
-from environment import Environment
+from environment import GlobalEnvironment, Cell, global_slot, UNDEFINED, LOCAL, CELL, UPVALUE
 from lox_callable import LoxCallable
 from stmt import Expression, Stmt, Var, Block, If, While, Break, Function, Return, Class
 from token_type import TokenType
@@ -20,19 +20,88 @@ from expr import (
 )
 from token import Token
 from exceptions import LoxRuntimeError, LoxBreakException, LoxReturnException
+import operator
 import time
-from lox_function import LoxFunction
+from typing import Callable, Optional
+from lox_function import LoxFunction, TailCall
 from lox_class import LoxClass
 from lox_instance import LoxInstance
+from transpiler import transpile_function
+
+# How hot a function gets, in calls plus loop iterations while it runs,
+# before the tiered engine promotes it from the tree-walker to Python
+HOT_THRESHOLD: int = 1000
+# How deep Lox calls may nest under the stack engine, which keeps its frames
+# on the heap rather than on Python's stack
+MAX_DEPTH: int = 10_000
+
+# Operations specialized to the types of their operands, which a Binary or a
+# Unary node is quickened to on its first run when it has one. They give the
+# same results as Interpreter.binary and unary for those types. Division is
+# left out, as it needs to check for zero.
+QUICK_BINARY: dict[tuple[TokenType, type, type], Callable] = {
+    (TokenType.PLUS, float, float): operator.add,
+    (TokenType.PLUS, str, str): operator.add,
+    (TokenType.MINUS, float, float): operator.sub,
+    (TokenType.STAR, float, float): operator.mul,
+    (TokenType.GREATER, float, float): operator.gt,
+    (TokenType.GREATER_EQUAL, float, float): operator.ge,
+    (TokenType.LESS, float, float): operator.lt,
+    (TokenType.LESS_EQUAL, float, float): operator.le,
+    (TokenType.EQUAL_EQUAL, float, float): operator.eq,
+    (TokenType.EQUAL_EQUAL, str, str): operator.eq,
+    (TokenType.EQUAL_EQUAL, bool, bool): operator.eq,
+    (TokenType.BANG_EQUAL, float, float): operator.ne,
+    (TokenType.BANG_EQUAL, str, str): operator.ne,
+    (TokenType.BANG_EQUAL, bool, bool): operator.ne,
+}
+QUICK_UNARY: dict[tuple[TokenType, type], Callable] = {
+    (TokenType.MINUS, float): operator.neg,
+    (TokenType.BANG, bool): operator.not_,
+}
+# Types whose values are truthy exactly when they are True, which a Logical
+# node is quickened to
+QUICK_TRUTHY: tuple[type, ...] = (bool, type(None))
+# What a node is quickened to when it has no specialization, or once its
+# operands' types change. No type is any of its items.
+GENERIC: tuple = (None, None, None)
+
+
+def makes_tail_calls(statements: list[Stmt]) -> bool:
+    # Whether a function body may make tail calls: whether it returns a call
+    # in tail position that hasn't run yet, or last called a Lox function
+    # (rather than a class or a native, which aren't tail calls)
+    for statement in statements:
+        if isinstance(statement, Return) and statement.tail:
+            callee: object = statement.value.checked_callee
+            if callee is None or isinstance(callee, Function):
+                return True
+        if isinstance(statement, Block) and makes_tail_calls(statement.statements):
+            return True
+        if isinstance(statement, If) and makes_tail_calls(
+            [branch for branch in (statement.then_branch, statement.else_branch) if branch is not None]
+        ):
+            return True
+    return False
 
 
 class Interpreter(Visitor):
     def __init__(self):
         self.had_error: bool = False
-        self.globals: Environment = Environment()  # Global scope
-        # Current scope starts as global scope
-        self.environment: Environment = self.globals
-        self.locals: dict = {}
+        self.globals: GlobalEnvironment = GlobalEnvironment()
+        # The slots of the running function's locals (or of top-level code's)
+        # and the cells its closure captured
+        self.frame: list = []
+        self.upvalues: list[Cell] = []
+        # Whether hot functions get promoted, as under the tiered engine,
+        # and the heat that takes
+        self.tiered: bool = False
+        self.hot_threshold: int = HOT_THRESHOLD
+        self.back_edges: int = 0  # Loop iterations run by the tree-walker
+        self.max_depth: int = MAX_DEPTH
+        # Whether returned calls reuse the returning call's Python frame.
+        # Turning it off keeps every call on the stack, for full tracebacks.
+        self.tail_calls: bool = True
 
         class Clock(LoxCallable):
             def arity(self):
@@ -55,34 +124,82 @@ class Interpreter(Visitor):
             def __str__(self):
                 return '<native function "print">'
 
-        self.globals.define("clock", Clock())
-        self.globals.define("print", Print())
-
-    def interpret(self, statements: list[Stmt]) -> None:
+        self.natives: dict = {"clock": Clock(), "print": Print()}
+        self.reset()
+
+    def reset(self, values: dict = None) -> None:
+        # Starts over with a global scope holding only the natives and values,
+        # so the interpreter can be reused to run another program
+        self.had_error = False
+        self.globals = GlobalEnvironment()
+        # Promoted functions' factories, by declaration. They are bound to
+        # the globals, so they go with them.
+        self.factories: dict[Function, Callable] = {}
+        for name, value in (self.natives | (values or {})).items():
+            self.globals.define(name, value)
+
+    def interpret(self, statements: list[Stmt], frame_size: int = 0) -> None:
+        # frame_size is the number of slots top-level code needs for the
+        # locals of its blocks, as returned by Resolver.resolve_script
+        self.had_error = False
+        self.frame = [None] * frame_size
+        self.upvalues = []
         try:
             for statement in statements:
                 self.execute(statement)
         except LoxRuntimeError as error:
             error.what()
+            self.had_error = True
             return
 
+    def run_compiled(self, code: Callable, frame_size: int = 0) -> None:
+        # Runs top-level code that another engine compiled the statements
+        # to, in this interpreter's globals, reporting errors as interpret does
+        self.had_error = False
+        try:
+            code(self, [None] * frame_size, [])
+        except LoxRuntimeError as error:
+            error.what()
+            self.had_error = True
+
     def visit_call_expr(self, expr: Call):
-        callee = self.evaluate(expr.callee)
+        if expr.inline is not None:
+            declaration, body = expr.inline
+            callee = self.evaluate(expr.callee)
+            if type(callee) is LoxFunction and callee.declaration == declaration:
+                return self.evaluate(body)
+            callee, arguments = self.evaluate_call(expr, callee)
+        else:
+            callee, arguments = self.evaluate_call(expr)
+        return callee.call(self, arguments)
+
+    def evaluate_call(self, expr: Call, callee: object = UNDEFINED) -> tuple[LoxCallable, list]:
+        # The callee and the arguments of a call, checked to go together. The
+        # callee is evaluated here unless it is given.
+        if callee is UNDEFINED:
+            callee = self.evaluate(expr.callee)
 
         arguments: list = []
         for argument in expr.arguments:
             arguments.append(self.evaluate(argument))
 
-        if not isinstance(callee, LoxCallable):
-            raise LoxRuntimeError(expr.paren, "Can only call functions and classes.")
+        # A call site nearly always calls the same thing, and a callable's
+        # arity never changes, so the checks only need to pass once for it.
+        # Functions are checked by declaration, which all their closures and
+        # bound methods share, so the node keeps no instance or cell alive.
+        checked: object = callee.declaration if type(callee) is LoxFunction else callee
+        if checked is not expr.checked_callee:
+            if not isinstance(callee, LoxCallable):
+                raise LoxRuntimeError(expr.paren, "Can only call functions and classes.")
 
-        if len(arguments) != callee.arity():
-            raise LoxRuntimeError(
-                expr.paren,
-                f"Expected {callee.arity()} arguments but got {len(arguments)}.",
-            )
+            if len(arguments) != callee.arity():
+                raise LoxRuntimeError(
+                    expr.paren,
+                    f"Expected {callee.arity()} arguments but got {len(arguments)}.",
+                )
+            expr.checked_callee = checked
 
-        return callee.call(self, arguments)
+        return callee, arguments
 
     def visit_get_expr(self, expr: Get):
         object_ = self.evaluate(expr.object)
@@ -109,12 +226,27 @@ class Interpreter(Visitor):
 
     def visit_unary_expr(self, expr: Unary):
         right = self.evaluate(expr.right)
-
-        match expr.operator.type:
+        quick: tuple = expr.quick
+        if quick is not None and type(right) is quick[0]:
+            return quick[1](right)
+        return self.quicken_unary(expr, right)
+
+    def quicken_unary(self, expr: Unary, right: object) -> object:
+        # Runs expr the generic way, quickening it on its first run and going
+        # back to GENERIC when its operand's type changes
+        if expr.quick is None:
+            operation: Callable = QUICK_UNARY.get((expr.operator.type, type(right)))
+            expr.quick = GENERIC if operation is None else (type(right), operation)
+        elif expr.quick is not GENERIC:
+            expr.quick = GENERIC
+        return self.unary(expr.operator, right)
+
+    def unary(self, operator: Token, right: object) -> object:
+        match operator.type:
             case TokenType.BANG:
                 return not self.is_truthy(right)
             case TokenType.MINUS:
-                self.check_number_operand(expr.operator, right)
+                self.check_number_operand(operator, right)
                 return -float(right)
 
         return None
@@ -122,22 +254,37 @@ class Interpreter(Visitor):
     def visit_binary_expr(self, expr: Binary):
         left = self.evaluate(expr.left)
         right = self.evaluate(expr.right)
-
-        match expr.operator.type:
+        quick: tuple = expr.quick
+        if quick is not None and type(left) is quick[0] and type(right) is quick[1]:
+            return quick[2](left, right)
+        return self.quicken_binary(expr, left, right)
+
+    def quicken_binary(self, expr: Binary, left: object, right: object) -> object:
+        # As quicken_unary
+        if expr.quick is None:
+            operation: Callable = QUICK_BINARY.get((expr.operator.type, type(left), type(right)))
+            expr.quick = GENERIC if operation is None else (type(left), type(right), operation)
+        elif expr.quick is not GENERIC:
+            expr.quick = GENERIC
+        return self.binary(expr.operator, left, right)
+
+    def binary(self, operator: Token, left: object, right: object) -> object:
+        # Applies a binary operator to operands already evaluated
+        match operator.type:
             case TokenType.GREATER:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) > float(right)
             case TokenType.GREATER_EQUAL:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) >= float(right)
             case TokenType.LESS:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) < float(right)
             case TokenType.LESS_EQUAL:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) <= float(right)
             case TokenType.MINUS:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) - float(right)
             case TokenType.PLUS:
                 if isinstance(left, float) and isinstance(right, float):
@@ -145,15 +292,15 @@ class Interpreter(Visitor):
                 elif isinstance(left, str) and isinstance(right, str):
                     return str(left) + str(right)
                 raise LoxRuntimeError(
-                    expr.operator, "Operands must be two numbers or two strings."
+                    operator, "Operands must be two numbers or two strings."
                 )
             case TokenType.SLASH:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 if float(right) == 0:
-                    raise LoxRuntimeError(expr.operator, "Cannot divide by zero.")
+                    raise LoxRuntimeError(operator, "Cannot divide by zero.")
                 return float(left) / float(right)
             case TokenType.STAR:
-                self.check_number_operand(expr.operator, left, right)
+                self.check_number_operand(operator, left, right)
                 return float(left) * float(right)
             case TokenType.BANG_EQUAL:
                 return not self.is_equal(left, right)
@@ -169,21 +316,24 @@ class Interpreter(Visitor):
         return self.look_up_variable(expr.name, expr)
 
     def visit_assign_expr(self, expr: Assign) -> Expr:
-        value = self.evaluate(expr.value)
-
-        distance: int = self.locals.get(expr)
-        if distance is not None:
-            self.environment.assign_at(distance, expr.name, value)
+        return self.assign(expr, self.evaluate(expr.value))
+
+    def assign(self, expr: Assign, value: object) -> object:
+        access: int = expr.access
+        if access == LOCAL:
+            self.frame[expr.slot] = value
+        elif access == CELL:
+            self.frame[expr.slot].value = value
+        elif access == UPVALUE:
+            self.upvalues[expr.slot].value = value
         else:
-            self.globals.assign(expr.name, value)
+            self.globals.assign(expr.name, self.global_slot(expr), value)
 
         return value
 
     def visit_super_expr(self, expr: Super):
-        distance: int = self.locals.get(expr)
-        superclass: LoxClass = self.environment.get_at(distance, "super")
-        # The environment where "this" is bound is always right inside the environment where we store "super"
-        object_: LoxInstance = self.environment.get_at(distance - 1, "this")
+        superclass: LoxClass = self.look_up_variable(expr.keyword, expr)
+        object_: LoxInstance = self.look_up_variable(expr.this.keyword, expr.this)
         method: LoxFunction = superclass.find_method(expr.method.lexeme)
 
         if method is None:
@@ -196,13 +346,23 @@ class Interpreter(Visitor):
     def visit_logical_expr(self, expr: Logical):
         left = self.evaluate(expr.left)
 
+        if type(left) is expr.quick:
+            truthy: bool = left is True
+        else:
+            # As quicken_unary
+            if expr.quick is None and type(left) in QUICK_TRUTHY:
+                expr.quick = type(left)
+            elif expr.quick is not GENERIC:
+                expr.quick = GENERIC
+            truthy = self.is_truthy(left)
+
         if expr.operator.type == TokenType.OR:
             # If or statement
-            if self.is_truthy(left):
+            if truthy:
                 return left
         else:
             # If and statement
-            if not self.is_truthy(left):
+            if not truthy:
                 return left
 
         return self.evaluate(expr.right)
@@ -211,10 +371,24 @@ class Interpreter(Visitor):
         self.evaluate(stmt.expression)
 
     def visit_function_stmt(self, stmt: Function) -> None:
-        function: LoxFunction = LoxFunction(stmt, self.environment, False)
-        self.environment.define(stmt.name.lexeme, function)
+        if stmt.captured:
+            # A local function calling itself captures its own cell, so the
+            # cell has to exist before the closure is made
+            cell: Cell = Cell(None)
+            self.frame[stmt.slot] = cell
+            cell.value = self.make_closure(stmt, False)
+        else:
+            self.define(stmt, self.make_closure(stmt, False))
 
     def visit_return_stmt(self, stmt: Return) -> None:
+        if stmt.tail and self.tail_calls:
+            callee, arguments = self.evaluate_call(stmt.value)
+            if type(callee) is LoxFunction and not callee.is_initializer:
+                # Left to the LoxFunction.call returning, to make in place
+                # of the call running now
+                raise LoxReturnException(TailCall(callee, arguments))
+            raise LoxReturnException(callee.call(self, arguments))
+
         value = None
         if stmt.value is not None:
             value = self.evaluate(stmt.value)
@@ -224,6 +398,7 @@ class Interpreter(Visitor):
         try:
             while self.is_truthy(self.evaluate(stmt.condition)):
                 self.execute(stmt.body)
+                self.back_edges += 1
         except LoxBreakException:
             pass
 
@@ -231,14 +406,17 @@ class Interpreter(Visitor):
         raise LoxBreakException()
 
     def visit_block_stmt(self, stmt: Block) -> None:
-        self.execute_block(stmt.statements, Environment(self.environment))
+        # A block's variables have slots in the current frame, so running it
+        # allocates nothing
+        for statement in stmt.statements:
+            self.execute(statement)
 
     def visit_var_stmt(self, stmt: Var) -> None:
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
 
-        self.environment.define(stmt.name.lexeme, value)
+        self.define(stmt, value)
 
     def visit_if_stmt(self, stmt: If) -> None:
         if self.is_truthy(self.evaluate(stmt.condition)):
@@ -255,30 +433,101 @@ class Interpreter(Visitor):
                     stmt.superclass.name, "Superclass must be a class."
                 )
 
-        self.environment.define(stmt.name.lexeme, None)
+        # The class is declared before its methods are made, as they may
+        # capture it
+        cell: Cell = None
+        if stmt.slot is None:
+            self.globals.define(stmt.name.lexeme, None)
+        elif stmt.captured:
+            cell = self.frame[stmt.slot] = Cell(None)
+        else:
+            self.frame[stmt.slot] = None
 
-        if stmt.superclass is not None:
-            self.environment = Environment(self.environment)
-            self.environment.define("super", superclass)
+        if superclass is not None:
+            self.frame[stmt.super_slot] = Cell(superclass)
 
         methods: dict[str, LoxFunction] = {}
         for method in stmt.methods:
-            methods[method.name.lexeme] = LoxFunction(
-                method, self.environment, method.name.lexeme == "init"
-            )
+            methods[method.name.lexeme] = self.make_closure(method, method.name.lexeme == "init")
         klass: LoxClass = LoxClass(stmt.name.lexeme, superclass, methods)
 
-        if superclass is not None:
-            self.environment = self.environment.enclosing
-
-        self.environment.assign(stmt.name, klass)
+        if cell is not None:
+            cell.value = klass
+        else:
+            self.define(stmt, klass)
+
+    def make_closure(self, declaration: Function, is_initializer: bool) -> LoxFunction:
+        # Captures the cells the function uses, from the current frame or
+        # the current closure
+        frame: list = self.frame
+        upvalues: list[Cell] = self.upvalues
+        return LoxFunction(
+            declaration,
+            [frame[index] if is_local else upvalues[index] for is_local, index in declaration.upvalues],
+            is_initializer,
+        )
+
+    def promote(self, function: LoxFunction) -> Optional[Callable]:
+        # Moves a hot function up to the fast tier: its body transpiled to a
+        # Python function, taking "this" first for a method. Returns None,
+        # leaving it on the tree-walker for good, when that can't be done.
+        declaration: Function = function.declaration
+        factory: Callable = self.factories.get(declaration)
+        if factory is None:
+            if self.tail_calls and makes_tail_calls(declaration.body):
+                # Python code can't make tail calls, so recursion that runs
+                # in constant space here would overflow Python's stack there
+                declaration.heat = None
+                return None
+            try:
+                factory = transpile_function(
+                    declaration, function.this is not None, function.is_initializer, self
+                )
+            except (RecursionError, SyntaxError, MemoryError):
+                # Too deeply nested for Python's own compiler
+                declaration.heat = None
+                return None
+            self.factories[declaration] = factory
+        return factory(*function.upvalues)
+
+    def define(self, stmt: Var | Function | Class, value: object) -> None:
+        # Locals are declared in their slot of the current frame. Declaring
+        # a captured one makes a new cell, so each run of a loop body gives
+        # its closures a variable of their own.
+        slot: int = stmt.slot
+        if slot is None:
+            self.globals.define(stmt.name.lexeme, value)
+        elif stmt.captured:
+            self.frame[slot] = Cell(value)
+        else:
+            self.frame[slot] = value
 
     def look_up_variable(self, name: Token, expr: Expr) -> None:
-        distance: int = self.locals.get(expr)
-        if distance is not None:
-            return self.environment.get_at(distance, name.lexeme)
-        else:
-            return self.globals.get(name)
+        access: int = expr.access
+        if access == LOCAL:
+            return self.frame[expr.slot]
+        if access == CELL:
+            return self.frame[expr.slot].value
+        if access == UPVALUE:
+            return self.upvalues[expr.slot].value
+
+        slot: int = expr.slot
+        if slot is None:
+            slot = expr.slot = global_slot(name.lexeme).index
+        values: list = self.globals.values
+        if slot < len(values):
+            value: object = values[slot]
+            if value is not UNDEFINED:
+                return value
+        raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+
+    @staticmethod
+    def global_slot(node: Expr) -> int:
+        # A global's slot, cached on the node that names it. Nodes of globals
+        # are left unresolved, so their slot is free for this.
+        if node.slot is None:
+            node.slot = global_slot(node.name.lexeme).index
+        return node.slot
 
     def check_number_operand(self, operator: Token, *operands: object) -> None:
         for operand in operands:
@@ -307,17 +556,17 @@ class Interpreter(Visitor):
     def execute(self, stmt: Stmt):
         stmt.accept(self)
 
-    def execute_block(self, statements: list[Stmt], environment: Environment) -> None:
-        previous: Environment = self.environment
+    def execute_call(self, statements: list[Stmt], frame: list, upvalues: list[Cell]) -> None:
+        previous_frame: list = self.frame
+        previous_upvalues: list[Cell] = self.upvalues
         try:
-            self.environment = environment
+            self.frame = frame
+            self.upvalues = upvalues
             for statement in statements:
                 self.execute(statement)
         finally:
-            self.environment = previous
-
-    def resolve(self, expr: Expr, depth: int) -> None:
-        self.locals[expr] = depth
+            self.frame = previous_frame
+            self.upvalues = previous_upvalues
 
     def stringify(self, obj) -> str:
         if obj is None:
@@ -332,3 +581,18 @@ class Interpreter(Visitor):
                 text = text[: len(text) - 2]
             return text
         return str(obj)
+
+
+class TieredEngine:
+    # The tree-walker, promoting functions to Python as they get hot, so
+    # nothing is compiled before it is known to be worth it. The top level
+    # only runs once, so it always stays on the tree-walker.
+    def compile(self, statements: list[Stmt]) -> Callable:
+        def script(interpreter: Interpreter, frame: list, upvalues: list[Cell]) -> None:
+            interpreter.tiered = True
+            try:
+                interpreter.execute_call(statements, frame, upvalues)
+            finally:
+                interpreter.tiered = False
+
+        return script
@@ -1,11 +1,15 @@
+import mmap
 import sys
-import typing
+from typing import Optional
+import compile_cache
 from interpreter import Interpreter
-from stmt import Stmt
+from program import Program, ENGINES, PERSISTENT_ENGINES
 from scanner import Scanner
-from token import Token
 from parser import Parser
 from resolver import Resolver
+from ast_arena import AstArena
+from optimizer import Optimizer
+from exceptions import LoxScannerError
 
 
 class Lox:
@@ -15,61 +19,154 @@ class Lox:
     interpreter: Interpreter = Interpreter()
 
     @classmethod
-    def run_file(cls, path: str) -> None:
-        file: typing.TextIO = open(path, "rt")
-        cls.run(file.read())
-        file.close()
+    def run_file(
+        cls, path: str, engine: str = "tree", optimize: bool = False, tail_calls: bool = True
+    ) -> None:
+        # The script is memory-mapped and scanned as bytes, so it is never
+        # decoded (or even read) as a whole before it starts running
+        with open(path, "rb") as file:
+            try:
+                source: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                cls.run_cached(path, b"", engine, optimize, tail_calls)
+            else:
+                with source:
+                    cls.run_cached(path, source, engine, optimize, tail_calls)
         if cls.had_error:
             sys.exit(65)
         if cls.had_runtime_error:
             sys.exit(70)
 
     @classmethod
-    def run_prompt(cls) -> None:
+    def run_prompt(
+        cls, engine: str = "tree", optimize: bool = False, tail_calls: bool = True
+    ) -> None:
         while True:
             line: str = input("Lox > ")
             if not line:
                 break
-            cls.run(line)
+            cls.run(line, engine=engine, optimize=optimize, tail_calls=tail_calls)
             cls.had_error = False
 
     @classmethod
-    def run(cls, source: str) -> None:
+    def run_cached(
+        cls,
+        path: str,
+        source: bytes,
+        engine: str = "tree",
+        optimize: bool = False,
+        tail_calls: bool = True,
+    ) -> None:
+        # Runs the script at path, skipping the front end when the compile
+        # cache has an entry for this source and interpreter version
+        key: bytes = compile_cache.cache_key(source, optimize)
+        program: Optional[Program] = compile_cache.load(path, key)
+        if program is None or (engine in PERSISTENT_ENGINES and engine not in program.compiled):
+            if program is None:
+                program = cls.compile(source, optimize=optimize)
+                if program is None:
+                    return
+            if engine in PERSISTENT_ENGINES:
+                # Compiled before storing, so the next run skips that too
+                program.compile(engine)
+            compile_cache.store(path, key, program)
+
+        cls.execute(program, engine, tail_calls)
+
+    @classmethod
+    def run(
+        cls,
+        source: str | bytes,
+        arena: bool = False,
+        lazy: bool = False,
+        engine: str = "tree",
+        optimize: bool = False,
+        tail_calls: bool = True,
+    ) -> None:
+        # engine picks what runs the program: the tree-walking Interpreter,
+        # or one of program.ENGINES, like "closure". Without tail_calls,
+        # every call stays on the stack, for full stack traces.
+        program: Optional[Program] = cls.compile(source, arena, lazy, optimize)
+        if program is not None:
+            cls.execute(program, engine, tail_calls)
+
+    @classmethod
+    def compile(
+        cls, source: str | bytes, arena: bool = False, lazy: bool = False, optimize: bool = False
+    ) -> Optional[Program]:
+        # Scans, parses and resolves source into a Program, or returns None on
+        # error. Nothing is run, so the Program can be run as often as needed.
+        # With arena, the tree is packed into an AstArena and the statements
+        # returned are views into it. With lazy, function bodies are checked
+        # like the rest but only kept as tokens, their trees being built when
+        # they are first called. An arena needs the whole tree, so it takes
+        # precedence over lazy. With optimize, the resolved tree goes through
+        # the Optimizer, before it is packed.
         scanner: Scanner = Scanner(source)
-        tokens: list[Token] = scanner.scan_tokens()
 
-        if scanner.had_error:
+        # The parser pulls tokens from the scanner as it goes, so the full
+        # token list is never built
+        try:
+            parser: Parser = Parser(scanner.stream_tokens(), lazy=lazy and not arena)
+            statements: list = parser.parse()
+        except LoxScannerError as error:
+            error.what()
             cls.had_error = True
             return
 
-        parser: Parser = Parser(tokens)
-        statements: list[Stmt] = parser.parse()
-
         if parser.had_error:
             cls.had_error = True
             return
 
-        resolver: Resolver = Resolver(cls.interpreter)
-        resolver.resolve_list(statements)
+        if arena and not optimize:
+            statements = AstArena(statements).statements
+
+        resolver: Resolver = Resolver()
+        frame_size: int = resolver.resolve_script(statements)
 
         if resolver.had_error:
             cls.had_error = True
             return
 
-        # print(tokens)
-        # AstPrinter().print(expression)
-        cls.interpreter.interpret(statements)
+        if optimize:
+            statements = Optimizer().optimize(statements)
+            if arena:
+                # Packed as resolved, as the optimizer rewrites the tree
+                statements = AstArena(statements).statements
+
+        return Program(statements, frame_size, resolver.global_slots)
 
-        if cls.interpreter.had_error:
+    @classmethod
+    def execute(cls, program: Program, engine: str = "tree", tail_calls: bool = True) -> None:
+        # Scripts and REPL lines all run in the one shared interpreter, so
+        # each line sees what the ones before it defined
+        if program.run(interpreter=cls.interpreter, engine=engine, tail_calls=tail_calls) is None:
             cls.had_runtime_error = True
-            return
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 2:
-        print("Usage: pylox [script]")
+    arguments: list[str] = sys.argv[1:]
+    engine: str = "tree"
+    optimize: bool = False
+    tail_calls: bool = True
+    while arguments and arguments[0].startswith("--"):
+        option: str = arguments.pop(0)
+        if option.startswith("--engine="):
+            engine = option[len("--engine="):]
+        elif option == "--optimize":
+            optimize = True
+        elif option == "--no-tail-calls":
+            tail_calls = False
+        else:
+            engine = None
+    if len(arguments) > 1 or engine not in ("tree", *ENGINES):
+        print(
+            f"Usage: pylox [--engine={'|'.join(('tree', *ENGINES))}] [--optimize] [--no-tail-calls]"
+            " [script]"
+        )
         sys.exit(64)
-    elif len(sys.argv) == 2:
-        Lox.run_file(sys.argv[1])
+    elif len(arguments) == 1:
+        Lox.run_file(arguments[0], engine, optimize, tail_calls)
     else:
-        Lox.run_prompt()
+        Lox.run_prompt(engine, optimize, tail_calls)
@@ -25,8 +25,9 @@ class LoxClass(LoxCallable):
         return instance
 
     def find_method(self, name: str):
-        if name in self.methods.keys():
-            return self.methods.get(name)
+        method: LoxFunction = self.methods.get(name)
+        if method is not None:
+            return method
         if self.superclass is not None:
             return self.superclass.find_method(name)
         return None
@@ -1,37 +1,99 @@
+from typing import Callable
 from lox_callable import LoxCallable
 from stmt import Function
-from environment import Environment
+from environment import Cell
 from exceptions import LoxReturnException
+from resolver import Resolver
+
+
+class TailCall:
+    # What a return of a call in tail position returns instead of making the
+    # call: the function and arguments, for LoxFunction.call to call next
+    __slots__ = ("function", "arguments")
+
+    def __init__(self, function: "LoxFunction", arguments: list):
+        self.function: LoxFunction = function
+        self.arguments: list = arguments
 
 
 class LoxFunction(LoxCallable):
     def __init__(
-        self, declaration: Function, closure: Environment, is_initializer: bool
+        self,
+        declaration: Function,
+        upvalues: list[Cell],
+        is_initializer: bool,
+        this: "LoxInstance" = None,
+        fast: Cell = None,
     ):
         self.declaration = declaration
-        self.closure = closure
+        # Only the cells of the variables the function uses from enclosing
+        # functions, not the frames they were declared in
+        self.upvalues = upvalues
         self.is_initializer = is_initializer
+        self.this = this  # The instance a method is bound to
+        # The function as the tiered engine promoted it, shared with the
+        # copies bound to instances
+        self.fast = Cell(None) if fast is None else fast
 
     def call(self, interpreter: "Interpreter", arguments: list):
-        environment: Environment = Environment(self.closure)
+        function: LoxFunction = self
+        while True:
+            fast: Callable = function.fast.value
+            if fast is not None:
+                if function.this is not None:
+                    return fast(function.this, *arguments)
+                return fast(*arguments)
+
+            declaration: Function = function.declaration
+            if declaration.body is None:
+                Resolver.resolve_lazy_body(declaration)
+            if interpreter.tiered and declaration.heat is not None:
+                declaration.heat += 1
+                if declaration.heat > interpreter.hot_threshold:
+                    # Calls already running carry on in the tree-walker
+                    function.fast.value = interpreter.promote(function)
+                    if function.fast.value is not None:
+                        continue
+
+            frame: list = function.frame(arguments)
+            back_edges: int = interpreter.back_edges
+            try:
+                interpreter.execute_call(declaration.body, frame, function.upvalues)
+            except LoxReturnException as return_value:
+                value = return_value.value
+                if type(value) is not TailCall:
+                    if function.is_initializer:
+                        return function.this
+                    return value
+                # A call in tail position, made here in place of the one that
+                # returned it, so tail recursion runs in constant space
+                function, arguments = value.function, value.arguments
+                continue
+            finally:
+                if interpreter.tiered and declaration.heat is not None:
+                    # Loops count towards the heat too, so a function called
+                    # only a few times but looping long still gets promoted
+                    declaration.heat += interpreter.back_edges - back_edges
 
-        for i in range(len(self.declaration.params)):
-            environment.define(self.declaration.params[i].lexeme, arguments[i])
-        try:
-            interpreter.execute_block(self.declaration.body, environment)
-        except LoxReturnException as return_value:
-            if self.is_initializer:
-                return self.closure.get_at(0, "this")
-            return return_value.value
+            if function.is_initializer:
+                return function.this
+            return None
 
-        if self.is_initializer:
-            return self.closure.get_at(0, "this")
-        return None
+    def frame(self, arguments: list) -> list:
+        # The frame is "this" (for methods), the parameters in order and then
+        # the body's locals, so the arguments list (built fresh for every
+        # call) becomes the frame
+        if self.this is not None:
+            arguments.insert(0, self.this)
+        size: int = self.declaration.size
+        if size > len(arguments):
+            arguments.extend([None] * (size - len(arguments)))
+        for slot in self.declaration.cells:
+            arguments[slot] = Cell(arguments[slot])
+        return arguments
 
     def bind(self, instance: "LoxInstance") -> "LoxFunction":
-        environment: Environment = Environment(self.closure)
-        environment.define("this", instance)
-        return LoxFunction(self.declaration, environment, self.is_initializer)
+        return LoxFunction(self.declaration, self.upvalues, self.is_initializer, instance, self.fast)
 
     def arity(self) -> int:
         return len(self.declaration.params)
@@ -1,4 +1,5 @@
 from token import Token
+from environment import UNDEFINED
 from exceptions import LoxRuntimeError
 from lox_function import LoxFunction
 
@@ -9,10 +10,13 @@ class LoxInstance:
         self.fields: dict = {}
 
     def get(self, name: Token):
-        if name.lexeme in self.fields:
-            return self.fields.get(name.lexeme)
+        lexeme: str = name.lexeme
+        # One lookup, as fields may hold nil
+        value: object = self.fields.get(lexeme, UNDEFINED)
+        if value is not UNDEFINED:
+            return value
 
-        method: LoxFunction = self.klass.find_method(name.lexeme)
+        method: LoxFunction = self.klass.find_method(lexeme)
         if method is not None:
             return method.bind(self)
 
@@ -0,0 +1,448 @@
+from stmt import Expression, Stmt, Var, Block, If, While, Break, Function, Return, Class
+from visitor import Visitor
+from expr import (
+    Expr,
+    Literal,
+    Grouping,
+    Unary,
+    Binary,
+    Variable,
+    Assign,
+    Logical,
+    Call,
+    Get,
+    Set,
+    This,
+    Super,
+)
+from token_type import TokenType
+from environment import LOCAL
+from exceptions import LoxRuntimeError
+from interpreter import Interpreter
+
+# How many nodes the expression a function returns may have for calls of the
+# function to be inlined
+INLINE_SIZE: int = 16
+
+
+class ConstantLocals(Visitor):
+    # Finds the local variables that are never assigned after their
+    # declaration, and which declaration each local read refers to, by
+    # following the same scopes as the Resolver
+    def __init__(self):
+        self.scopes: list[dict[str, Var]] = []  # None for locals that aren't Vars
+        self.declarations: dict[Variable, Var] = {}
+        self.assigned: set[Var] = set()
+        self.assigned_globals: set[str] = set()
+
+    def find(self, statements: list[Stmt]) -> None:
+        for statement in statements:
+            statement.accept(self)
+
+    def resolve(self, node: Expr | Stmt) -> None:
+        if node is not None:
+            node.accept(self)
+
+    def look_up(self, name: str) -> Var:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def declare(self, name: str, declaration: Var = None) -> None:
+        if self.scopes:
+            self.scopes[-1][name] = declaration
+
+    def visit_block_stmt(self, stmt: Block) -> None:
+        self.scopes.append({})
+        self.find(stmt.statements)
+        self.scopes.pop()
+
+    def visit_var_stmt(self, stmt: Var) -> None:
+        self.resolve(stmt.initializer)
+        self.declare(stmt.name.lexeme, stmt)
+
+    def visit_function_stmt(self, stmt: Function) -> None:
+        self.declare(stmt.name.lexeme)
+        self.function(stmt)
+
+    def function(self, stmt: Function) -> None:
+        if stmt.body is None:
+            # What a lazily parsed body assigns isn't known before it is
+            # parsed, so nothing it can see is a constant
+            for scope in self.scopes:
+                self.assigned.update(declaration for declaration in scope.values() if declaration)
+            return
+        self.scopes.append({param.lexeme: None for param in stmt.params})
+        self.find(stmt.body)
+        self.scopes.pop()
+
+    def visit_class_stmt(self, stmt: Class) -> None:
+        self.declare(stmt.name.lexeme)
+        self.resolve(stmt.superclass)
+        for method in stmt.methods:
+            self.function(method)
+
+    def visit_variable_expr(self, expr: Variable) -> None:
+        if expr.access is not None:
+            declaration: Var = self.look_up(expr.name.lexeme)
+            if declaration is not None:
+                self.declarations[expr] = declaration
+
+    def visit_assign_expr(self, expr: Assign) -> None:
+        self.resolve(expr.value)
+        if expr.access is None:
+            self.assigned_globals.add(expr.name.lexeme)
+        else:
+            declaration: Var = self.look_up(expr.name.lexeme)
+            if declaration is not None:
+                self.assigned.add(declaration)
+
+    def visit_expression_stmt(self, stmt: Expression) -> None:
+        self.resolve(stmt.expression)
+
+    def visit_if_stmt(self, stmt: If) -> None:
+        self.resolve(stmt.condition)
+        self.resolve(stmt.then_branch)
+        self.resolve(stmt.else_branch)
+
+    def visit_while_stmt(self, stmt: While) -> None:
+        self.resolve(stmt.condition)
+        self.resolve(stmt.body)
+
+    def visit_return_stmt(self, stmt: Return) -> None:
+        self.resolve(stmt.value)
+
+    def visit_break_stmt(self, stmt: Break) -> None:
+        return None
+
+    def visit_binary_expr(self, expr: Binary) -> None:
+        self.resolve(expr.left)
+        self.resolve(expr.right)
+
+    def visit_logical_expr(self, expr: Logical) -> None:
+        self.resolve(expr.left)
+        self.resolve(expr.right)
+
+    def visit_unary_expr(self, expr: Unary) -> None:
+        self.resolve(expr.right)
+
+    def visit_grouping_expr(self, expr: Grouping) -> None:
+        self.resolve(expr.expression)
+
+    def visit_call_expr(self, expr: Call) -> None:
+        self.resolve(expr.callee)
+        for argument in expr.arguments:
+            self.resolve(argument)
+
+    def visit_get_expr(self, expr: Get) -> None:
+        self.resolve(expr.object)
+
+    def visit_set_expr(self, expr: Set) -> None:
+        self.resolve(expr.object)
+        self.resolve(expr.value)
+
+    def visit_literal_expr(self, expr: Literal) -> None:
+        return None
+
+    def visit_this_expr(self, expr: This) -> None:
+        return None
+
+    def visit_super_expr(self, expr: Super) -> None:
+        return None
+
+
+class Inliner(Visitor):
+    # Copies the expression a small function returns, with the arguments of
+    # a call in place of its parameters, or returns None if it can't be
+    # inlined. Only expressions without calls or assignments can be, which
+    # keeps inlined functions from being recursive, and arguments need to
+    # be literals or locals, which can be read any number of times, or not
+    # at all, with the same result.
+    def __init__(self, arguments: list[Expr]):
+        self.arguments: list[Expr] = arguments
+        self.size: int = 0
+
+    def inline(self, declaration: Function) -> Expr:
+        if any(not self.is_argument(argument) for argument in self.arguments):
+            return None
+        if not declaration.body:
+            return Literal(None)
+        if len(declaration.body) != 1 or not isinstance(declaration.body[0], Return):
+            return None
+        if declaration.body[0].value is None:
+            return Literal(None)
+        return self.copy(declaration.body[0].value)
+
+    def is_argument(self, argument: Expr) -> bool:
+        return isinstance(argument, Literal) or (
+            isinstance(argument, (Variable, This)) and argument.access is not None
+        )
+
+    def copy(self, expr: Expr) -> Expr:
+        self.size += 1
+        if expr is None or self.size > INLINE_SIZE:
+            return None
+        return expr.accept(self)
+
+    def copy_local(self, expr: Variable | This) -> Expr:
+        copy: Variable | This = type(expr)(expr.name if isinstance(expr, Variable) else expr.keyword)
+        copy.access = expr.access
+        copy.slot = expr.slot
+        return copy
+
+    def visit_literal_expr(self, expr: Literal) -> Expr:
+        return Literal(expr.value)
+
+    def visit_grouping_expr(self, expr: Grouping) -> Expr:
+        return self.copy(expr.expression)
+
+    def visit_unary_expr(self, expr: Unary) -> Expr:
+        right: Expr = self.copy(expr.right)
+        return None if right is None else Unary(expr.operator, right)
+
+    def visit_binary_expr(self, expr: Binary) -> Expr:
+        left: Expr = self.copy(expr.left)
+        right: Expr = self.copy(expr.right)
+        if left is None or right is None:
+            return None
+        return Binary(left, expr.operator, right)
+
+    def visit_logical_expr(self, expr: Logical) -> Expr:
+        left: Expr = self.copy(expr.left)
+        right: Expr = self.copy(expr.right)
+        if left is None or right is None:
+            return None
+        return Logical(left, expr.operator, right)
+
+    def visit_get_expr(self, expr: Get) -> Expr:
+        object_: Expr = self.copy(expr.object)
+        return None if object_ is None else Get(object_, expr.name)
+
+    def visit_variable_expr(self, expr: Variable) -> Expr:
+        if expr.access is None:
+            return Variable(expr.name)
+        if expr.access == LOCAL:
+            # A parameter, as the body declares nothing else, and functions
+            # have no "this" before them
+            argument: Expr = self.arguments[expr.slot]
+            if isinstance(argument, Literal):
+                return Literal(argument.value)
+            return self.copy_local(argument)
+        return None
+
+    def visit_assign_expr(self, expr: Assign) -> Expr:
+        return None
+
+    def visit_call_expr(self, expr: Call) -> Expr:
+        return None
+
+    def visit_set_expr(self, expr: Set) -> Expr:
+        return None
+
+    def visit_this_expr(self, expr: This) -> Expr:
+        return None
+
+    def visit_super_expr(self, expr: Super) -> Expr:
+        return None
+
+
+class Optimizer(Visitor):
+    # Rewrites a resolved tree into one that does less at runtime, with the
+    # same output and the same runtime errors: constant operations are
+    # folded, unless they would fail, groupings are dropped, locals never
+    # assigned after a constant initializer are replaced by their value,
+    # branches that can't be taken are removed, and so are statements after
+    # a return or a break. Calls of small top-level functions that are only
+    # declared once and never assigned get an inlined copy of the function,
+    # which the engines run in place of the call as long as the global still
+    # holds it. Each visit returns the node to replace the one visited, or
+    # None for a statement to drop.
+    def __init__(self):
+        # Folding applies operators just as running the tree would
+        self.interpreter: Interpreter = Interpreter()
+        self.locals: ConstantLocals = ConstantLocals()
+        self.constants: dict[Var, object] = {}
+        self.functions: dict[str, Function] = {}  # Global functions to inline calls of
+
+    def optimize(self, statements: list[Stmt]) -> list[Stmt]:
+        self.locals.find(statements)
+        self.find_functions(statements)
+        return self.optimize_list(statements)
+
+    def find_functions(self, statements: list[Stmt]) -> None:
+        declared: set[str] = set()
+        for statement in statements:
+            if isinstance(statement, (Var, Function, Class)):
+                name: str = statement.name.lexeme
+                if name in declared:
+                    self.functions.pop(name, None)
+                elif isinstance(statement, Function) and statement.body is not None:
+                    self.functions[name] = statement
+                declared.add(name)
+        for name in self.locals.assigned_globals:
+            self.functions.pop(name, None)
+
+    def optimize_list(self, statements: list[Stmt]) -> list[Stmt]:
+        optimized: list[Stmt] = []
+        for statement in statements:
+            statement = statement.accept(self)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if isinstance(statement, (Return, Break)):
+                break
+        return optimized
+
+    def branch(self, stmt: Stmt) -> Stmt:
+        # The body of an if or a while, which can't be dropped
+        optimized: Stmt = stmt.accept(self)
+        return Block([]) if optimized is None else optimized
+
+    def fold(self, expr: Expr, apply, *operands: Literal) -> Expr:
+        # The Literal apply returns for the operands' values, or expr itself
+        # when it raises, so the error is still raised when it runs
+        try:
+            return Literal(apply(*(operand.value for operand in operands)))
+        except LoxRuntimeError:
+            return expr
+
+    def visit_literal_expr(self, expr: Literal) -> Expr:
+        return expr
+
+    def visit_grouping_expr(self, expr: Grouping) -> Expr:
+        return expr.expression.accept(self)
+
+    def visit_unary_expr(self, expr: Unary) -> Expr:
+        expr.right = expr.right.accept(self)
+        if isinstance(expr.right, Literal):
+            return self.fold(
+                expr, lambda right: self.interpreter.unary(expr.operator, right), expr.right
+            )
+        return expr
+
+    def visit_binary_expr(self, expr: Binary) -> Expr:
+        expr.left = expr.left.accept(self)
+        expr.right = expr.right.accept(self)
+        if isinstance(expr.left, Literal) and isinstance(expr.right, Literal):
+            return self.fold(
+                expr,
+                lambda left, right: self.interpreter.binary(expr.operator, left, right),
+                expr.left,
+                expr.right,
+            )
+        return expr
+
+    def visit_logical_expr(self, expr: Logical) -> Expr:
+        expr.left = expr.left.accept(self)
+        expr.right = expr.right.accept(self)
+        if not isinstance(expr.left, Literal):
+            return expr
+
+        # A constant left operand decides which operand the value is
+        truthy: bool = self.interpreter.is_truthy(expr.left.value)
+        if truthy == (expr.operator.type == TokenType.OR):
+            return expr.left
+        return expr.right
+
+    def visit_variable_expr(self, expr: Variable) -> Expr:
+        declaration: Var = self.locals.declarations.get(expr)
+        if declaration in self.constants:
+            return Literal(self.constants[declaration])
+        return expr
+
+    def visit_assign_expr(self, expr: Assign) -> Expr:
+        expr.value = expr.value.accept(self)
+        return expr
+
+    def visit_call_expr(self, expr: Call) -> Expr:
+        expr.callee = expr.callee.accept(self)
+        expr.arguments = [argument.accept(self) for argument in expr.arguments]
+
+        if isinstance(expr.callee, Variable) and expr.callee.access is None:
+            declaration: Function = self.functions.get(expr.callee.name.lexeme)
+            if declaration is not None and len(declaration.params) == len(expr.arguments):
+                body: Expr = Inliner(expr.arguments).inline(declaration)
+                if body is not None:
+                    expr.inline = (declaration, body.accept(self))
+        return expr
+
+    def visit_get_expr(self, expr: Get) -> Expr:
+        expr.object = expr.object.accept(self)
+        return expr
+
+    def visit_set_expr(self, expr: Set) -> Expr:
+        expr.object = expr.object.accept(self)
+        expr.value = expr.value.accept(self)
+        return expr
+
+    def visit_this_expr(self, expr: This) -> Expr:
+        return expr
+
+    def visit_super_expr(self, expr: Super) -> Expr:
+        return expr
+
+    def visit_expression_stmt(self, stmt: Expression) -> Stmt:
+        stmt.expression = stmt.expression.accept(self)
+        return stmt
+
+    def visit_var_stmt(self, stmt: Var) -> Stmt:
+        if stmt.initializer is not None:
+            stmt.initializer = stmt.initializer.accept(self)
+        # Globals can be defined again, or read before they are defined, so
+        # only locals are propagated
+        if stmt.slot is not None and stmt not in self.locals.assigned:
+            if stmt.initializer is None:
+                self.constants[stmt] = None
+            elif isinstance(stmt.initializer, Literal):
+                self.constants[stmt] = stmt.initializer.value
+        return stmt
+
+    def visit_block_stmt(self, stmt: Block) -> Stmt:
+        stmt.statements = self.optimize_list(stmt.statements)
+        return stmt
+
+    def visit_if_stmt(self, stmt: If) -> Stmt:
+        stmt.condition = stmt.condition.accept(self)
+        if isinstance(stmt.condition, Literal):
+            if self.interpreter.is_truthy(stmt.condition.value):
+                return stmt.then_branch.accept(self)
+            if stmt.else_branch is not None:
+                return stmt.else_branch.accept(self)
+            return None
+
+        stmt.then_branch = self.branch(stmt.then_branch)
+        if stmt.else_branch is not None:
+            stmt.else_branch = stmt.else_branch.accept(self)
+        return stmt
+
+    def visit_while_stmt(self, stmt: While) -> Stmt:
+        stmt.condition = stmt.condition.accept(self)
+        if isinstance(stmt.condition, Literal) and not self.interpreter.is_truthy(
+            stmt.condition.value
+        ):
+            return None
+        stmt.body = self.branch(stmt.body)
+        return stmt
+
+    def visit_break_stmt(self, stmt: Break) -> Stmt:
+        return stmt
+
+    def visit_return_stmt(self, stmt: Return) -> Stmt:
+        if stmt.value is not None:
+            stmt.value = stmt.value.accept(self)
+            if isinstance(stmt.value, Call) and stmt.value.inline is not None:
+                # An inlined call is cheaper than a tail call
+                stmt.tail = False
+        return stmt
+
+    def visit_function_stmt(self, stmt: Function) -> Stmt:
+        # Lazily parsed bodies are left as they are
+        if stmt.body is not None:
+            stmt.body = self.optimize_list(stmt.body)
+        return stmt
+
+    def visit_class_stmt(self, stmt: Class) -> Stmt:
+        for method in stmt.methods:
+            method.accept(self)
+        return stmt
@@ -14,18 +14,54 @@ from expr import (
     This,
     Super,
 )
-from stmt import Stmt, Expression, Var, Block, If, While, Break, Function, Return, Class
+from stmt import (
+    Stmt,
+    Expression,
+    Var,
+    Block,
+    If,
+    While,
+    Break,
+    Function,
+    LazyBody,
+    Return,
+    Class,
+)
 from token_type import TokenType
 from exceptions import LoxParseError
-from typing import Optional
+from typing import Iterable, Iterator, Optional
+from enum import IntEnum
+
+
+class Precedence(IntEnum):
+    # Binding power of infix operators, loosest first
+    NONE = 0
+    ASSIGNMENT = 1  # =
+    OR = 2  # or
+    AND = 3  # and
+    EQUALITY = 4  # == !=
+    COMPARISON = 5  # < > <= >=
+    TERM = 6  # + -
+    FACTOR = 7  # * /
+    UNARY = 8  # ! -
+    CALL = 9  # . ()
 
 
 class Parser:
-    def __init__(self, tokens: list[Token]):
-        self.tokens: list[Token] = tokens
-        self.current: int = 0
+    def __init__(self, tokens: Iterable[Token], lazy: bool = False):
+        # Tokens are pulled one at a time, so they can come straight from
+        # Scanner.stream_tokens. Only the current and previous token are kept.
+        self.tokens: Iterator[Token] = iter(tokens)
+        self.current_token: Token = next(self.tokens)
+        self.previous_token: Token = None
+        self.current: int = 0  # Number of tokens consumed so far
         self.had_error: bool = False
         self.loop_depth: int = 0
+        # Only keep the tokens of function bodies, leaving their trees to be
+        # built on first call. They are still parsed, to report their errors.
+        self.lazy: bool = lazy
+        self.recording: int = 0  # Lazy bodies being parsed, inside each other
+        self.recorded: list[Token] = []  # The tokens consumed while recording
 
     def parse(self) -> Optional[Expr]:
         try:
@@ -133,7 +169,7 @@ class Parser:
             body = While(condition, body)
             if initializer is not None:
                 body = Block([initializer, body])
-                return body
+            return body
         finally:
             self.loop_depth -= 1
 
@@ -185,9 +221,25 @@ class Parser:
         self.consume(TokenType.RIGHT_PAREN, 'Expect ")" after parameters.')
 
         self.consume(TokenType.LEFT_BRACE, 'Expect "{" before ' + kind + " body.")
+        if self.lazy:
+            return Function(name, parameters, None, self.lazy_body())
         body: list[Stmt] = self.block()
         return Function(name, parameters, body)
 
+    def lazy_body(self) -> LazyBody:
+        # Parses a block, keeping its tokens up to and including the closing
+        # brace. Its statements are only kept for the resolver to check.
+        start: int = len(self.recorded)
+        self.recording += 1
+        try:
+            statements: list[Stmt] = self.block()
+        finally:
+            self.recording -= 1
+        tokens: list[Token] = self.recorded[start:]
+        if not self.recording:
+            self.recorded = []
+        return LazyBody(tokens, statements)
+
     def block(self) -> list[Stmt]:
         statements = []
         while not self.check(TokenType.RIGHT_BRACE) and not self.is_at_end:
@@ -196,112 +248,99 @@ class Parser:
         return statements
 
     def expression(self) -> Expr:
-        return self.assignment()
-
-    def assignment(self) -> Expr:
-        expr: Expr = self.or_expr()
-
-        if self.match(TokenType.EQUAL):
-            equals: Token = self.previous()
-            value: Expr = self.assignment()
-
-            if isinstance(expr, Variable):
-                return Assign(expr.name, value)
-            elif isinstance(expr, Get):
-                return Set(expr.object, expr.name, value)
-
-            LoxParseError(equals, "Invalid assignment target.").what()
-
-        return expr
-
-    def or_expr(self) -> Expr:
-        expr: Expr = self.and_expr()
-
-        while self.match(TokenType.OR):
-            operator: Token = self.previous()
-            right: Expr = self.and_expr()
-            expr = Logical(expr, operator, right)
-
-        return expr
-
-    def or_expr(self) -> Expr:
-        expr: Expr = self.equality()
-
-        while self.match(TokenType.AND):
-            operator: Token = self.previous()
-            right: Expr = self.equality()
-            expr = Logical(expr, operator, right)
-
-        return expr
-
-    def equality(self) -> Expr:
-        expr: Expr = self.comparison()
-
-        while self.match(TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL):
-            operator: Token = self.previous()
-            right: Expr = self.comparison()
-            expr = Binary(expr, operator, right)
-
-        return expr
+        return self.parse_precedence(Precedence.ASSIGNMENT)
+
+    def parse_precedence(self, precedence: "Precedence") -> Expr:
+        # Pratt parser: the current token's prefix rule parses an operand, then
+        # infix rules fold operators into it for as long as they bind at least
+        # as tightly as precedence
+        prefix = Parser.prefix_rules.get(self.current_token.type)
+        if prefix is None:
+            raise self.error(self.peek(), "Expect expression.")
+        self.advance()
+        expr: Expr = prefix(self)
 
-    def comparison(self) -> Expr:
-        expr: Expr = self.term()
+        infix_rules: dict = Parser.infix_rules
+        while True:
+            rule: tuple = infix_rules.get(self.current_token.type)
+            if rule is None or rule[0] < precedence:
+                return expr
+            self.advance()
+            expr = rule[1](self, expr)
 
-        while self.match(
-            TokenType.GREATER,
-            TokenType.GREATER_EQUAL,
-            TokenType.LESS,
-            TokenType.LESS_EQUAL,
-        ):
-            operator: Token = self.previous()
-            right: Expr = self.term()
-            expr = Binary(expr, operator, right)
+    def literal(self) -> Expr:
+        # We just consumed the number or string, so we have to go back
+        # and get the previous token's literal
+        return Literal(self.previous_token.literal)
 
-        return expr
+    def false_literal(self) -> Expr:
+        return Literal(False)
 
-    def term(self) -> Expr:
-        expr: Expr = self.factor()
+    def true_literal(self) -> Expr:
+        return Literal(True)
 
-        while self.match(TokenType.MINUS, TokenType.PLUS):
-            operator: Token = self.previous()
-            right: Expr = self.factor()
-            expr = Binary(expr, operator, right)
+    def nil_literal(self) -> Expr:
+        return Literal(None)
 
-        return expr
+    def this(self) -> Expr:
+        return This(self.previous_token)
 
-    def factor(self) -> Expr:
-        expr: Expr = self.unary()
+    def variable(self) -> Expr:
+        return Variable(self.previous_token)
 
-        while self.match(TokenType.SLASH, TokenType.STAR):
-            operator: Token = self.previous()
-            right: Expr = self.unary()
-            expr = Binary(expr, operator, right)
+    def super_(self) -> Expr:
+        keyword: Token = self.previous_token
+        self.consume(TokenType.DOT, 'Expect "." after "super".')
+        method: Token = self.consume(
+            TokenType.IDENTIFIER, "Expect superclass method name."
+        )
+        return Super(keyword, method)
 
-        return expr
+    def grouping(self) -> Expr:
+        expr: Expr = self.expression()
+        self.consume(TokenType.RIGHT_PAREN, 'Expect ")" after expression.')
+        return Grouping(expr)
 
     def unary(self) -> Expr:
-        if self.match(TokenType.BANG, TokenType.MINUS):
-            operator: Token = self.previous()
-            right: Expr = self.unary()
-            return Unary(operator, right)
-
-        return self.call()
-
-    def call(self) -> Expr:
-        expr: Expr = self.primary()  # "Left operand" to the call
-
-        while True:
-            if self.match(TokenType.LEFT_PAREN):
-                expr = self.finish_call(expr)
-            elif self.match(TokenType.DOT):
-                name: Token = self.consume(
-                    TokenType.IDENTIFIER, 'Expect property name after ".".'
-                )
-                expr = Get(expr, name)
-            else:
-                break
-
-        return expr
+        operator: Token = self.previous_token
+        right: Expr = self.parse_precedence(Precedence.UNARY)
+        return Unary(operator, right)
+
+    def binary(self, left: Expr) -> Expr:
+        # Operands on the right bind one level tighter, so operators of the
+        # same precedence associate to the left
+        operator: Token = self.previous_token
+        right: Expr = self.parse_precedence(Parser.infix_rules[operator.type][0] + 1)
+        return Binary(left, operator, right)
+
+    def logical(self, left: Expr) -> Expr:
+        operator: Token = self.previous_token
+        right: Expr = self.parse_precedence(Parser.infix_rules[operator.type][0] + 1)
+        return Logical(left, operator, right)
+
+    def assignment(self, target: Expr) -> Expr:
+        # Assignment is right-associative, so the value is parsed at its own level
+        equals: Token = self.previous_token
+        value: Expr = self.parse_precedence(Precedence.ASSIGNMENT)
+
+        if isinstance(target, Variable):
+            return Assign(target.name, value)
+        elif isinstance(target, Get):
+            return Set(target.object, target.name, value)
+
+        # Reported, but not thrown: the parser isn't confused, so there's no
+        # need to synchronize
+        self.error(equals, "Invalid assignment target.")
+        return target
+
+    def call(self, callee: Expr) -> Expr:
+        return self.finish_call(callee)
+
+    def get(self, object_: Expr) -> Expr:
+        name: Token = self.consume(
+            TokenType.IDENTIFIER, 'Expect property name after ".".'
+        )
+        return Get(object_, name)
 
     def finish_call(self, callee: Expr) -> Expr:
         arguments: list[Expr] = []
@@ -323,34 +362,39 @@ class Parser:
 
         return Call(callee, paren, arguments)
 
-    def primary(self) -> Expr:
-        if self.match(TokenType.FALSE):
-            return Literal(False)
-        elif self.match(TokenType.TRUE):
-            return Literal(True)
-        elif self.match(TokenType.NIL):
-            return Literal(None)
-        elif self.match(TokenType.NUMBER, TokenType.STRING):
-            # We just consumed the number or string in the self.match,
-            # so we have to go back and get the previous token's literal
-            return Literal(self.previous().literal)
-        elif self.match(TokenType.THIS):
-            return This(self.previous())
-        elif self.match(TokenType.IDENTIFIER):
-            return Variable(self.previous())
-        elif self.match(TokenType.SUPER):
-            keyword: Token = self.previous()
-            self.consume(TokenType.DOT, 'Expect "." after "super".')
-            method: Token = self.consume(
-                TokenType.IDENTIFIER, "Expect superclass method name."
-            )
-            return Super(keyword, method)
-        elif self.match(TokenType.LEFT_PAREN):
-            expr: Expr = self.expression()
-            self.consume(TokenType.RIGHT_PAREN, 'Expect ")" after expression.')
-            return Grouping(expr)
-
-        raise self.error(self.peek(), "Expect expression.")
+    # Rules for tokens that can start an expression
+    prefix_rules: dict = {
+        TokenType.NUMBER: literal,
+        TokenType.STRING: literal,
+        TokenType.FALSE: false_literal,
+        TokenType.TRUE: true_literal,
+        TokenType.NIL: nil_literal,
+        TokenType.THIS: this,
+        TokenType.IDENTIFIER: variable,
+        TokenType.SUPER: super_,
+        TokenType.LEFT_PAREN: grouping,
+        TokenType.BANG: unary,
+        TokenType.MINUS: unary,
+    }
+
+    # Precedence and rule for tokens that can follow an operand
+    infix_rules: dict = {
+        TokenType.EQUAL: (Precedence.ASSIGNMENT, assignment),
+        TokenType.OR: (Precedence.OR, logical),
+        TokenType.AND: (Precedence.AND, logical),
+        TokenType.BANG_EQUAL: (Precedence.EQUALITY, binary),
+        TokenType.EQUAL_EQUAL: (Precedence.EQUALITY, binary),
+        TokenType.GREATER: (Precedence.COMPARISON, binary),
+        TokenType.GREATER_EQUAL: (Precedence.COMPARISON, binary),
+        TokenType.LESS: (Precedence.COMPARISON, binary),
+        TokenType.LESS_EQUAL: (Precedence.COMPARISON, binary),
+        TokenType.MINUS: (Precedence.TERM, binary),
+        TokenType.PLUS: (Precedence.TERM, binary),
+        TokenType.SLASH: (Precedence.FACTOR, binary),
+        TokenType.STAR: (Precedence.FACTOR, binary),
+        TokenType.LEFT_PAREN: (Precedence.CALL, call),
+        TokenType.DOT: (Precedence.CALL, get),
+    }
 
     def match(self, *token_types: TokenType) -> bool:
         # If current token is any of token_types, consume current
@@ -402,8 +446,12 @@ class Parser:
 
     def advance(self) -> Token:
         if not self.is_at_end:
+            self.previous_token = self.current_token
+            self.current_token = next(self.tokens)
             self.current += 1
-        return self.previous()
+            if self.recording:
+                self.recorded.append(self.previous_token)
+        return self.previous_token
 
     @property
     def is_at_end(self) -> bool:
@@ -411,8 +459,8 @@ class Parser:
 
     def peek(self) -> Token:
         # Returns current token without consuming it
-        return self.tokens[self.current]
+        return self.current_token
 
     def previous(self) -> Token:
         # Returns most recently consumed token
-        return self.tokens[self.current - 1]
+        return self.previous_token
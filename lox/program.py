@@ -0,0 +1,109 @@
+from typing import Callable, Optional
+from stmt import Stmt
+from environment import GlobalSlot
+from interpreter import Interpreter, TieredEngine
+from closure_compiler import ClosureCompiler
+from bytecode_compiler import BytecodeCompiler
+from transpiler import Transpiler
+from stack_evaluator import StackEngine
+
+# The engines a Program can run on besides the tree-walking Interpreter, by
+# name, each a compiler from the resolved statements to top-level code
+ENGINES: dict[str, type] = {
+    "tiered": TieredEngine,
+    "stack": StackEngine,
+    "closure": ClosureCompiler,
+    "bytecode": BytecodeCompiler,
+    "python": Transpiler,
+}
+# Engines whose compiled code survives pickling, so the compile cache keeps it
+PERSISTENT_ENGINES: tuple[str, ...] = ("python",)
+
+
+class Program:
+    # A scanned, parsed and resolved script, as returned by Lox.compile. It
+    # can be run any number of times, with different globals each time,
+    # without going through the front end again. What it does never changes,
+    # but runs fill in what later runs reuse: the caches on its nodes
+    # (quickened operations, checked callees, heat and global slots), the
+    # trees of lazily parsed bodies, and the code of each engine it runs on.
+    # Threads can run a program at once, each in an interpreter of its own:
+    # every cache is filled by single writes of values any thread would
+    # accept (heat racing only loses a little, delaying promotion), and lazy
+    # bodies are parsed under a lock.
+    __slots__ = ("statements", "frame_size", "global_slots", "pool", "compiled")
+
+    def __init__(
+        self, statements: list[Stmt], frame_size: int, global_slots: tuple[GlobalSlot, ...] = ()
+    ):
+        # The resolver's results are stored on the nodes, so the tree is all
+        # there is to a program, and all of it is freed with the program
+        self.statements: tuple[Stmt, ...] = tuple(statements)
+        self.frame_size: int = frame_size  # Slots for the locals of top-level blocks
+        # Pinned for top-level code, as Resolver.global_slots
+        self.global_slots: tuple[GlobalSlot, ...] = global_slots
+        # Idle interpreters that have run this program before. Popping and
+        # appending are atomic, so threads can run the program at once.
+        self.pool: list[Interpreter] = []
+        # What each engine compiled the program to, when first run on it
+        self.compiled: dict[str, Callable] = {}
+
+    def run(
+        self,
+        globals: dict[str, object] = None,
+        interpreter: Interpreter = None,
+        engine: str = "tree",
+        tail_calls: bool = True,
+    ) -> Optional[dict[str, object]]:
+        # Runs the program with globals defined on top of the natives, and
+        # returns the global variables it ends with, or None if it raised a
+        # runtime error. Unless an interpreter is given, which keeps its state
+        # (as the REPL's does), each run gets a fresh global scope in an
+        # interpreter from the pool. engine is "tree" or one of ENGINES.
+        # Without tail_calls, every call stays on the stack (see
+        # Interpreter.tail_calls).
+        code: Callable = None if engine == "tree" else self.compile(engine)
+        if interpreter is not None:
+            interpreter.tail_calls = tail_calls
+            for name, value in (globals or {}).items():
+                interpreter.globals.define(name, value)
+            return self.interpret(interpreter, code)
+
+        try:
+            interpreter = self.pool.pop()
+        except IndexError:
+            interpreter = Interpreter()
+        interpreter.reset(globals)
+        interpreter.tail_calls = tail_calls
+        try:
+            return self.interpret(interpreter, code)
+        finally:
+            self.pool.append(interpreter)
+
+    def compile(self, engine: str) -> Callable:
+        # The program compiled for engine. It is only compiled once, however
+        # many times it is run.
+        code: Callable = self.compiled.get(engine)
+        if code is None:
+            if engine not in ENGINES:
+                raise ValueError(f'Unknown engine "{engine}".')
+            # Threads compiling at once all go on with the first one's code
+            code = self.compiled.setdefault(engine, ENGINES[engine]().compile(self.statements))
+        return code
+
+    def persistent(self) -> dict[str, Callable]:
+        # The compiled code the compile cache stores along with the program
+        return {
+            engine: code for engine, code in self.compiled.items() if engine in PERSISTENT_ENGINES
+        }
+
+    def interpret(
+        self, interpreter: Interpreter, code: Callable = None
+    ) -> Optional[dict[str, object]]:
+        if code is None:
+            interpreter.interpret(self.statements, self.frame_size)
+        else:
+            interpreter.run_compiled(code, self.frame_size)
+        if interpreter.had_error:
+            return None
+        return interpreter.globals.to_dict()
@@ -15,10 +15,18 @@ from expr import (
     Super,
 )
 from visitor import Visitor
-from stmt import Stmt, Block, Var, Function, Expression, If, Return, While, Class
-from exceptions import LoxStaticError
+from stmt import Stmt, Block, Var, Function, LazyBody, Expression, If, Return, While, Break, Class
+from exceptions import LoxStaticError, LoxParseError, LoxRuntimeError
 from enum import Enum
 from token import Token
+from token_type import TokenType
+from parser import Parser
+from threading import Lock
+from environment import GlobalSlot, global_slot, LOCAL, CELL, UPVALUE
+
+
+# Held while a lazily parsed body is parsed and resolved
+lazy_bodies_lock: Lock = Lock()
 
 
 class ClassType(Enum):
@@ -34,18 +42,93 @@ class FunctionType(Enum):
     INITIALIZER = 3
 
 
+class Local:
+    # A local variable: the function whose frame holds it, its slot there and
+    # whether a closure captures it, in which case its slot holds a Cell
+    __slots__ = ("function", "slot", "captured", "node")
+
+    def __init__(self, function: "FunctionScope", slot: int, node: Stmt = None):
+        self.function: FunctionScope = function
+        self.slot: int = slot
+        self.captured: bool = False
+        self.node: Var | Function | Class = node  # The declaration, if any
+
+
+class FunctionScope:
+    # The frame of a function being resolved (or of top-level code). Every
+    # block in a function shares its frame, so a block needs no environment
+    # of its own; blocks that never run at once share slots.
+    __slots__ = ("enclosing", "node", "slot", "size", "locals", "upvalues", "upvalue_indexes", "references")
+
+    def __init__(self, enclosing: "FunctionScope", node: Function = None):
+        self.enclosing: FunctionScope = enclosing
+        self.node: Function = node
+        self.slot: int = 0  # The next free slot
+        self.size: int = 0
+        self.locals: list[Local] = []
+        # The variables of enclosing functions the function captures, each
+        # as (True, slot) for a slot of the enclosing function's frame or
+        # (False, index) for one of its upvalues
+        self.upvalues: list[tuple[bool, int]] = []
+        self.upvalue_indexes: dict[Local, int] = {}
+        # Accesses to the function's own locals. Whether one is captured is
+        # only known once the whole function is resolved.
+        self.references: list[tuple[Expr, Local]] = []
+
+    def declare(self, node: Stmt = None) -> Local:
+        local: Local = Local(self, self.slot, node)
+        self.locals.append(local)
+        self.slot += 1
+        self.size = max(self.size, self.slot)
+        return local
+
+    def finish(self) -> None:
+        # Writes what was resolved onto the nodes
+        for node, local in self.references:
+            node.access = CELL if local.captured else LOCAL
+            node.slot = local.slot
+        for local in self.locals:
+            if local.node is not None:
+                local.node.slot = local.slot
+                local.node.captured = local.captured
+        self.references = []
+
+
 class Resolver(Visitor):
-    def __init__(self, interpreter: "Interpreter"):
-        self.interpreter = interpreter
+    def __init__(self):
         self.scopes: list[dict[str, bool]] = []
+        self.locals: list[dict[str, Local]] = []  # One for each of scopes
+        # Top-level code has a frame too, for the locals of its blocks
+        self.function_scope: FunctionScope = FunctionScope(None)
         self.current_function = FunctionType.NONE
         self.current_class = ClassType.NONE
+        self.loops: int = 0  # Loops around the code being resolved, in its function
         self.had_error: bool = False
+        self.global_names: set[str] = set()  # The globals the code names
+        self.functions: list[Function] = []  # The functions whose bodies were resolved
+        # Those globals' slots, as pinned by resolve_script
+        self.global_slots: tuple[GlobalSlot, ...] = ()
+
+    def resolve_script(self, statements: list[Stmt]) -> int:
+        # Resolves top-level code, returning the size of its frame
+        self.resolve_list(statements)
+        self.function_scope.finish()
+        self.global_slots = self.pin_globals()
+        return self.function_scope.size
+
+    def pin_globals(self) -> tuple[GlobalSlot, ...]:
+        # The slots of the globals the code names. Every function resolved
+        # holds them, as does the Program of top-level code, so the slots
+        # their nodes cache aren't given to other names while they can run.
+        slots: tuple[GlobalSlot, ...] = tuple(global_slot(name) for name in self.global_names)
+        for function in self.functions:
+            function.globals = slots
+        return slots
 
     def visit_class_stmt(self, stmt: Class) -> None:
         enclosing_class: ClassType = self.current_class
         self.current_class = ClassType.CLASS
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
 
         if stmt.superclass is not None:
@@ -53,22 +136,21 @@ class Resolver(Visitor):
                 LoxStaticError(
                     stmt.superclass.name, "A class can't inherit from itself."
                 ).what()
+                self.had_error = True
             else:
                 self.current_class = ClassType.SUBCLASS
                 self.resolve(stmt.superclass)
 
+            # "super" is a local around the methods, which capture it
             self.begin_scope()
-            self.scopes[-1]["super"] = True
+            stmt.super_slot = self.declare_implicit("super").slot
 
-        self.begin_scope()
-        self.scopes[-1]["this"] = True
         for method in stmt.methods:
             declaration: FunctionType = FunctionType.METHOD
             if method.name.lexeme == "init":
                 declaration = FunctionType.INITIALIZER
 
             self.resolve_function(method, declaration)
-        self.end_scope()
 
         if stmt.superclass is not None:
             self.end_scope()
@@ -81,13 +163,13 @@ class Resolver(Visitor):
         self.end_scope()
 
     def visit_var_stmt(self, stmt: Var) -> None:
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
 
     def visit_function_stmt(self, stmt: Function) -> None:
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
         self.resolve_function(stmt, FunctionType.FUNCTION)
 
@@ -97,9 +179,14 @@ class Resolver(Visitor):
         if stmt.else_branch is not None:
             self.resolve(stmt.else_branch)
 
-    def visit_while_Stmt(self, stmt: While) -> None:
+    def visit_while_stmt(self, stmt: While) -> None:
         self.resolve(stmt.condition)
+        self.loops += 1
         self.resolve(stmt.body)
+        self.loops -= 1
+
+    def visit_break_stmt(self, stmt: Break) -> None:
+        return None
 
     def visit_return_stmt(self, stmt: Return) -> None:
         if self.current_function == FunctionType.NONE:
@@ -112,6 +199,14 @@ class Resolver(Visitor):
                 ).what()
                 self.had_error = True
             self.resolve(stmt.value)
+            # A call whose value is returned as is can be made in place of
+            # the function returning it. Not from inside a loop, though: a
+            # break out of the callee must still end that loop.
+            stmt.tail = (
+                isinstance(stmt.value, Call)
+                and self.loops == 0
+                and self.current_function != FunctionType.NONE
+            )
 
     def visit_expression_stmt(self, stmt: Expression) -> None:
         self.resolve(stmt.expression)
@@ -137,11 +232,18 @@ class Resolver(Visitor):
             LoxStaticError(
                 expr.keyword, 'Can\'t use "super" outside of a class.'
             ).what()
+            self.had_error = True
+            return
         elif self.current_class != ClassType.SUBCLASS:
             LoxStaticError(
                 expr.keyword, 'Can\'t use "super" in a class with no superclass.'
             ).what()
+            self.had_error = True
+            return
         self.resolve_local(expr, expr.keyword)
+        # The method is bound to the "this" of the enclosing method. The node
+        # carries the "super" token, so it is looked up by name.
+        self.resolve_local(expr.this, Token(TokenType.THIS, "this", None, expr.keyword.line))
 
     def visit_call_expr(self, expr: Call) -> None:
         self.resolve(expr.callee)
@@ -158,6 +260,7 @@ class Resolver(Visitor):
     def visit_this_expr(self, expr: This) -> None:
         if self.current_class == ClassType.NONE:
             LoxStaticError(expr.keyword, 'Can\'t use "this" outside of a class.').what()
+            self.had_error = True
             return
         self.resolve_local(expr, expr.keyword)
 
@@ -182,31 +285,157 @@ class Resolver(Visitor):
         obj.accept(self)
 
     def resolve_function(self, function: Function, function_type: FunctionType) -> None:
+        if function.body is None:
+            # Lazily parsed: keep what the body will need to be resolved on
+            # its first call. The scopes are copied, as names declared after
+            # the function aren't visible to it. What the body will capture
+            # isn't known, and its closure is made before it is parsed, so it
+            # captures every local in sight.
+            function_scope: FunctionScope = FunctionScope(self.function_scope, function)
+            for scope, locals in zip(self.scopes, self.locals):
+                for name in scope:
+                    self.upvalue(function_scope, locals[name])
+            function.upvalues = tuple(function_scope.upvalues)
+
+            lazy_body: LazyBody = function.lazy_body
+            lazy_body.scopes = [dict(scope) for scope in self.scopes]
+            lazy_body.locals = [dict(locals) for locals in self.locals]
+            lazy_body.function_scope = function_scope
+            lazy_body.function_type = function_type
+            lazy_body.class_type = self.current_class
+
+            # The body is resolved now as well, in copies of all that, so its
+            # errors are reported with the rest of the script's
+            checker: Resolver = Resolver()
+            checker.scopes = [dict(scope) for scope in self.scopes]
+            checker.locals = [dict(locals) for locals in self.locals]
+            checker.current_class = self.current_class
+            checker_scope: FunctionScope = FunctionScope(self.function_scope, function)
+            checker_scope.upvalues = list(function_scope.upvalues)
+            checker_scope.upvalue_indexes = dict(function_scope.upvalue_indexes)
+            checked: Function = Function(function.name, function.params, lazy_body.statements)
+            checker.resolve_body(checked, function_type, checker_scope)
+            self.had_error = self.had_error or checker.had_error
+            lazy_body.statements = None
+            return
+
+        self.resolve_body(function, function_type, FunctionScope(self.function_scope, function))
+
+    def resolve_body(
+        self, function: Function, function_type: FunctionType, function_scope: FunctionScope
+    ) -> None:
         enclosing_function: FunctionType = self.current_function
+        enclosing_scope: FunctionScope = self.function_scope
+        enclosing_loops: int = self.loops
         self.current_function = function_type
+        self.loops = 0
+        self.function_scope = function_scope
+        self.functions.append(function)
         self.begin_scope()
+        is_method: bool = function_type in (FunctionType.METHOD, FunctionType.INITIALIZER)
+        if is_method:
+            # Methods get the instance they are bound to in slot 0
+            self.declare_implicit("this")
         for param in function.params:
             self.declare(param)
             self.define(param)
         self.resolve_list(function.body)
         self.end_scope()
+
+        function_scope.finish()
+        function.size = function_scope.size
+        function.upvalues = tuple(function_scope.upvalues)
+        # Parameters (and "this") that closures capture are moved into cells
+        # on each call
+        parameters: list[Local] = function_scope.locals[:len(function.params) + is_method]
+        function.cells = tuple(local.slot for local in parameters if local.captured)
         # When we're done resolving the function body, restore the current function
         # to the enclosing function
+        self.function_scope = enclosing_scope
         self.current_function = enclosing_function
-
-    def resolve_local(self, expr: Expr, name: Token) -> None:
+        self.loops = enclosing_loops
+
+    @staticmethod
+    def resolve_lazy_body(function: Function) -> list[Stmt]:
+        # Parses and resolves a lazily parsed function body, in the scopes
+        # recorded when the function itself was resolved. Threads running
+        # the function at once take turns, and only the first resolves it.
+        with lazy_bodies_lock:
+            if function.body is not None:
+                return function.body
+            lazy_body: LazyBody = function.lazy_body
+            end: Token = lazy_body.tokens[-1]
+            tokens: list[Token] = [*lazy_body.tokens, Token(TokenType.EOF, "", None, end.line)]
+            parser: Parser = Parser(tokens, lazy=True)
+            try:
+                body: list[Stmt] = parser.block()
+            except LoxParseError:
+                parser.had_error = True
+            if parser.had_error:
+                raise LoxRuntimeError(function.name, f'Invalid body in function "{function.name.lexeme}".')
+
+            resolver: Resolver = Resolver()
+            resolver.scopes = lazy_body.scopes
+            resolver.locals = lazy_body.locals
+            resolver.current_class = lazy_body.class_type
+            parsed: Function = Function(function.name, function.params, body)
+            resolver.resolve_body(parsed, lazy_body.function_type, lazy_body.function_scope)
+            if resolver.had_error:
+                raise LoxRuntimeError(function.name, f'Invalid body in function "{function.name.lexeme}".')
+
+            function.size = parsed.size
+            function.cells = parsed.cells
+            function.globals = resolver.pin_globals()
+            function.body = body
+            function.lazy_body = None
+            return body
+
+    def resolve_local(self, node: Expr, name: Token) -> None:
+        # Records where the variable lives on the node itself: a slot of the
+        # current frame, or one of the current function's upvalues. Globals
+        # are left unresolved.
         for i in range(len(self.scopes) - 1, -1, -1):
             if name.lexeme in self.scopes[i]:
-                self.interpreter.resolve(expr, len(self.scopes) - 1 - i)
+                local: Local = self.locals[i][name.lexeme]
+                if local.function is self.function_scope:
+                    self.function_scope.references.append((node, local))
+                else:
+                    node.access = UPVALUE
+                    node.slot = self.upvalue(self.function_scope, local)
                 return
+        self.global_names.add(name.lexeme)
+
+    def upvalue(self, function_scope: FunctionScope, local: Local) -> int:
+        # The index of local among the upvalues of the function, adding it,
+        # and to every function in between, if needed
+        index: int = function_scope.upvalue_indexes.get(local)
+        if index is None:
+            if local.function is function_scope.enclosing:
+                local.captured = True
+                upvalue: tuple[bool, int] = (True, local.slot)
+            else:
+                upvalue = (False, self.upvalue(function_scope.enclosing, local))
+            index = function_scope.upvalue_indexes[local] = len(function_scope.upvalues)
+            function_scope.upvalues.append(upvalue)
+        return index
 
     def begin_scope(self) -> None:
         self.scopes.append({})
+        self.locals.append({})
 
     def end_scope(self) -> None:
         self.scopes.pop()
+        # The block's slots are free for whatever comes after it
+        self.function_scope.slot -= len(self.locals.pop())
+
+    def declare_implicit(self, name: str) -> Local:
+        # Declares a variable the program doesn't, like "this"
+        self.scopes[-1][name] = True
+        local: Local = self.function_scope.declare()
+        self.locals[-1][name] = local
+        return local
 
-    def declare(self, name: Token) -> None:
+    def declare(self, name: Token, node: Stmt = None) -> None:
         if len(self.scopes) == 0:
             return
 
@@ -218,6 +447,7 @@ class Resolver(Visitor):
         else:
             # False meaning we have not finished resolving the variable's initializer
             self.scopes[-1][name.lexeme] = False
+            self.locals[-1][name.lexeme] = self.function_scope.declare(node)
 
     def define(self, name: Token) -> None:
         if len(self.scopes) == 0:
@@ -1,7 +1,17 @@
 from token_type import TokenType
 from token import Token
+from token_buffer import TokenBuffer
 from exceptions import LoxScannerError
+from typing import Iterator
 import re
+import sys
+
+
+def count_lines(raw: bytes) -> int:
+    # Line breaks in raw source bytes, where \r\n, \r and \n each end a line,
+    # as they do when the file is read in text mode
+    return raw.count(b'\n') + raw.count(b'\r') - raw.count(b'\r\n')
+
 
 class Scanner:
 
@@ -24,14 +34,260 @@ class Scanner:
         'break': TokenType.BREAK
     }
 
-    def __init__(self, source: str):
+    operators: dict = {
+        '(': TokenType.LEFT_PAREN,
+        ')': TokenType.RIGHT_PAREN,
+        '{': TokenType.LEFT_BRACE,
+        '}': TokenType.RIGHT_BRACE,
+        ',': TokenType.COMMA,
+        '.': TokenType.DOT,
+        '-': TokenType.MINUS,
+        '+': TokenType.PLUS,
+        ';': TokenType.SEMICOLON,
+        '/': TokenType.SLASH,
+        '*': TokenType.STAR,
+        '!': TokenType.BANG,
+        '!=': TokenType.BANG_EQUAL,
+        '=': TokenType.EQUAL,
+        '==': TokenType.EQUAL_EQUAL,
+        '>': TokenType.GREATER,
+        '>=': TokenType.GREATER_EQUAL,
+        '<': TokenType.LESS,
+        '<=': TokenType.LESS_EQUAL
+    }
+
+    # One alternation for the whole lexical grammar. Groups are numbered in
+    # order, and tokenize dispatches on the index of the group that matched.
+    # Anything the other groups reject falls through to the last one.
+    token_pattern: re.Pattern = re.compile(r'''
+        ([ \r\t\n]+)                        # 1: whitespace
+      | (//[^\r\n]*)                        # 2: comment
+      | ([A-Za-z_][A-Za-z0-9_]*)            # 3: identifier or keyword
+      | ([!=<>]=?|[(){},.\-+;*/])           # 4: operator
+      | ([0-9]+\.[0-9]+\.)                  # 5: number like 123.456.78
+      | ([0-9]+(?:\.[0-9]+)?)               # 6: number
+      | ("[^"]*)("?)                        # 7, 8: string and its closing quote
+      | (.)                                 # 9: unexpected character
+    ''', re.VERBOSE | re.DOTALL)
+
+    # The same grammar and tables over bytes, for sources that are scanned
+    # without decoding them first, such as memory-mapped files
+    byte_token_pattern: re.Pattern = re.compile(
+        token_pattern.pattern.encode(), re.VERBOSE | re.DOTALL
+    )
+    byte_keywords: dict = {lexeme.encode(): type for lexeme, type in keywords.items()}
+    byte_operators: dict = {lexeme.encode(): type for lexeme, type in operators.items()}
+    # Keyword and operator lexemes, so they are never decoded per occurrence
+    byte_lexemes: dict = {lexeme.encode(): lexeme for lexeme in (*keywords, *operators)}
+
+    def __init__(self, source: str | bytes, symbols: dict[str, str] = None):
         self.had_error: bool = False  # Error state of scanner
-        self.source: str = source  # Characters to be tokenized
+        # Characters to be tokenized, or UTF-8 bytes (anything with the buffer
+        # protocol, like an mmap) to be tokenized without decoding them first
+        self.source: str | bytes = source
+        # Symbol table identifier lexemes are interned into, one per scan
+        # unless one is given. Every occurrence of a name is the same string
+        # object, so dict lookups keyed by it hit identity checks, and as
+        # symbols are sys.intern'ed, that holds across tables too.
+        self.symbols: dict[str, str] = {} if symbols is None else symbols
         self.tokens: list[Token] = []  # Final list of tokens
         self.start: int = 0  # First character in lexeme being scanned
         self.current: int = 0  # Character currently being considered
         self.line: int = 1  # What source line self.current is on
 
+    def scan_tokens(self) -> list[Token]:
+        try:
+            self.tokens.extend(self.stream_tokens())
+        except LoxScannerError as error:
+            self.had_error = True
+            error.what()
+        else:
+            return self.tokens
+
+    def stream_tokens(self) -> Iterator[Token]:
+        # Lazily yields tokens, ending with EOF, so a consumer like the Parser
+        # never needs the whole token list at once. A LoxScannerError is
+        # raised to the consumer at the point the bad lexeme is reached.
+        try:
+            if isinstance(self.source, str):
+                yield from self.tokenize()
+            else:
+                yield from self.tokenize_bytes()
+        except LoxScannerError:
+            self.had_error = True
+            raise
+        yield Token(TokenType.EOF, '', None, self.line)
+
+    def tokenize(self) -> Iterator[Token]:
+        # Tokenizes whole runs of the source at once, one regex match per
+        # token (or per run of whitespace) instead of one call per character
+        keywords: dict = Scanner.keywords
+        operators: dict = Scanner.operators
+        symbols: dict = self.symbols
+        line: int = self.line
+
+        for match in Scanner.token_pattern.finditer(self.source, self.current):
+            kind: int = match.lastindex
+            if kind == 1:
+                line += match.group().count('\n')
+                continue
+            # Expose the span of the lexeme, so a consumer can find where
+            # the token it was just handed sits in the source
+            self.start, self.current = match.span()
+            if kind == 3:
+                lexeme: str = match.group()
+                token_type: TokenType = keywords.get(lexeme)
+                if token_type is None:
+                    token_type = TokenType.IDENTIFIER
+                    lexeme = symbols.get(lexeme) or self.intern(lexeme)
+                yield Token(token_type, lexeme, None, line)
+            elif kind == 4:
+                lexeme: str = match.group()
+                yield Token(operators[lexeme], lexeme, None, line)
+            elif kind == 6:
+                lexeme: str = match.group()
+                yield Token(TokenType.NUMBER, lexeme, float(lexeme), line)
+            elif kind == 8:
+                lexeme: str = match.group()
+                # Lox allows for multiline strings, so the token is reported
+                # on the line the string ends on
+                line += lexeme.count('\n')
+                if not match.group(8):
+                    self.line = line
+                    raise LoxScannerError(line, 'Unterminated string.')
+                yield Token(TokenType.STRING, lexeme, lexeme[1:-1], line)
+            elif kind != 2:
+                # Stray character or a lexeme like 123.456.78
+                self.line = line
+                raise LoxScannerError(line, 'Unexpected character.')
+
+        self.start = self.current = len(self.source)
+        self.line = line
+
+    def tokenize_bytes(self) -> Iterator[Token]:
+        # tokenize for a bytes source. Keyword and operator lexemes come from a
+        # table, and only identifiers, numbers and strings are decoded.
+        keywords: dict = Scanner.byte_keywords
+        operators: dict = Scanner.byte_operators
+        lexemes: dict = Scanner.byte_lexemes
+        identifiers: dict[bytes, str] = {}  # Decoded identifiers, keyed by their bytes
+        line: int = self.line
+
+        for match in Scanner.byte_token_pattern.finditer(self.source, self.current):
+            kind: int = match.lastindex
+            if kind == 1:
+                line += count_lines(match.group())
+                continue
+            self.start, self.current = match.span()
+            if kind == 3:
+                raw: bytes = match.group()
+                token_type: TokenType = keywords.get(raw)
+                if token_type is not None:
+                    yield Token(token_type, lexemes[raw], None, line)
+                    continue
+                lexeme: str = identifiers.get(raw)
+                if lexeme is None:
+                    lexeme = raw.decode('ascii')
+                    lexeme = identifiers[raw] = self.symbols.get(lexeme) or self.intern(lexeme)
+                yield Token(TokenType.IDENTIFIER, lexeme, None, line)
+            elif kind == 4:
+                raw: bytes = match.group()
+                yield Token(operators[raw], lexemes[raw], None, line)
+            elif kind == 6:
+                raw: bytes = match.group()
+                yield Token(TokenType.NUMBER, raw.decode('ascii'), float(raw), line)
+            elif kind == 8:
+                raw: bytes = match.group()
+                line += count_lines(raw)
+                if not match.group(8):
+                    self.line = line
+                    raise LoxScannerError(line, 'Unterminated string.')
+                try:
+                    lexeme: str = raw.decode('utf-8')
+                except UnicodeDecodeError:
+                    self.line = line
+                    raise LoxScannerError(line, 'Invalid UTF-8 in string.')
+                if '\r' in lexeme:
+                    # Match what reading the file in text mode would give
+                    lexeme = lexeme.replace('\r\n', '\n').replace('\r', '\n')
+                yield Token(TokenType.STRING, lexeme, lexeme[1:-1], line)
+            elif kind != 2:
+                self.line = line
+                raise LoxScannerError(line, 'Unexpected character.')
+
+        self.start = self.current = len(self.source)
+        self.line = line
+
+    def intern(self, lexeme: str) -> str:
+        # sys.intern makes the symbol identical to the interpreter's own
+        # "this", "super" and "init" constants as well
+        symbol: str = sys.intern(lexeme)
+        self.symbols[symbol] = symbol
+        return symbol
+
+    def scan_buffer(self) -> TokenBuffer:
+        # Same token stream as scan_tokens, but stored column-wise in a
+        # TokenBuffer, so no per-token objects are created while lexing
+        buffer: TokenBuffer = TokenBuffer(self.source, self.symbols)
+        types_append = buffer.types.append
+        starts_append = buffer.starts.append
+        ends_append = buffer.ends.append
+        lines_append = buffer.lines.append
+        if isinstance(self.source, str):
+            pattern, keywords, operators, lines_in = (
+                Scanner.token_pattern, Scanner.keywords, Scanner.operators, lambda text: text.count('\n')
+            )
+        else:
+            pattern, keywords, operators, lines_in = (
+                Scanner.byte_token_pattern, Scanner.byte_keywords, Scanner.byte_operators, count_lines
+            )
+        identifier: int = TokenType.IDENTIFIER.value
+        number: int = TokenType.NUMBER.value
+        string: int = TokenType.STRING.value
+        line: int = self.line
+
+        try:
+            for match in pattern.finditer(self.source, self.current):
+                kind: int = match.lastindex
+                if kind == 1:
+                    line += lines_in(match.group())
+                    continue
+                elif kind == 3:
+                    token_type: TokenType = keywords.get(match.group())
+                    types_append(token_type.value if token_type else identifier)
+                elif kind == 4:
+                    types_append(operators[match.group()].value)
+                elif kind == 6:
+                    types_append(number)
+                elif kind == 8:
+                    line += lines_in(match.group())
+                    if not match.group(8):
+                        raise LoxScannerError(line, 'Unterminated string.')
+                    types_append(string)
+                elif kind == 2:
+                    continue
+                else:
+                    raise LoxScannerError(line, 'Unexpected character.')
+                start, end = match.span()
+                starts_append(start)
+                ends_append(end)
+                lines_append(line)
+        except LoxScannerError as error:
+            self.line = line
+            self.had_error = True
+            error.what()
+            return None
+
+        self.start = self.current = len(self.source)
+        self.line = line
+        buffer.append(TokenType.EOF, self.current, self.current, line)
+        return buffer
+
+
+class CharacterScanner(Scanner):
+    # The original character-at-a-time scanner. Kept as the reference
+    # implementation the table-driven Scanner is checked and benchmarked against.
+
     def scan_tokens(self) -> list[Token]:
         try:
             while not self.is_at_end:
@@ -82,26 +338,26 @@ class Scanner:
     def identifier(self) -> None:
         while self.is_alphanumeric(self.peek()):
             self.advance()
-        
+
         token_type: TokenType = Scanner.keywords.get(self.current_lexeme)
         if not token_type:
             token_type = TokenType.IDENTIFIER
         self.add_token(token_type)
-    
+
     def number(self) -> None:
         while self.is_digit(self.peek()):
             self.advance()
-        
+
         # Look for a fractional part
         if self.peek() == '.' and self.is_digit(self.peek_next()):
             self.advance()  # Consume the "."
             while self.is_digit(self.peek()):
                 self.advance()
-        
+
             if self.peek() == '.':
                 # If lexeme is something like 123.456.78
                 raise LoxScannerError(self.line, 'Unexpected character.')
-        
+
         self.add_token(TokenType.NUMBER, float(self.current_lexeme))
 
     def string(self) -> None:
@@ -111,7 +367,7 @@ class Scanner:
                 # the line counter when we hit a new line within the string
                 self.line += 1
             self.advance()
-        
+
         if self.is_at_end:
             raise LoxScannerError(self.line, "Unterminated string.")
 
@@ -133,7 +389,7 @@ class Scanner:
         if self.is_at_end:
             return '\0'
         return self.source[self.current]
-    
+
     def peek_next(self) -> str:
         if self.current + 1 >= len(self.source):
             return '\0'
@@ -141,7 +397,7 @@ class Scanner:
 
     def is_alpha(self, c: str) -> bool:
         return re.match(r'[A-Za-z0-9_]+$', c)
-    
+
     def is_alphanumeric(self, c: str) -> bool:
         return self.is_alpha(c) or self.is_digit(c)
 
@@ -160,9 +416,9 @@ class Scanner:
         # Consumes a character and returns the consumed character
         if self.is_at_end:
             return ''
-        
+
         self.current += 1
         return self.source[self.current - 1]
-    
+
     def add_token(self, type: TokenType, literal: object = None) -> None:
-        self.tokens.append(Token(type, self.current_lexeme, literal, self.line))
\ No newline at end of file
+        self.tokens.append(Token(type, self.current_lexeme, literal, self.line))
@@ -0,0 +1,310 @@
+from types import GeneratorType
+from typing import Callable, Generator
+from environment import Cell
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_function import LoxFunction
+from lox_instance import LoxInstance
+from stmt import Expression, Stmt, Var, Block, If, While, Function, Return, Class
+from token_type import TokenType
+from visitor import Visitor
+from expr import Expr, Unary, Binary, Grouping, Assign, Logical, Call, Get, Set
+from token import Token
+from exceptions import LoxRuntimeError, LoxBreakException, LoxReturnException
+from resolver import Resolver
+from ast_arena import FIELDS, NODE, NODES
+
+# What a step of the evaluator can raise and have its caller's step handle
+UNWINDING: tuple[type, ...] = (LoxRuntimeError, LoxReturnException, LoxBreakException)
+
+
+class StackEvaluator(Visitor):
+    # Evaluates a tree without nesting a Python call for each Lox call. Each
+    # node that contains a call is run by a generator, which yields the
+    # nodes it needs evaluated (or the generator of a Lox call) and is sent
+    # back their values, so one loop drives them all from a stack of its
+    # own. The rest of the tree, which can't call anything, is handed to
+    # the Interpreter as is: its recursion is bounded by how deeply the
+    # source nests, not by how deeply calls do.
+    def __init__(self, interpreter: "Interpreter"):
+        self.interpreter: "Interpreter" = interpreter
+        self.pure: set[Expr | Stmt] = set()  # Nodes without calls in them
+        self.marked: set[Function] = set()  # Functions whose bodies are marked
+        self.depth: int = 0  # Lox calls running
+
+    def mark(self, node: Expr | Stmt) -> bool:
+        # Adds node and the nodes under it to pure if they have no calls, and
+        # returns whether node has one. Making a function or a class calls
+        # nothing, whatever is in its methods.
+        if isinstance(node, Function):
+            if node.body is not None:
+                for statement in node.body:
+                    self.mark(statement)
+                self.marked.add(node)
+            self.pure.add(node)
+            return False
+        if isinstance(node, Class):
+            for method in node.methods:
+                self.mark(method)
+            self.pure.add(node)
+            return False
+
+        calls: bool = isinstance(node, Call)
+        # An arena's views are subclasses of the node classes
+        node_class: type = type(node) if type(node) in FIELDS else type(node).__base__
+        fields: tuple = FIELDS[node_class]
+        for field, kind in fields:
+            if kind == NODE:
+                child: Expr | Stmt = getattr(node, field)
+                if child is not None:
+                    calls = self.mark(child) or calls
+            elif kind == NODES:
+                for child in getattr(node, field):
+                    calls = self.mark(child) or calls
+        if not calls:
+            self.pure.add(node)
+        return calls
+
+    def run(self, code: Generator) -> object:
+        # Drives code and everything it yields to completion. An exception
+        # from a step is thrown into the step below it, as it would have
+        # propagated up the Python stack.
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        stack: list[Generator] = [code]
+        value: object = None
+        error: BaseException = None
+        while True:
+            try:
+                if error is None:
+                    step = stack[-1].send(value)
+                else:
+                    raised, error = error, None
+                    step = stack[-1].throw(raised)
+            except StopIteration as done:
+                stack.pop()
+                value = done.value
+                if not stack:
+                    return value
+                continue
+            except UNWINDING as raised:
+                stack.pop()
+                if not stack:
+                    raise
+                error = raised
+                continue
+
+            if type(step) is GeneratorType:
+                stack.append(step)
+                value = None
+            elif step in pure:
+                try:
+                    value = step.accept(interpreter)
+                except UNWINDING as raised:
+                    error = raised
+            else:
+                stack.append(step.accept(self))
+                value = None
+
+    # Each generator runs the children it can right away, and only yields
+    # those with calls in them, which saves a trip through run for most
+
+    def block(self, statements: list[Stmt]) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        for statement in statements:
+            if statement in pure:
+                statement.accept(interpreter)
+            else:
+                yield statement
+
+    def call(self, function: LoxFunction, arguments: list, paren: Token) -> Generator:
+        # A call of a Lox function, as LoxFunction.call makes it
+        declaration: Function = function.declaration
+        if declaration not in self.marked:
+            # A lazily parsed body, or a function an earlier program made, as
+            # in the REPL
+            if declaration.body is None:
+                Resolver.resolve_lazy_body(declaration)
+            self.mark(declaration)
+        if self.depth >= self.interpreter.max_depth:
+            raise LoxRuntimeError(paren, "Stack overflow.")
+
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        previous_frame: list = interpreter.frame
+        previous_upvalues: list[Cell] = interpreter.upvalues
+        interpreter.frame = function.frame(arguments)
+        interpreter.upvalues = function.upvalues
+        self.depth += 1
+        try:
+            for statement in declaration.body:
+                if isinstance(statement, Return) and not function.is_initializer:
+                    # Returning from the body itself needs no unwinding
+                    value: Expr = statement.value
+                    if value is None:
+                        return None
+                    return value.accept(interpreter) if value in pure else (yield value)
+                if statement in pure:
+                    statement.accept(interpreter)
+                else:
+                    yield statement
+        except LoxReturnException as return_value:
+            if function.is_initializer:
+                return function.this
+            return return_value.value
+        finally:
+            interpreter.frame = previous_frame
+            interpreter.upvalues = previous_upvalues
+            self.depth -= 1
+
+        if function.is_initializer:
+            return function.this
+        return None
+
+    def visit_call_expr(self, expr: Call) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        callee = expr.callee.accept(interpreter) if expr.callee in pure else (yield expr.callee)
+        if expr.inline is not None:
+            # The body makes no calls
+            declaration, body = expr.inline
+            if type(callee) is LoxFunction and callee.declaration == declaration:
+                return body.accept(interpreter)
+
+        arguments: list = []
+        for argument in expr.arguments:
+            arguments.append(argument.accept(interpreter) if argument in pure else (yield argument))
+
+        # As in Interpreter.evaluate_call
+        checked: object = callee.declaration if type(callee) is LoxFunction else callee
+        if checked is not expr.checked_callee:
+            if not isinstance(callee, LoxCallable):
+                raise LoxRuntimeError(expr.paren, "Can only call functions and classes.")
+
+            if len(arguments) != callee.arity():
+                raise LoxRuntimeError(
+                    expr.paren,
+                    f"Expected {callee.arity()} arguments but got {len(arguments)}.",
+                )
+            expr.checked_callee = checked
+
+        if type(callee) is LoxFunction:
+            return (yield self.call(callee, arguments, expr.paren))
+        if type(callee) is LoxClass:
+            # Initializers are Lox calls too
+            instance: LoxInstance = LoxInstance(callee)
+            initializer: LoxCallable = callee.find_method("init")
+            if type(initializer) is LoxFunction:
+                yield self.call(initializer.bind(instance), arguments, expr.paren)
+            elif initializer is not None:
+                initializer.bind(instance).call(interpreter, arguments)
+            return instance
+        return callee.call(interpreter, arguments)
+
+    def visit_get_expr(self, expr: Get) -> Generator:
+        object_ = yield expr.object
+        if isinstance(object_, LoxInstance):
+            return object_.get(expr.name)
+
+        raise LoxRuntimeError(expr.name, "Only instances have properties.")
+
+    def visit_set_expr(self, expr: Set) -> Generator:
+        object_ = expr.object.accept(self.interpreter) if expr.object in self.pure else (yield expr.object)
+
+        if not isinstance(object_, LoxInstance):
+            raise LoxRuntimeError(expr.name, "Only instances have fields.")
+
+        value = expr.value.accept(self.interpreter) if expr.value in self.pure else (yield expr.value)
+        object_.set(expr.name, value)
+        return value
+
+    def visit_unary_expr(self, expr: Unary) -> Generator:
+        return self.interpreter.unary(expr.operator, (yield expr.right))
+
+    def visit_binary_expr(self, expr: Binary) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        left = expr.left.accept(interpreter) if expr.left in pure else (yield expr.left)
+        right = expr.right.accept(interpreter) if expr.right in pure else (yield expr.right)
+        return interpreter.binary(expr.operator, left, right)
+
+    def visit_grouping_expr(self, expr: Grouping) -> Generator:
+        return expr.expression.accept(self)
+
+    def visit_assign_expr(self, expr: Assign) -> Generator:
+        return self.interpreter.assign(expr, (yield expr.value))
+
+    def visit_logical_expr(self, expr: Logical) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        left = expr.left.accept(interpreter) if expr.left in self.pure else (yield expr.left)
+
+        if expr.operator.type == TokenType.OR:
+            if interpreter.is_truthy(left):
+                return left
+        elif not interpreter.is_truthy(left):
+            return left
+
+        return expr.right.accept(interpreter) if expr.right in self.pure else (yield expr.right)
+
+    def visit_expression_stmt(self, stmt: Expression) -> Generator:
+        # The value is dropped as the step below ignores it
+        return stmt.expression.accept(self)
+
+    def visit_var_stmt(self, stmt: Var) -> Generator:
+        self.interpreter.define(stmt, (yield stmt.initializer))
+
+    def visit_return_stmt(self, stmt: Return) -> Generator:
+        raise LoxReturnException((yield stmt.value))
+
+    def visit_while_stmt(self, stmt: While) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        pure: set[Expr | Stmt] = self.pure
+        condition: Expr = stmt.condition
+        body: Stmt = stmt.body
+        try:
+            while interpreter.is_truthy(
+                condition.accept(interpreter) if condition in pure else (yield condition)
+            ):
+                if body in pure:
+                    body.accept(interpreter)
+                else:
+                    yield body
+        except LoxBreakException:
+            pass
+
+    def visit_block_stmt(self, stmt: Block) -> Generator:
+        return self.block(stmt.statements)
+
+    def visit_if_stmt(self, stmt: If) -> Generator:
+        interpreter: "Interpreter" = self.interpreter
+        condition: Expr = stmt.condition
+        if interpreter.is_truthy(
+            condition.accept(interpreter) if condition in self.pure else (yield condition)
+        ):
+            yield stmt.then_branch
+        elif stmt.else_branch is not None:
+            yield stmt.else_branch
+
+
+class StackEngine:
+    # The tree-walker's semantics with Lox calls kept off Python's stack, so
+    # recursion is only limited by Interpreter.max_depth, past which it is
+    # a "Stack overflow." runtime error
+    def compile(self, statements: list[Stmt]) -> Callable:
+        def script(interpreter: "Interpreter", frame: list, upvalues: list[Cell]) -> None:
+            evaluator: StackEvaluator = StackEvaluator(interpreter)
+            for statement in statements:
+                evaluator.mark(statement)
+
+            previous_frame: list = interpreter.frame
+            previous_upvalues: list[Cell] = interpreter.upvalues
+            interpreter.frame = frame
+            interpreter.upvalues = upvalues
+            try:
+                evaluator.run(evaluator.block(statements))
+            finally:
+                interpreter.frame = previous_frame
+                interpreter.upvalues = previous_upvalues
+
+        return script
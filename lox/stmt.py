@@ -3,10 +3,12 @@ from token import Token
 
 
 class Stmt:
-    pass
+    __slots__ = ()
 
 
 class Expression(Stmt):
+    __slots__ = ("expression",)
+
     def __init__(self, expr: Expr):
         self.expression = expr
 
@@ -15,15 +17,23 @@ class Expression(Stmt):
 
 
 class Var(Stmt):
+    __slots__ = ("name", "initializer", "slot", "captured")
+
     def __init__(self, name: Token, initializer: Expr):
         self.name = name
         self.initializer = initializer
+        # Set by the resolver for locals: the variable's slot in the frame,
+        # and whether closures capture it, so it is kept in a Cell
+        self.slot: int = None
+        self.captured: bool = False
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_var_stmt(self)
 
 
 class Block(Stmt):
+    __slots__ = ("statements",)
+
     def __init__(self, statements: list[Stmt]):
         self.statements = statements
 
@@ -32,6 +42,8 @@ class Block(Stmt):
 
 
 class If(Stmt):
+    __slots__ = ("condition", "then_branch", "else_branch")
+
     def __init__(self, condition: Expr, then_branch: Stmt, else_branch: Stmt):
         self.condition = condition
         self.then_branch = then_branch
@@ -42,6 +54,8 @@ class If(Stmt):
 
 
 class While(Stmt):
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition: Expr, body: Stmt):
         self.condition = condition
         self.body = body
@@ -51,6 +65,8 @@ class While(Stmt):
 
 
 class Break(Stmt):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -58,30 +74,93 @@ class Break(Stmt):
         return visitor.visit_break_stmt(self)
 
 
+class LazyBody:
+    # The tokens of a function body whose tree isn't kept. The resolver
+    # checks the statements parsed from them and drops them, recording the
+    # scopes around the function here, and the body is parsed and resolved
+    # again in them the first time the function is called.
+    __slots__ = ("tokens", "statements", "scopes", "locals", "function_scope", "function_type", "class_type")
+
+    def __init__(self, tokens: list[Token], statements: list[Stmt] = None):
+        self.tokens = tokens  # Up to and including the closing brace
+        self.statements = statements  # Until the resolver has checked them
+        self.scopes = None
+        self.locals = None
+        self.function_scope = None
+        self.function_type = None
+        self.class_type = None
+
+
 class Function(Stmt):
-    def __init__(self, name: Token, params: list[Token], body: list[Stmt]):
+    __slots__ = (
+        "name",
+        "params",
+        "body",
+        "lazy_body",
+        "slot",
+        "captured",
+        "size",
+        "upvalues",
+        "cells",
+        "globals",
+        "heat",
+    )
+
+    def __init__(
+        self,
+        name: Token,
+        params: list[Token],
+        body: list[Stmt],
+        lazy_body: LazyBody = None,
+    ):
         self.name = name
         self.params = params
-        self.body = body
+        self.body = body  # None until a lazy body is parsed
+        self.lazy_body = lazy_body
+        # Set by the resolver: where a local function is stored, as for Var
+        self.slot: int = None
+        self.captured: bool = False
+        self.size: int = None  # Slots in the frame of a call
+        # What a closure of the function captures, as (True, slot) for a cell
+        # in the frame it is made in or (False, index) for one of that
+        # frame's function's upvalues
+        self.upvalues: tuple[tuple[bool, int], ...] = ()
+        self.cells: tuple[int, ...] = ()  # Parameters to move into cells on a call
+        # The slots of the globals the function's code names, which it keeps
+        # from being reused (see Resolver.pin_globals)
+        self.globals: tuple = ()
+        # Calls and loop iterations so far under the tiered engine, or None
+        # once the function can't be promoted
+        self.heat: int = 0
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_function_stmt(self)
 
 
 class Return(Stmt):
+    __slots__ = ("keyword", "value", "tail")
+
     def __init__(self, keyword: Token, value: Expr):
         self.keyword = keyword
         self.value = value
+        self.tail: bool = False  # Set by the resolver for a call in tail position
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_return_stmt(self)
 
 
 class Class(Stmt):
+    __slots__ = ("name", "methods", "superclass", "slot", "captured", "super_slot")
+
     def __init__(self, name: Token, superclass: Variable, methods: list[Function]):
         self.name = name
         self.methods = methods
         self.superclass = superclass
+        # Set by the resolver: where a local class is stored, as for Var, and
+        # the slot of the "super" its methods capture
+        self.slot: int = None
+        self.captured: bool = False
+        self.super_slot: int = None
 
     def accept(self, visitor: "Visitor"):
         return visitor.visit_class_stmt(self)
@@ -1,6 +1,8 @@
 from token_type import TokenType
 
 class Token:
+    __slots__ = ("type", "lexeme", "literal", "line")
+
     def __init__(self, type: TokenType, lexeme: str, literal: object, line: int):
         self.type: TokenType = type
         self.lexeme: str = lexeme
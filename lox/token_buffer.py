@@ -0,0 +1,104 @@
+from array import array
+from typing import Iterator
+import sys
+from token_type import TokenType
+
+# TokenType members indexed by their value, to turn a stored type back into a member
+TOKEN_TYPES: list[TokenType] = sorted(TokenType, key=lambda token_type: token_type.value)
+IDENTIFIER: int = TokenType.IDENTIFIER.value
+
+
+class TokenBuffer:
+    # Columnar token storage. Instead of one Token object per token, the type,
+    # source offsets and line of every token are kept in parallel arrays, and
+    # lexemes and literals are only sliced out of the source when asked for.
+    def __init__(self, source: str | bytes, symbols: dict[str, str] = None):
+        self.source: str | bytes = source  # Bytes sources are decoded a lexeme at a time
+        # Identifier lexemes are interned into this table as they are sliced out
+        self.symbols: dict[str, str] = {} if symbols is None else symbols
+        self.types: array = array('B')  # TokenType values
+        self.starts: array = array('I')  # Offset of the first character of each lexeme
+        self.ends: array = array('I')  # Offset just past the last character
+        self.lines: array = array('I')
+
+    def append(self, type: TokenType, start: int, end: int, line: int) -> None:
+        self.types.append(type.value)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+
+    def type(self, index: int) -> TokenType:
+        return TOKEN_TYPES[self.types[index]]
+
+    def lexeme(self, index: int) -> str:
+        lexeme: str = self.source[self.starts[index]:self.ends[index]]
+        if not isinstance(lexeme, str):
+            lexeme = bytes(lexeme).decode('utf-8')
+            if '\r' in lexeme:
+                # Match what reading the file in text mode would give
+                lexeme = lexeme.replace('\r\n', '\n').replace('\r', '\n')
+        if self.types[index] == IDENTIFIER:
+            symbol: str = self.symbols.get(lexeme)
+            if symbol is None:
+                symbol = self.symbols[lexeme] = sys.intern(lexeme)
+            return symbol
+        return lexeme
+
+    def literal(self, index: int) -> object:
+        token_type: TokenType = TOKEN_TYPES[self.types[index]]
+        if token_type == TokenType.NUMBER:
+            return float(self.lexeme(index))
+        if token_type == TokenType.STRING:
+            # Trim the surrounding quotes
+            return self.lexeme(index)[1:-1]
+        return None
+
+    def line(self, index: int) -> int:
+        return self.lines[index]
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> "TokenView":
+        if index < 0:
+            index += len(self.types)
+        if not 0 <= index < len(self.types):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self) -> Iterator["TokenView"]:
+        for index in range(len(self.types)):
+            yield TokenView(self, index)
+
+
+class TokenView:
+    # A Token-compatible handle on one entry of a TokenBuffer. It holds nothing
+    # but the buffer and an index, so it is cheap to keep in the AST for error
+    # reporting.
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer: TokenBuffer, index: int):
+        self.buffer: TokenBuffer = buffer
+        self.index: int = index
+
+    @property
+    def type(self) -> TokenType:
+        return TOKEN_TYPES[self.buffer.types[self.index]]
+
+    @property
+    def lexeme(self) -> str:
+        return self.buffer.lexeme(self.index)
+
+    @property
+    def literal(self) -> object:
+        return self.buffer.literal(self.index)
+
+    @property
+    def line(self) -> int:
+        return self.buffer.lines[self.index]
+
+    def __str__(self) -> str:
+        return f'{self.type} {self.lexeme} {self.literal}'
+
+    def __repr__(self) -> str:
+        return f'{self.type} {self.lexeme} {self.literal}'
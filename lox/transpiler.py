@@ -0,0 +1,707 @@
+import ast
+import marshal
+import math
+from typing import Callable
+from functools import partial
+from types import CodeType, FunctionType
+from environment import Cell, GlobalEnvironment, UNDEFINED, LOCAL, CELL, UPVALUE
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from stmt import Expression, Stmt, Var, Block, If, While, Break, Function, Return, Class
+from token_type import TokenType
+from visitor import Visitor
+from expr import (
+    Expr,
+    Literal,
+    Grouping,
+    Unary,
+    Binary,
+    Variable,
+    Assign,
+    Logical,
+    Call,
+    Get,
+    Set,
+    This,
+    Super,
+)
+from token import Token
+from exceptions import LoxRuntimeError, LoxBreakException
+from resolver import Resolver
+
+# A token as the generated code refers to it, as (type name, lexeme, line):
+# only literals, so that code objects can be marshalled. A Token is only
+# made from it to report an error.
+Location = tuple[str, str, int]
+
+# Operators whose result is always a bool, so it can be a Python condition as is
+COMPARISONS: dict[TokenType, str] = {
+    TokenType.GREATER: ">",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.LESS: "<",
+    TokenType.LESS_EQUAL: "<=",
+}
+ARITHMETIC: dict[TokenType, str] = {
+    TokenType.MINUS: "-",
+    TokenType.STAR: "*",
+}
+
+
+def location(token: Token) -> Location:
+    return (token.type.name, token.lexeme, token.line)
+
+
+def error(at: Location, message: str) -> LoxRuntimeError:
+    type_name, lexeme, line = at
+    return LoxRuntimeError(Token(TokenType[type_name], lexeme, None, line), message)
+
+
+class PythonFunction(LoxCallable):
+    # A Lox function transpiled to a Python function, standing in for
+    # LoxFunction. Calls with the right number of arguments call function
+    # directly; methods take their instance as the first argument.
+    __slots__ = ("raw", "function", "parameter_count", "name", "is_initializer", "this")
+
+    def __init__(
+        self,
+        raw: FunctionType,
+        parameter_count: int,
+        name: str,
+        is_initializer: bool,
+        this: LoxInstance = None,
+    ):
+        self.raw: FunctionType = raw
+        self.function: FunctionType = raw if this is None else partial(raw, this)
+        self.parameter_count: int = parameter_count
+        self.name: str = name
+        self.is_initializer: bool = is_initializer
+        self.this: LoxInstance = this
+
+    def call(self, interpreter: "Interpreter", arguments: list):
+        return self.function(*arguments)
+
+    def bind(self, instance: LoxInstance) -> "PythonFunction":
+        return PythonFunction(self.raw, self.parameter_count, self.name, self.is_initializer, instance)
+
+    def arity(self) -> int:
+        return self.parameter_count
+
+    def __str__(self) -> str:
+        return f"<fun {self.name}>"
+
+
+# The runtime support generated code calls into. Only the slow paths go
+# through these; the common cases are inlined as Python expressions.
+
+
+def undefined(at: Location) -> None:
+    raise error(at, f"Undefined variable {at[1]}.")
+
+
+def assign_global(values: list, slot: int, value: object, at: Location) -> object:
+    if values[slot] is UNDEFINED:
+        undefined(at)
+    values[slot] = value
+    return value
+
+
+def set_cell(cell: Cell, value: object) -> object:
+    cell.value = value
+    return value
+
+
+def check_numbers(at: Location, *operands: object) -> None:
+    for operand in operands:
+        if not isinstance(operand, float) and not isinstance(operand, int):
+            raise error(at, "Operands must be numbers.")
+
+
+def add(left: object, right: object, at: Location) -> object:
+    if isinstance(left, float) and isinstance(right, float):
+        return left + right
+    elif isinstance(left, str) and isinstance(right, str):
+        return left + right
+    raise error(at, "Operands must be two numbers or two strings.")
+
+
+def divide(left: object, right: object, at: Location) -> float:
+    check_numbers(at, left, right)
+    if float(right) == 0:
+        raise error(at, "Cannot divide by zero.")
+    return float(left) / float(right)
+
+
+def call(interpreter: "Interpreter", callee: object, at: Location, *arguments: object) -> object:
+    if not isinstance(callee, LoxCallable):
+        raise error(at, "Can only call functions and classes.")
+    if len(arguments) != callee.arity():
+        raise error(at, f"Expected {callee.arity()} arguments but got {len(arguments)}.")
+    return callee.call(interpreter, list(arguments))
+
+
+def get(instance: object, name: str, at: Location) -> object:
+    if not isinstance(instance, LoxInstance):
+        raise error(at, "Only instances have properties.")
+    value = instance.fields.get(name, UNDEFINED)
+    if value is not UNDEFINED:
+        return value
+    method = instance.klass.find_method(name)
+    if method is None:
+        raise error(at, f'Undefined property "{name}".')
+    return method.bind(instance)
+
+
+def lookup(instance: object, name: str, at: Location, count: int) -> object:
+    # The property a method call calls, as get finds it. A method that can
+    # be called directly with count arguments is returned unbound, as a
+    # plain Python function to pass the instance to.
+    if not isinstance(instance, LoxInstance):
+        raise error(at, "Only instances have properties.")
+    value = instance.fields.get(name, UNDEFINED)
+    if value is not UNDEFINED:
+        return value
+    method = instance.klass.find_method(name)
+    if method is None:
+        raise error(at, f'Undefined property "{name}".')
+    if type(method) is PythonFunction and method.parameter_count == count:
+        return method.raw
+    return method.bind(instance)
+
+
+def check_instance(instance: object, at: Location) -> LoxInstance:
+    if not isinstance(instance, LoxInstance):
+        raise error(at, "Only instances have fields.")
+    return instance
+
+
+def set_field(instance: LoxInstance, name: str, value: object) -> object:
+    instance.fields[name] = value
+    return value
+
+
+def superclass(value: object, at: Location) -> LoxClass:
+    if not isinstance(value, LoxClass):
+        raise error(at, "Superclass must be a class.")
+    return value
+
+
+def super_method(klass: LoxClass, instance: LoxInstance, name: str, at: Location) -> object:
+    method = klass.find_method(name)
+    if method is None:
+        raise error(at, f'Undefined property "{name}".')
+    return method.bind(instance)
+
+
+RUNTIME: dict[str, object] = {
+    "_UNDEFINED": UNDEFINED,
+    "_Cell": Cell,
+    "_LoxClass": LoxClass,
+    "_LoxInstance": LoxInstance,
+    "_PythonFunction": PythonFunction,
+    "_FunctionType": FunctionType,
+    "_LoxBreak": LoxBreakException,
+    "_undefined": undefined,
+    "_assign_global": assign_global,
+    "_set_cell": set_cell,
+    "_check_numbers": check_numbers,
+    "_add": add,
+    "_divide": divide,
+    "_call": call,
+    "_get": get,
+    "_lookup": lookup,
+    "_check_instance": check_instance,
+    "_set_field": set_field,
+    "_superclass": superclass,
+    "_super": super_method,
+}
+
+
+class TranspiledScript:
+    # A program transpiled to a Python code object. Running it defines the
+    # functions of the program and runs its top-level code in a namespace of
+    # its own, holding the runtime support and the interpreter's globals.
+    __slots__ = ("code", "lazy")
+
+    def __init__(self, code: CodeType, lazy: tuple[Function, ...] = ()):
+        self.code: CodeType = code
+        self.lazy: tuple[Function, ...] = lazy  # As for Module
+
+    def __call__(self, interpreter: "Interpreter", frame: list, upvalues: list[Cell]) -> None:
+        exec(self.code, namespace(interpreter, self.lazy))
+
+    def __reduce__(self) -> tuple:
+        # Code objects can't be pickled, but they can be marshalled
+        return load_script, (marshal.dumps(self.code), self.lazy)
+
+
+def load_script(data: bytes, lazy: tuple[Function, ...] = ()) -> TranspiledScript:
+    return TranspiledScript(marshal.loads(data), lazy)
+
+
+def namespace(interpreter: "Interpreter", lazy: tuple[Function, ...] = ()) -> dict[str, object]:
+    # The globals of generated code run by interpreter, where lazy holds the
+    # declarations of its lazily parsed functions
+    globals: GlobalEnvironment = interpreter.globals
+
+    def lazy_factory(index: int, is_method: bool, is_initializer: bool) -> Callable:
+        # The factory of a lazily parsed function, which is parsed, resolved
+        # and transpiled on its first call. An invalid body raises then, and
+        # again on every call, as in the tree-walker.
+        declaration: Function = lazy[index]
+        factory: Callable = interpreter.factories.get(declaration)
+        if factory is None:
+            if declaration.body is None:
+                Resolver.resolve_lazy_body(declaration)
+            factory = transpile_function(declaration, is_method, is_initializer, interpreter)
+            interpreter.factories[declaration] = factory
+        return factory
+
+    return RUNTIME | {
+        "_g": globals.values,
+        "_interpreter": interpreter,
+        # Global slots differ between processes, so the code looks them up
+        # by name when it starts. It holds the globals, and so their slots.
+        "_slot": globals.slot,
+        "_lazy": lazy_factory,
+    }
+
+
+def transpile_function(
+    declaration: Function, is_method: bool, is_initializer: bool, interpreter: "Interpreter"
+) -> Callable[..., FunctionType]:
+    # Transpiles a single function, as the tiered engine promotes it, and
+    # returns its factory: called with the function's upvalues, it returns
+    # the Python function, which a method takes its instance first to
+    transpiler: Transpiler = Transpiler()
+    name: str = transpiler.factory(declaration, is_method, is_initializer)
+    code: dict[str, object] = namespace(interpreter, tuple(transpiler.module.lazy))
+    exec(transpiler.module.code(), code)
+    return code[name]
+
+
+class Module:
+    # The Python source being generated for a program, each line with the
+    # Lox line it came from
+    __slots__ = ("lines", "factories", "globals", "lazy")
+
+    def __init__(self):
+        self.lines: list[tuple[str, int]] = []
+        self.factories: int = 0
+        self.globals: dict[str, str] = {}  # Python name holding each global's slot
+        # Functions whose bodies aren't parsed yet, by the index the code
+        # passes to _lazy for them
+        self.lazy: list[Function] = []
+
+    def global_name(self, name: str) -> str:
+        python_name: str = self.globals.get(name)
+        if python_name is None:
+            python_name = self.globals[name] = f"_s_{name}"
+        return python_name
+
+    def code(self) -> CodeType:
+        lines: list[tuple[str, int]] = [
+            (f"{python_name} = _slot({name!r})", 1) for name, python_name in self.globals.items()
+        ] + self.lines
+        tree: ast.Module = ast.parse("\n".join(text for text, line in lines))
+        # Map every position back to the Lox source, so tracebacks through
+        # the generated code point at Lox lines
+        for node in ast.walk(tree):
+            if hasattr(node, "lineno"):
+                node.lineno = lines[node.lineno - 1][1]
+                node.end_lineno = node.lineno
+                node.end_col_offset = max(node.end_col_offset or 0, node.col_offset)
+        return compile(tree, "<lox>", "exec")
+
+
+class Transpiler(Visitor):
+    # Translates a resolved tree into Python source, a function at a time.
+    # Lox locals become Python locals, named after the variable and its
+    # slot. Captured ones hold a Cell, and each Lox function becomes a
+    # factory that takes the cells it captures and returns a plain Python
+    # function, so closures capture exactly what the resolver said.
+    def __init__(self, module: Module = None, is_initializer: bool = False):
+        self.module: Module = Module() if module is None else module
+        self.lines: list[tuple[str, int]] = []
+        self.names: dict[int, str] = {}  # Python name of the local in each slot
+        self.temps: int = 0
+        self.indent: int = 1
+        self.loops: int = 0  # Python loops around the code being generated
+        self.calls: int = 0  # Calls generated so far
+        self.line: int = 1
+        self.is_initializer: bool = is_initializer
+        self.cells: set[int] = set()  # Parameter slots, "this" included, boxed in cells
+
+    def compile(self, statements: list[Stmt]) -> TranspiledScript:
+        # Transpiles top-level code into what Program runs
+        for statement in statements:
+            statement.accept(self)
+        self.module.lines += [("def _script():", 1), *self.lines, ("    return", self.line)]
+        self.module.lines.append(("_script()", self.line))
+        return TranspiledScript(self.module.code(), tuple(self.module.lazy))
+
+    def emit(self, text: str) -> None:
+        self.lines.append(("    " * self.indent + text, self.line))
+
+    def emit_body(self, stmt: Stmt) -> None:
+        # Emits stmt as an indented block, which Python needs to be non-empty
+        count: int = len(self.lines)
+        self.indent += 1
+        stmt.accept(self)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.indent -= 1
+
+    def temp(self) -> str:
+        self.temps += 1
+        return f"_t{self.temps}"
+
+    def local(self, slot: int, name: str) -> str:
+        self.names[slot] = f"{name}_{slot}"
+        return self.names[slot]
+
+    def at(self, token: Token) -> str:
+        self.line = token.line
+        return repr(location(token))
+
+    def closure(self, declaration: Function, is_method: bool, is_initializer: bool) -> str:
+        # The expression making a PythonFunction for declaration here
+        captures: list[str] = [
+            self.names[index] if is_local else f"_u{index}"
+            for is_local, index in declaration.upvalues
+        ]
+        return (
+            f"_PythonFunction({self.factory(declaration, is_method, is_initializer)}"
+            f"({', '.join(captures)}), {len(declaration.params)}, "
+            f"{declaration.name.lexeme!r}, {is_initializer})"
+        )
+
+    def factory(self, declaration: Function, is_method: bool, is_initializer: bool) -> str:
+        # Generates the factory for a function and returns its name
+        name: str = f"_make{self.module.factories}"
+        self.module.factories += 1
+        if declaration.body is None:
+            self.lazy_factory(name, declaration, is_method, is_initializer)
+            return name
+
+        function: Transpiler = Transpiler(self.module, is_initializer)
+        function.line = declaration.name.line
+        function.indent = 2
+        parameters: list[str] = []
+        if is_method:
+            parameters.append(function.local(0, "this"))
+        for param in declaration.params:
+            parameters.append(function.local(len(parameters), param.lexeme))
+
+        function.cells = set(declaration.cells)
+        for slot in declaration.cells:
+            function.emit(f"{function.names[slot]} = _Cell({function.names[slot]})")
+        for statement in declaration.body:
+            statement.accept(function)
+        function.emit_return(None)
+
+        upvalues: list[str] = [f"_u{index}" for index in range(len(declaration.upvalues))]
+        self.module.lines += [
+            (f"def {name}({', '.join(upvalues)}):", declaration.name.line),
+            (f"    def {declaration.name.lexeme}_({', '.join(parameters)}):", declaration.name.line),
+            *function.lines,
+            (f"    return {declaration.name.lexeme}_", declaration.name.line),
+        ]
+        return name
+
+    def lazy_factory(
+        self, name: str, declaration: Function, is_method: bool, is_initializer: bool
+    ) -> None:
+        # Generates a factory for a function whose body isn't parsed yet. Its
+        # functions get the real one from _lazy on their first call and pass
+        # every call on to it.
+        index: int = len(self.module.lazy)
+        self.module.lazy.append(declaration)
+        upvalues: str = ", ".join(f"_u{slot}" for slot in range(len(declaration.upvalues)))
+        count: int = len(declaration.params) + is_method  # "this" comes first
+        parameters: str = ", ".join(f"_a{position}" for position in range(count))
+        line: int = declaration.name.line
+        self.module.lines += [
+            (f"def {name}({upvalues}):", line),
+            ("    _function = None", line),
+            (f"    def {declaration.name.lexeme}_({parameters}):", line),
+            ("        nonlocal _function", line),
+            ("        if _function is None:", line),
+            (
+                f"            _function = _lazy({index}, {is_method}, {is_initializer})({upvalues})",
+                line,
+            ),
+            (f"        return _function({parameters})", line),
+            (f"    return {declaration.name.lexeme}_", line),
+        ]
+
+    def emit_return(self, value: Expr) -> None:
+        if self.is_initializer:
+            # An initializer always returns its instance, from slot 0
+            self.emit(f"return {self.variable_in(CELL if 0 in self.cells else LOCAL, 0)}")
+        elif value is None:
+            self.emit("return None")
+        else:
+            self.emit(f"return {value.accept(self)}")
+
+    def visit_literal_expr(self, expr: Literal) -> str:
+        value: object = expr.value
+        if isinstance(value, float) and not math.isfinite(value):
+            return f"float({str(value)!r})"
+        return repr(value)
+
+    def visit_grouping_expr(self, expr: Grouping) -> str:
+        return expr.expression.accept(self)
+
+    def visit_variable_expr(self, expr: Variable) -> str:
+        return self.variable(expr.name, expr)
+
+    def visit_this_expr(self, expr: This) -> str:
+        return self.variable(expr.keyword, expr)
+
+    def variable(self, name: Token, expr: Expr) -> str:
+        if expr.access is not None:
+            return self.variable_in(expr.access, expr.slot)
+        slot: str = self.module.global_name(name.lexeme)
+        value: str = self.temp()
+        return f"({value} if ({value} := _g[{slot}]) is not _UNDEFINED else _undefined({self.at(name)}))"
+
+    def variable_in(self, access: int, slot: int) -> str:
+        if access == LOCAL:
+            return self.names[slot]
+        if access == CELL:
+            return f"{self.names[slot]}.value"
+        return f"_u{slot}.value"
+
+    def visit_assign_expr(self, expr: Assign) -> str:
+        value: str = expr.value.accept(self)
+        if expr.access == LOCAL:
+            return f"({self.names[expr.slot]} := {value})"
+        if expr.access == CELL:
+            return f"_set_cell({self.names[expr.slot]}, {value})"
+        if expr.access == UPVALUE:
+            return f"_set_cell(_u{expr.slot}, {value})"
+        slot: str = self.module.global_name(expr.name.lexeme)
+        return f"_assign_global(_g, {slot}, {value}, {self.at(expr.name)})"
+
+    def visit_unary_expr(self, expr: Unary) -> str:
+        right: str = expr.right.accept(self)
+        value: str = self.temp()
+        if expr.operator.type == TokenType.BANG:
+            return f"(({value} := {right}) is None or {value} is False)"
+        at: str = self.at(expr.operator)
+        return f"(-{value} if type({value} := {right}) is float else (_check_numbers({at}, {value}) or -float({value})))"
+
+    def visit_binary_expr(self, expr: Binary) -> str:
+        left: str = expr.left.accept(self)
+        right: str = expr.right.accept(self)
+        a: str = self.temp()
+        b: str = self.temp()
+        at: str = self.at(expr.operator)
+        operator: TokenType = expr.operator.type
+        # Both operands are always evaluated, left first, before the chained
+        # "is" checks whether both are floats
+        floats: str = f"type({a} := {left}) is type({b} := {right}) is float"
+
+        if operator in COMPARISONS or operator in ARITHMETIC:
+            symbol: str = COMPARISONS.get(operator) or ARITHMETIC[operator]
+            return (
+                f"({a} {symbol} {b} if {floats} else "
+                f"(_check_numbers({at}, {a}, {b}) or float({a}) {symbol} float({b})))"
+            )
+        if operator == TokenType.PLUS:
+            return f"({a} + {b} if {floats} else _add({a}, {b}, {at}))"
+        if operator == TokenType.SLASH:
+            return f"({a} / {b} if {floats} and {b} else _divide({a}, {b}, {at}))"
+        # Interpreter.is_equal: values of different types are never equal
+        equal: str = f"(type({a} := {left}) is type({b} := {right}) and {a} == {b})"
+        if operator == TokenType.BANG_EQUAL:
+            return f"(not {equal})"
+        return equal
+
+    def visit_logical_expr(self, expr: Logical) -> str:
+        left: str = expr.left.accept(self)
+        right: str = expr.right.accept(self)
+        value: str = self.temp()
+        if expr.operator.type == TokenType.OR:
+            return f"({value} if (({value} := {left}) is not None and {value} is not False) else {right})"
+        return f"({value} if (({value} := {left}) is None or {value} is False) else {right})"
+
+    def visit_call_expr(self, expr: Call) -> str:
+        self.calls += 1
+        function: str = self.temp()
+        if isinstance(expr.callee, Get):
+            # A method the call can pass the instance to itself isn't bound
+            instance: str = self.temp()
+            target: str = (
+                f"({function} := _lookup({instance} := {expr.callee.object.accept(self)}, "
+                f"{expr.callee.name.lexeme!r}, {self.at(expr.callee.name)}, {len(expr.arguments)}))"
+            )
+            fast: str = f"type({function}) is _FunctionType"
+        else:
+            instance = None
+            target = f"({function} := {expr.callee.accept(self)})"
+            fast = f"type({function}) is _PythonFunction and {function}.parameter_count == {len(expr.arguments)}"
+
+        # The arguments are evaluated once, after the callee and before
+        # either branch, which only passes them on
+        temps: list[str] = []
+        values: list[str] = []
+        for argument in expr.arguments:
+            temps.append(self.temp())
+            values.append(f"({temps[-1]} := {argument.accept(self)})")
+        arguments: str = ", ".join(temps)
+        at: str = self.at(expr.paren)
+        slow: str = f"_call(_interpreter, {function}, {at}{', ' if temps else ''}{arguments})"
+        evaluate: str = f"({target}, {', '.join(values)})" if values else target
+
+        if instance is not None:
+            direct: str = f"{function}({instance}{', ' if temps else ''}{arguments})"
+        else:
+            direct = f"{function}.function({arguments})"
+        if values:
+            return f"({direct} if {evaluate} and {fast} else {slow})"
+        return f"({direct} if {evaluate} is not None and {fast} else {slow})"
+
+    def visit_get_expr(self, expr: Get) -> str:
+        instance: str = self.temp()
+        value: str = self.temp()
+        name: str = repr(expr.name.lexeme)
+        return (
+            f"({value} if type({instance} := {expr.object.accept(self)}) is _LoxInstance and "
+            f"({value} := {instance}.fields.get({name}, _UNDEFINED)) is not _UNDEFINED "
+            f"else _get({instance}, {name}, {self.at(expr.name)}))"
+        )
+
+    def visit_set_expr(self, expr: Set) -> str:
+        # The object is checked before the value is evaluated
+        instance: str = f"_check_instance({expr.object.accept(self)}, {self.at(expr.name)})"
+        return f"_set_field({instance}, {expr.name.lexeme!r}, {expr.value.accept(self)})"
+
+    def visit_super_expr(self, expr: Super) -> str:
+        klass: str = self.variable(expr.keyword, expr)
+        instance: str = self.variable(expr.this.keyword, expr.this)
+        return f"_super({klass}, {instance}, {expr.method.lexeme!r}, {self.at(expr.method)})"
+
+    def condition(self, expr: Expr) -> str:
+        # expr as a Python condition, with Lox truthiness
+        inner: Expr = expr
+        while isinstance(inner, Grouping):
+            inner = inner.expression
+        code: str = expr.accept(self)
+        if (
+            (isinstance(inner, Binary) and inner.operator.type not in ARITHMETIC
+                and inner.operator.type not in (TokenType.PLUS, TokenType.SLASH))
+            or (isinstance(inner, Unary) and inner.operator.type == TokenType.BANG)
+            or (isinstance(inner, Literal) and isinstance(inner.value, bool))
+        ):
+            return code
+        value: str = self.temp()
+        return f"(({value} := {code}) is not None and {value} is not False)"
+
+    def visit_expression_stmt(self, stmt: Expression) -> None:
+        expr: Expr = stmt.expression
+        if not isinstance(expr, Assign):
+            self.emit(expr.accept(self))
+            return
+
+        # Assignments as statements are plain Python assignments
+        value: str = expr.value.accept(self)
+        if expr.access == LOCAL:
+            self.emit(f"{self.names[expr.slot]} = {value}")
+        elif expr.access == CELL:
+            self.emit(f"{self.names[expr.slot]}.value = {value}")
+        elif expr.access == UPVALUE:
+            self.emit(f"_u{expr.slot}.value = {value}")
+        else:
+            slot: str = self.module.global_name(expr.name.lexeme)
+            self.emit(f"_assign_global(_g, {slot}, {value}, {self.at(expr.name)})")
+
+    def define(self, stmt: Var | Function | Class, value: str) -> None:
+        if stmt.slot is None:
+            self.emit(f"_g[{self.module.global_name(stmt.name.lexeme)}] = {value}")
+        elif stmt.captured:
+            # A new cell on every run, as in the tree-walker
+            self.emit(f"{self.local(stmt.slot, stmt.name.lexeme)} = _Cell({value})")
+        else:
+            self.emit(f"{self.local(stmt.slot, stmt.name.lexeme)} = {value}")
+
+    def visit_var_stmt(self, stmt: Var) -> None:
+        self.line = stmt.name.line
+        value: str = "None" if stmt.initializer is None else stmt.initializer.accept(self)
+        self.define(stmt, value)
+
+    def visit_function_stmt(self, stmt: Function) -> None:
+        self.line = stmt.name.line
+        if stmt.captured:
+            # The function may capture its own cell, so the cell comes first
+            name: str = self.local(stmt.slot, stmt.name.lexeme)
+            self.emit(f"{name} = _Cell(None)")
+            self.emit(f"{name}.value = {self.closure(stmt, False, False)}")
+        else:
+            self.define(stmt, self.closure(stmt, False, False))
+
+    def visit_return_stmt(self, stmt: Return) -> None:
+        self.line = stmt.keyword.line
+        self.emit_return(stmt.value)
+
+    def visit_while_stmt(self, stmt: While) -> None:
+        calls: int = self.calls
+        start: int = len(self.lines)
+        self.emit(f"while {self.condition(stmt.condition)}:")
+        self.loops += 1
+        self.emit_body(stmt.body)
+        self.loops -= 1
+        if self.calls == calls:
+            return
+
+        # A break in a function called from the loop ends it, as in the
+        # tree-walker
+        loop: list[tuple[str, int]] = [("    " + text, line) for text, line in self.lines[start:]]
+        del self.lines[start:]
+        self.emit("try:")
+        self.lines += loop
+        self.emit("except _LoxBreak:")
+        self.emit("    pass")
+
+    def visit_break_stmt(self, stmt: Break) -> None:
+        if self.loops:
+            self.emit("break")
+        else:
+            self.emit("raise _LoxBreak()")
+
+    def visit_block_stmt(self, stmt: Block) -> None:
+        for statement in stmt.statements:
+            statement.accept(self)
+
+    def visit_if_stmt(self, stmt: If) -> None:
+        self.emit(f"if {self.condition(stmt.condition)}:")
+        self.emit_body(stmt.then_branch)
+        if stmt.else_branch is not None:
+            self.emit("else:")
+            self.emit_body(stmt.else_branch)
+
+    def visit_class_stmt(self, stmt: Class) -> None:
+        self.line = stmt.name.line
+        base: str = "None"
+        if stmt.superclass is not None:
+            base = self.temp()
+            value: str = stmt.superclass.accept(self)
+            self.emit(f"{base} = _superclass({value}, {self.at(stmt.superclass.name)})")
+
+        # Declared before the methods are made, which may capture it
+        self.define(stmt, "None")
+        if stmt.superclass is not None:
+            self.emit(f"{self.local(stmt.super_slot, 'super')} = _Cell({base})")
+
+        methods: str = ", ".join(
+            f"{method.name.lexeme!r}: {self.closure(method, True, method.name.lexeme == 'init')}"
+            for method in stmt.methods
+        )
+        klass: str = f"_LoxClass({stmt.name.lexeme!r}, {base}, {{{methods}}})"
+        if stmt.slot is None:
+            self.emit(f"_g[{self.module.global_name(stmt.name.lexeme)}] = {klass}")
+        elif stmt.captured:
+            self.emit(f"{self.names[stmt.slot]}.value = {klass}")
+        else:
+            self.emit(f"{self.names[stmt.slot]} = {klass}")
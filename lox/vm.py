@@ -0,0 +1,473 @@
+from bytecode import OpCode, Chunk
+from environment import Cell, UNDEFINED
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from exceptions import LoxRuntimeError, LoxBreakException
+
+# Opcodes as plain ints, which the dispatch loop compares against fastest
+CONSTANT: int = OpCode.CONSTANT.value
+NIL: int = OpCode.NIL.value
+TRUE: int = OpCode.TRUE.value
+FALSE: int = OpCode.FALSE.value
+POP: int = OpCode.POP.value
+DUP: int = OpCode.DUP.value
+GET_LOCAL: int = OpCode.GET_LOCAL.value
+SET_LOCAL: int = OpCode.SET_LOCAL.value
+STORE_LOCAL: int = OpCode.STORE_LOCAL.value
+GET_CELL: int = OpCode.GET_CELL.value
+SET_CELL: int = OpCode.SET_CELL.value
+DEFINE_CELL: int = OpCode.DEFINE_CELL.value
+GET_UPVALUE: int = OpCode.GET_UPVALUE.value
+SET_UPVALUE: int = OpCode.SET_UPVALUE.value
+GET_GLOBAL: int = OpCode.GET_GLOBAL.value
+SET_GLOBAL: int = OpCode.SET_GLOBAL.value
+DEFINE_GLOBAL: int = OpCode.DEFINE_GLOBAL.value
+GET_PROPERTY: int = OpCode.GET_PROPERTY.value
+SET_PROPERTY: int = OpCode.SET_PROPERTY.value
+GET_SUPER: int = OpCode.GET_SUPER.value
+EQUAL: int = OpCode.EQUAL.value
+NOT_EQUAL: int = OpCode.NOT_EQUAL.value
+GREATER: int = OpCode.GREATER.value
+GREATER_EQUAL: int = OpCode.GREATER_EQUAL.value
+LESS: int = OpCode.LESS.value
+LESS_EQUAL: int = OpCode.LESS_EQUAL.value
+ADD: int = OpCode.ADD.value
+SUBTRACT: int = OpCode.SUBTRACT.value
+MULTIPLY: int = OpCode.MULTIPLY.value
+DIVIDE: int = OpCode.DIVIDE.value
+NOT: int = OpCode.NOT.value
+NEGATE: int = OpCode.NEGATE.value
+JUMP: int = OpCode.JUMP.value
+JUMP_IF_FALSE: int = OpCode.JUMP_IF_FALSE.value
+JUMP_IF_FALSE_OR_POP: int = OpCode.JUMP_IF_FALSE_OR_POP.value
+JUMP_IF_TRUE_OR_POP: int = OpCode.JUMP_IF_TRUE_OR_POP.value
+CALL: int = OpCode.CALL.value
+GET_METHOD: int = OpCode.GET_METHOD.value
+CALL_METHOD: int = OpCode.CALL_METHOD.value
+CLOSURE: int = OpCode.CLOSURE.value
+CLASS: int = OpCode.CLASS.value
+CHECK_SUPERCLASS: int = OpCode.CHECK_SUPERCLASS.value
+CHECK_INSTANCE: int = OpCode.CHECK_INSTANCE.value
+RETURN: int = OpCode.RETURN.value
+BREAK_OUT: int = OpCode.BREAK_OUT.value
+
+# Lox calls don't use the Python stack, so the VM bounds them itself
+MAX_FRAMES: int = 10_000
+
+
+class VMFunction(LoxCallable):
+    # A closure made from a FunctionProto, standing in for LoxFunction
+    def __init__(self, proto: "FunctionProto", upvalues: list[Cell], this: LoxInstance = None):
+        self.proto: "FunctionProto" = proto
+        self.upvalues: list[Cell] = upvalues
+        self.this: LoxInstance = this
+
+    def call(self, interpreter: "Interpreter", arguments: list):
+        # Called from outside the VM, like from LoxClass.call. Inside it,
+        # calls are made by the VM loop without this.
+        proto: "FunctionProto" = self.proto
+        if proto.chunk is None:
+            proto.compile()
+        return VM(interpreter).run(
+            proto.chunk, VM.frame(proto, arguments, self.this), self.upvalues
+        )
+
+    def bind(self, instance: LoxInstance) -> "VMFunction":
+        return VMFunction(self.proto, self.upvalues, instance)
+
+    def arity(self) -> int:
+        return self.proto.arity
+
+    def __str__(self) -> str:
+        return f"<fun {self.proto.name}>"
+
+
+class VM:
+    # Runs Chunks. Lox calls push a frame onto the VM's own call stack rather
+    # than recursing in Python, and returns and breaks are jumps, so the
+    # loop never raises to get around.
+    def __init__(self, interpreter: "Interpreter"):
+        # The interpreter holds the globals and is passed on to natives
+        self.interpreter: "Interpreter" = interpreter
+
+    @staticmethod
+    def frame(proto: "FunctionProto", arguments: list, this: LoxInstance) -> list:
+        # Lays arguments out as a frame for proto, as LoxFunction does
+        if this is not None:
+            arguments.insert(0, this)
+        size: int = proto.size
+        if size > len(arguments):
+            arguments.extend([None] * (size - len(arguments)))
+        for slot in proto.cells:
+            arguments[slot] = Cell(arguments[slot])
+        return arguments
+
+    def run(self, chunk: Chunk, frame: list, upvalues: list[Cell]) -> object:
+        # Runs chunk until it returns, and returns what it returns
+        interpreter: "Interpreter" = self.interpreter
+        global_values: list = interpreter.globals.values
+        code = chunk.code
+        constants: list = chunk.constants
+        stack: list = []
+        push = stack.append
+        pop = stack.pop
+        # The frames of the callers of the running function, each as the
+        # chunk, the offset to return to, the frame, the upvalues and the
+        # base of the operand stack
+        calls: list[tuple] = []
+        base: int = 0
+        ip: int = 0
+
+        while True:
+            op: int = code[ip]
+            if op == GET_LOCAL:
+                push(frame[code[ip + 1]])
+                ip += 2
+            elif op == CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+            elif op == GET_GLOBAL:
+                slot: int = code[ip + 1]
+                value = global_values[slot] if slot < len(global_values) else UNDEFINED
+                if value is UNDEFINED:
+                    name = chunk.tokens[ip]
+                    raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+                push(value)
+                ip += 2
+            elif op == LESS:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left < right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) < float(right)
+                ip += 1
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left + right
+                elif isinstance(left, str) and isinstance(right, str):
+                    stack[-1] = left + right
+                else:
+                    raise LoxRuntimeError(
+                        chunk.tokens[ip], "Operands must be two numbers or two strings."
+                    )
+                ip += 1
+            elif op == SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left - right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) - float(right)
+                ip += 1
+            elif op == JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+            elif op == CALL or op == CALL_METHOD:
+                count: int = code[ip + 1]
+                start: int = len(stack) - count
+                arguments: list = stack[start:]
+                if op == CALL:
+                    callee = stack[start - 1]
+                    this = None
+                    del stack[start - 1:]
+                else:
+                    # GET_METHOD left the method and its instance, or a
+                    # field's value and None
+                    callee = stack[start - 2]
+                    this = stack[start - 1]
+                    del stack[start - 2:]
+                paren = chunk.tokens[ip]
+                ip += 2
+
+                if type(callee) is VMFunction:
+                    if this is None:
+                        this = callee.this
+                    function: VMFunction = callee
+                    if count != function.proto.arity:
+                        raise LoxRuntimeError(
+                            paren, f"Expected {function.proto.arity} arguments but got {count}."
+                        )
+                else:
+                    if this is not None:
+                        callee = callee.bind(this)
+                    if not isinstance(callee, LoxCallable):
+                        raise LoxRuntimeError(paren, "Can only call functions and classes.")
+                    if count != callee.arity():
+                        raise LoxRuntimeError(
+                            paren, f"Expected {callee.arity()} arguments but got {count}."
+                        )
+
+                    initializer = None
+                    if isinstance(callee, LoxClass):
+                        initializer = callee.find_method("init")
+                    if type(initializer) is VMFunction:
+                        # Run the initializer in this loop; it returns the
+                        # instance
+                        function = initializer
+                        this = LoxInstance(callee)
+                    else:
+                        try:
+                            push(callee.call(interpreter, arguments))
+                        except LoxBreakException:
+                            # A break in a function outside the VM
+                            loop_exit: int = chunk.loop_exits.get(ip)
+                            if loop_exit is None:
+                                chunk, ip, frame, upvalues, base = self.unwind(calls, stack)
+                                code = chunk.code
+                                constants = chunk.constants
+                            else:
+                                del stack[base:]
+                                ip = loop_exit
+                        continue
+
+                if len(calls) >= MAX_FRAMES:
+                    raise LoxRuntimeError(paren, "Stack overflow.")
+                proto = function.proto
+                if proto.chunk is None:
+                    proto.compile()
+                calls.append((chunk, ip, frame, upvalues, base))
+                chunk = proto.chunk
+                code = chunk.code
+                constants = chunk.constants
+                frame = self.frame(proto, arguments, this)
+                upvalues = function.upvalues
+                base = len(stack)
+                ip = 0
+            elif op == RETURN:
+                value = pop()
+                if not calls:
+                    return value
+                chunk, ip, frame, upvalues, base = calls.pop()
+                code = chunk.code
+                constants = chunk.constants
+                push(value)
+            elif op == STORE_LOCAL:
+                frame[code[ip + 1]] = pop()
+                ip += 2
+            elif op == SET_LOCAL:
+                frame[code[ip + 1]] = stack[-1]
+                ip += 2
+            elif op == POP:
+                pop()
+                ip += 1
+            elif op == JUMP:
+                ip = code[ip + 1]
+            elif op == GET_PROPERTY:
+                instance = pop()
+                if not isinstance(instance, LoxInstance):
+                    raise LoxRuntimeError(chunk.tokens[ip], "Only instances have properties.")
+                name: str = constants[code[ip + 1]]
+                value = instance.fields.get(name, UNDEFINED)
+                if value is not UNDEFINED:
+                    push(value)
+                else:
+                    method = instance.klass.find_method(name)
+                    if method is None:
+                        raise LoxRuntimeError(chunk.tokens[ip], f'Undefined property "{name}".')
+                    push(method.bind(instance))
+                ip += 2
+            elif op == GET_METHOD:
+                instance = pop()
+                if not isinstance(instance, LoxInstance):
+                    raise LoxRuntimeError(chunk.tokens[ip], "Only instances have properties.")
+                name = constants[code[ip + 1]]
+                value = instance.fields.get(name, UNDEFINED)
+                if value is not UNDEFINED:
+                    push(value)
+                    push(None)
+                else:
+                    method = instance.klass.find_method(name)
+                    if method is None:
+                        raise LoxRuntimeError(chunk.tokens[ip], f'Undefined property "{name}".')
+                    push(method)
+                    push(instance)
+                ip += 2
+            elif op == GET_CELL:
+                push(frame[code[ip + 1]].value)
+                ip += 2
+            elif op == GET_UPVALUE:
+                push(upvalues[code[ip + 1]].value)
+                ip += 2
+            elif op == MULTIPLY:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left * right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) * float(right)
+                ip += 1
+            elif op == GREATER:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left > right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) > float(right)
+                ip += 1
+            elif op == LESS_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left <= right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) <= float(right)
+                ip += 1
+            elif op == GREATER_EQUAL:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left >= right
+                else:
+                    interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                    stack[-1] = float(left) >= float(right)
+                ip += 1
+            elif op == DIVIDE:
+                right = pop()
+                left = stack[-1]
+                interpreter.check_number_operand(chunk.tokens[ip], left, right)
+                if float(right) == 0:
+                    raise LoxRuntimeError(chunk.tokens[ip], "Cannot divide by zero.")
+                stack[-1] = float(left) / float(right)
+                ip += 1
+            elif op == EQUAL:
+                right = pop()
+                left = stack[-1]
+                # Interpreter.is_equal: values of different types are never equal
+                stack[-1] = type(left) is type(right) and left == right
+                ip += 1
+            elif op == NOT_EQUAL:
+                right = pop()
+                left = stack[-1]
+                stack[-1] = not (type(left) is type(right) and left == right)
+                ip += 1
+            elif op == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+                ip += 1
+            elif op == NEGATE:
+                value = stack[-1]
+                interpreter.check_number_operand(chunk.tokens[ip], value)
+                stack[-1] = -float(value)
+                ip += 1
+            elif op == NIL:
+                push(None)
+                ip += 1
+            elif op == TRUE:
+                push(True)
+                ip += 1
+            elif op == FALSE:
+                push(False)
+                ip += 1
+            elif op == JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+            elif op == JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is not None and value is not False:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+            elif op == SET_CELL:
+                frame[code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == DEFINE_CELL:
+                frame[code[ip + 1]] = Cell(pop())
+                ip += 2
+            elif op == SET_UPVALUE:
+                upvalues[code[ip + 1]].value = stack[-1]
+                ip += 2
+            elif op == SET_GLOBAL:
+                slot = code[ip + 1]
+                if slot >= len(global_values) or global_values[slot] is UNDEFINED:
+                    name = chunk.tokens[ip]
+                    raise LoxRuntimeError(name, f"Undefined variable {name.lexeme}.")
+                global_values[slot] = stack[-1]
+                ip += 2
+            elif op == DEFINE_GLOBAL:
+                interpreter.globals.define(constants[code[ip + 1]], pop())
+                ip += 2
+            elif op == CHECK_INSTANCE:
+                if not isinstance(stack[-1], LoxInstance):
+                    raise LoxRuntimeError(chunk.tokens[ip], "Only instances have fields.")
+                ip += 1
+            elif op == SET_PROPERTY:
+                value = pop()
+                pop().fields[constants[code[ip + 1]]] = value
+                push(value)
+                ip += 2
+            elif op == GET_SUPER:
+                instance = pop()
+                superclass: LoxClass = pop()
+                name = constants[code[ip + 1]]
+                method = superclass.find_method(name)
+                if method is None:
+                    raise LoxRuntimeError(chunk.tokens[ip], f'Undefined property "{name}".')
+                push(method.bind(instance))
+                ip += 2
+            elif op == CLOSURE:
+                proto = constants[code[ip + 1]]
+                push(
+                    VMFunction(
+                        proto,
+                        [frame[index] if is_local else upvalues[index] for is_local, index in proto.upvalues],
+                    )
+                )
+                ip += 2
+            elif op == CLASS:
+                count = code[ip + 2]
+                methods: list[VMFunction] = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                superclass = pop()
+                push(
+                    LoxClass(
+                        constants[code[ip + 1]],
+                        superclass,
+                        {method.proto.name: method for method in methods},
+                    )
+                )
+                ip += 3
+            elif op == CHECK_SUPERCLASS:
+                if not isinstance(stack[-1], LoxClass):
+                    raise LoxRuntimeError(chunk.tokens[ip], "Superclass must be a class.")
+                ip += 1
+            elif op == DUP:
+                push(stack[-1])
+                ip += 1
+            elif op == BREAK_OUT:
+                chunk, ip, frame, upvalues, base = self.unwind(calls, stack)
+                code = chunk.code
+                constants = chunk.constants
+            else:
+                raise ValueError(f"Unknown opcode {op}.")
+
+    @staticmethod
+    def unwind(calls: list[tuple], stack: list) -> tuple:
+        # Handles a break outside any loop of the running function. As in the
+        # tree-walker it ends the innermost loop the call was made in, in the
+        # nearest caller that made it in one. Returns the state to resume.
+        while calls:
+            chunk, ip, frame, upvalues, base = calls.pop()
+            loop_exit: int = chunk.loop_exits.get(ip)
+            if loop_exit is not None:
+                del stack[base:]
+                return chunk, loop_exit, frame, upvalues, base
+        # No caller in this run is in a loop, so leave it to whoever called
+        # into the VM
+        raise LoxBreakException()
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+LOX_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lox")
+
+# Run in a child process from lox/, where the interpreter's flat imports
+# resolve (its token module shadows the standard library's). clock is
+# replaced by one that stands still, so scripts that time themselves print
+# the same every run.
+RUNNER: str = """
+import sys
+from lox import Lox
+from lox_callable import LoxCallable
+
+
+class Clock(LoxCallable):
+    def arity(self):
+        return 0
+
+    def call(self, interpreter, arguments):
+        return 0.0
+
+    def __str__(self):
+        return '<native function "clock">'
+
+
+engine, optimize, arena, lazy = sys.argv[1], *(flag == "1" for flag in sys.argv[2:5])
+program = Lox.compile(sys.stdin.read(), arena, lazy, optimize)
+if program is not None:
+    program.run(globals={"clock": Clock()}, engine=engine)
+"""
+
+
+def lox_engines() -> list[str]:
+    # "tree" and every name in program.ENGINES
+    output: str = subprocess.run(
+        [sys.executable, "-c", "from program import ENGINES; print(*ENGINES)"],
+        cwd=LOX_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return ["tree", *output.split()]
+
+
+def run_source(
+    source: str,
+    engine: str = "tree",
+    optimize: bool = False,
+    arena: bool = False,
+    lazy: bool = False,
+) -> tuple[str, str]:
+    # The stdout and stderr of running source
+    flags: list[str] = ["1" if flag else "0" for flag in (optimize, arena, lazy)]
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-c", RUNNER, engine, *flags],
+        cwd=LOX_DIR,
+        input=source,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout, result.stderr
+
+
+def run_python(code: str, *args: str) -> str:
+    # The stdout of running Python code from lox/
+    return subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=LOX_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def run_repl(lines: list[str], *options: str) -> tuple[str, str]:
+    # The stdout and stderr of typing lines into the REPL
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "lox.py", *options],
+        cwd=LOX_DIR,
+        input="".join(line + "\n" for line in lines),
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout, result.stderr
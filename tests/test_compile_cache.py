@@ -0,0 +1,45 @@
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from support import LOX_DIR
+
+# Every module whose code decides what a cached script holds
+HASHED_MODULES: list[str] = [
+    "token.py",
+    "token_type.py",
+    "scanner.py",
+    "parser.py",
+    "expr.py",
+    "stmt.py",
+    "environment.py",
+    "ast_arena.py",
+    "resolver.py",
+    "optimizer.py",
+    "transpiler.py",
+    "interpreter.py",
+    "lox.py",
+    "compile_cache.py",
+]
+
+
+def interpreter_version(lox_dir: str) -> str:
+    return subprocess.run(
+        [sys.executable, "-c", "import compile_cache; print(compile_cache.interpreter_version().hex())"],
+        cwd=lox_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+@pytest.mark.parametrize("module", HASHED_MODULES)
+def test_editing_module_invalidates_cache(module: str, tmp_path) -> None:
+    lox_dir: str = str(tmp_path / "lox")
+    shutil.copytree(LOX_DIR, lox_dir, ignore=shutil.ignore_patterns("__pycache__", "__loxcache__"))
+    before: str = interpreter_version(lox_dir)
+    with open(f"{lox_dir}/{module}", "a") as file:
+        file.write("\n# Edited\n")
+    assert interpreter_version(lox_dir) != before
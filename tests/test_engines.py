@@ -0,0 +1,306 @@
+import pytest
+
+from support import lox_engines, run_python, run_repl, run_source
+
+ENGINES: list[str] = lox_engines()
+# The engines that make returned calls in place of the returning one, which
+# run tail recursion in constant space. The tiered engine only promotes
+# functions that make no tail calls.
+TAIL_CALL_ENGINES: list[str] = ["tree", "tiered"]
+
+TAIL_RECURSION: str = """
+fun count(n, total) {
+  if (n == 0) return total;
+  return count(n - 1, total + 1);
+}
+fun even(n) {
+  if (n == 0) return true;
+  return odd(n - 1);
+}
+fun odd(n) {
+  if (n == 0) return false;
+  return even(n - 1);
+}
+print(count(DEPTH, 0));
+print(even(DEPTH));
+"""
+
+# Each line calls what earlier lines, run as programs of their own, defined
+REPL_LINES: list[str] = [
+    "fun square(x) { return x * x; }",
+    "print(square(3));",
+    "fun counter() { var n = 0; fun next() { n = n + 1; return n; } return next; }",
+    "var next = counter();",
+    "next(); print(next());",
+    'class Greeter { init(name) { this.name = name; } greet() { return "hi " + this.name; } }',
+    'print(Greeter("lox").greet());',
+    "class Loud < Greeter { greet() { return super.greet() + \"!\"; } }",
+    'print(Loud("lox").greet());',
+    "",
+]
+
+# Quickens a division and a comparison, and makes an "or" and a comparison of
+# mixed types GENERIC, every trip through the loop
+QUICKENED_LOOP: str = """
+var total = 0;
+for (var i = 0; i < 20000; i = i + 1) {
+  total = total + (i / 2 or nil);
+  if (i == nil) print("never");
+}
+print(total);
+"""
+
+# Prints how many constants an arena holds before and after each of a few
+# runs of the program given
+ARENA_CONSTANTS: str = """
+import sys
+from lox import Lox
+
+program = Lox.compile(sys.argv[1], arena=True)
+arena = program.statements[0].arena
+print(len(arena.constants))
+for _ in range(3):
+    program.run(engine=sys.argv[2])
+    print(len(arena.constants))
+"""
+
+# Runs a program with and without tail calls, which without them recurses as
+# deep in Python as in Lox
+TAIL_CALLS_OPT_OUT: str = """
+import sys
+from lox import Lox
+
+program = Lox.compile(sys.argv[1])
+for tail_calls in (True, False):
+    try:
+        program.run(engine=sys.argv[2], tail_calls=tail_calls)
+    except RecursionError:
+        print("RecursionError")
+"""
+
+# Compiles and runs programs that each define globals of their own, printing
+# how many global slots are in use afterwards
+GLOBAL_SLOTS_IN_USE: str = """
+import gc
+import environment
+from lox import Lox
+
+for i in range(2000):
+    Lox.compile(f"var g{i} = {i}; fun f{i}() {{ return g{i} + h{i}; }}").run()
+gc.collect()
+print(environment.next_slot - len(environment.free_slots) - len(environment.released_slots))
+"""
+
+# Calls a function after the program that defined it, and its globals, are
+# gone and other programs have taken slots since
+FREED_PROGRAM_FUNCTION: str = """
+import gc
+import sys
+from lox import Lox
+
+engine = sys.argv[1]
+get = Lox.compile("var secret = 1; fun get() { return secret; } get();").run(engine=engine)["get"]
+gc.collect()
+for i in range(50):
+    Lox.compile(f"var n{i} = {i};").run(engine=engine)
+gc.collect()
+others = "".join(f"var other{i} = 2;" for i in range(50))
+Lox.compile(others + "print(get());").run(globals={"get": get}, engine=engine)
+"""
+
+# Prints how many instances are left once a program that makes some is run
+INSTANCES_LEFT: str = """
+import gc
+import sys
+from lox import Lox
+from lox_instance import LoxInstance
+
+program = Lox.compile(sys.argv[1])
+program.run(engine=sys.argv[2])
+gc.collect()
+print(sum(isinstance(value, LoxInstance) for value in gc.get_objects()))
+"""
+METHOD_CALLS: str = """
+class Counter {
+  init() { this.count = 0; }
+  add() { this.count = this.count + 1; return this.count; }
+}
+fun count() {
+  var counter = Counter();
+  for (var i = 0; i < 100; i = i + 1) counter.add();
+  return counter.add();
+}
+print(count());
+"""
+
+# Runs one program in several threads at once, with different globals, and
+# prints the results that came out wrong
+CONCURRENT_RUNS: str = """
+import sys
+import threading
+from lox import Lox
+
+sys.setswitchinterval(1e-5)
+engine, arena, lazy = sys.argv[1], sys.argv[2] == "1", sys.argv[3] == "1"
+program = Lox.compile(sys.argv[4], arena=arena, lazy=lazy)
+wrong = []
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def run(input):
+    for _ in range(5):
+        result = program.run(globals={"input": input}, engine=engine)["result"]
+        if result != fib(input) + sum(range(input * 10)):
+            wrong.append((input, result))
+
+
+threads = [threading.Thread(target=run, args=(input,)) for input in range(8, 16)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(wrong)
+"""
+SHARED_PROGRAM: str = """
+fun fib(n) {
+  if (n < 2) return n;
+  return fib(n - 1) + fib(n - 2);
+}
+class Box {
+  init(value) { this.value = value; }
+  get() { return this.value; }
+}
+fun sum(n) {
+  var total = 0;
+  for (var i = 0; i < n; i = i + 1) total = total + Box(i).get();
+  return total;
+}
+var result = fib(input) + sum(input * 10);
+"""
+
+# Fields holding nil are still fields, shadowing methods of the same name
+NIL_FIELDS: str = """
+class A { m() { return "method"; } }
+var a = A();
+a.m = nil;
+a.f = nil;
+print(a.m);
+print(a.f);
+"""
+
+# Lazily parsed bodies only have their trees built when first called
+LAZY_BODIES: str = """
+print("start");
+class Counter {
+  init(start) { this.count = start; }
+  add(by) {
+    fun adder(n) { return n + by; }
+    this.count = adder(this.count);
+    return this;
+  }
+}
+fun makeCounter() {
+  var n = 0;
+  fun next() { n = n + 1; return n; }
+  return next;
+}
+print(Counter(1).add(2).add(3).count);
+var next = makeCounter();
+next();
+print(next());
+"""
+
+# Programs with errors in function bodies, which lazy bodies report up front
+# all the same, so nothing runs
+INVALID_BODIES: list[str] = [
+    'print("start"); fun broken() { var = ; }',
+    'print("start"); fun broken() { fun inner() { return 1 +; } }',
+    'print("start"); class A { init() { return 1; } }',
+    'print("start"); class A { m() { return super.x; } }',
+    'print("start"); fun f() { var a = 1; var a = 2; }',
+    'print("start"); fun f() { var a = a; } fun g() { return this; }',
+    'print("start"); fun f() { if (true) { print 1; }',
+]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_lazy_bodies(engine: str) -> None:
+    assert run_source(LAZY_BODIES, engine, lazy=True) == run_source(LAZY_BODIES)
+
+
+@pytest.mark.parametrize("source", INVALID_BODIES)
+def test_lazy_bodies_rejected_like_eager(source: str) -> None:
+    output: tuple[str, str] = run_source(source)
+    assert "Error" in output[0] and "start" not in output[0]
+    assert run_source(source, lazy=True) == output
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_repl_calls_earlier_lines(engine: str) -> None:
+    stdout, stderr = run_repl(REPL_LINES, f"--engine={engine}")
+    assert stderr == ""
+    assert stdout.replace("Lox > ", "").split() == ["9", "2", "hi", "lox", "hi", "lox!"]
+
+
+@pytest.mark.parametrize("engine", TAIL_CALL_ENGINES)
+def test_deep_tail_recursion(engine: str) -> None:
+    # Far deeper than Python's stack, and hot enough to promote
+    assert run_source(TAIL_RECURSION.replace("DEPTH", "20000"), engine) == ("20000\ntrue\n", "")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_tail_recursion(engine: str) -> None:
+    # Shallow enough for the engines that nest Python calls for Lox calls
+    assert run_source(TAIL_RECURSION.replace("DEPTH", "100"), engine) == ("100\ntrue\n", "")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_quickening_keeps_arena_size(engine: str) -> None:
+    lines: list[str] = run_python(ARENA_CONSTANTS, QUICKENED_LOOP, engine).splitlines()
+    assert lines[1::2] == ["99995000"] * 3
+    assert len(set(lines[0::2])) == 1
+
+
+def test_global_slots_reclaimed() -> None:
+    # Two thousand programs' worth of names, but only the natives' and the
+    # last program's slots are held
+    assert int(run_python(GLOBAL_SLOTS_IN_USE)) < 20
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_call_sites_keep_no_instances(engine: str) -> None:
+    assert run_python(INSTANCES_LEFT, METHOD_CALLS, engine) == "101\n0\n"
+
+
+# Transpiled functions keep the globals they were made with
+@pytest.mark.parametrize("engine", [engine for engine in ENGINES if engine != "python"])
+def test_freed_global_slots_not_reused_while_named(engine: str) -> None:
+    assert "Undefined variable secret." in run_python(FREED_PROGRAM_FUNCTION, engine)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nil_fields(engine: str) -> None:
+    assert run_source(NIL_FIELDS, engine) == ("nil\nnil\n", "")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("arena, lazy", [(False, False), (True, False), (False, True)])
+def test_concurrent_runs(engine: str, arena: bool, lazy: bool) -> None:
+    flags: list[str] = ["1" if flag else "0" for flag in (arena, lazy)]
+    assert run_python(CONCURRENT_RUNS, engine, *flags, SHARED_PROGRAM) == "[]\n"
+
+
+@pytest.mark.parametrize("engine", TAIL_CALL_ENGINES)
+def test_tail_calls_opt_out(engine: str) -> None:
+    source: str = TAIL_RECURSION.replace("DEPTH", "20000")
+    assert run_python(TAIL_CALLS_OPT_OUT, source, engine) == "20000\ntrue\nRecursionError\n"
+
+
+def test_tail_calls_opt_out_option() -> None:
+    line: str = TAIL_RECURSION.replace("DEPTH", "100").replace("\n", " ")
+    stdout, stderr = run_repl([line, ""], "--no-tail-calls")
+    assert stderr == ""
+    assert stdout.replace("Lox > ", "").split() == ["100", "true"]
@@ -0,0 +1,208 @@
+import glob
+import os
+
+import pytest
+
+from support import LOX_DIR, lox_engines, run_source
+
+ENGINES: list[str] = lox_engines()
+
+SAMPLES: list[str] = sorted(
+    [os.path.join(LOX_DIR, "test.lox"), *glob.glob(os.path.join(LOX_DIR, "benchmarks", "*.lox"))]
+)
+
+# Programs whose optimized form differs the most from their source
+EDGE_CASES: dict[str, str] = {
+    "folding_errors": """
+print(1 + 2 * 3);
+fun divide() {
+  print("dividing");
+  return 1 /
+    0;
+}
+print(divide());
+print("unreached");
+""",
+    "unary_folding_error": """
+print(!nil);
+print(-"a");
+""",
+    "negative_zero": """
+print(0);
+print(-0);
+print(-false == -0);
+print(0 * -1);
+print(-0 == 0);
+print(-(1 - 1));
+var zero = -0;
+print(zero);
+""",
+    "string_concatenation": """
+print("a" + "b" + "c");
+{
+  var greeting = "hello";
+  print(greeting + ", " + "world");
+}
+print("a" + 1);
+""",
+    "shadowed_constants": """
+var a = "global";
+{
+  var a = 1;
+  {
+    var a = 2;
+    print(a);
+  }
+  print(a + 10);
+}
+print(a);
+fun count() {
+  var n = 0;
+  fun increment() {
+    n = n + 1;
+  }
+  increment();
+  increment();
+  {
+    var n = "inner";
+    print(n);
+  }
+  return n;
+}
+print(count());
+fun loop() {
+  var i = 0;
+  while (i < 3) {
+    var step = 1;
+    i = i + step;
+  }
+  return i;
+}
+print(loop());
+""",
+    "dead_code": """
+fun early(flag) {
+  if (flag) return "then";
+  return "after";
+  print("dead");
+}
+print(early(true));
+print(early(false));
+var i = 0;
+while (true) {
+  i = i + 1;
+  if (i > 2) {
+    break;
+    print("dead");
+  }
+  print(i);
+}
+for (var j = 0; j < 3; j = j + 1) {
+  if (false) print("never");
+  while (false) print("never");
+  print(j);
+  break;
+  print("dead");
+}
+fun nested() {
+  while (true) {
+    return "returned";
+    print("dead");
+  }
+}
+print(nested());
+""",
+    "constant_branches": """
+if (true) print("then"); else print("else");
+if (nil) print("then"); else print("else");
+if ("" and 0) print("truthy");
+print(nil or "default");
+print(false and undefined);
+""",
+    "inlining": """
+fun square(x) {
+  return x * x;
+}
+fun getX(point) {
+  return point.x;
+}
+fun nothing() {}
+fun negate(x) {
+  return -x;
+}
+class Point {
+  init(x) {
+    this.x = x;
+  }
+}
+fun sum(n) {
+  var total = 0;
+  for (var i = 0; i < n; i = i + 1) total = total + square(i);
+  return total;
+}
+print(sum(10));
+print(getX(Point(3)));
+print(nothing());
+print(square(4, 5));
+{
+  var s = "a";
+  print(negate(s));
+}
+""",
+}
+
+# A call inlined where the function's global is reassigned by a body the
+# optimizer never sees, which the inlined copy must notice
+INLINE_REASSIGNED: str = """
+fun increment(x) {
+  return x + 1;
+}
+fun tenfold(x) {
+  return x * 10;
+}
+fun swap() {
+  increment = tenfold;
+}
+fun use(n) {
+  return increment(n);
+}
+print(use(1));
+swap();
+print(use(1));
+"""
+
+
+def sources() -> list:
+    cases: list = []
+    for path in SAMPLES:
+        with open(path) as file:
+            cases.append(pytest.param(file.read(), id=os.path.relpath(path, LOX_DIR)))
+    cases.extend(pytest.param(source, id=name) for name, source in EDGE_CASES.items())
+    return cases
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("source", sources())
+def test_optimized_output_matches(source: str, engine: str) -> None:
+    assert run_source(source, engine, optimize=True) == run_source(source, engine)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", sorted(EDGE_CASES))
+def test_engines_match_tree_walker(name: str, engine: str) -> None:
+    assert run_source(EDGE_CASES[name], engine, optimize=True) == run_source(EDGE_CASES[name])
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_optimized_arena_output_matches(engine: str) -> None:
+    for name, source in EDGE_CASES.items():
+        assert run_source(source, engine, optimize=True, arena=True) == run_source(source), name
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("arena", [False, True])
+def test_inlined_call_falls_back_when_reassigned(engine: str, arena: bool) -> None:
+    optimized: tuple[str, str] = run_source(
+        INLINE_REASSIGNED, engine, optimize=True, arena=arena, lazy=True
+    )
+    assert optimized == ("2\n10\n", "")
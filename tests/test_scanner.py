@@ -0,0 +1,49 @@
+import pytest
+
+from support import run_python
+
+# Token streams for a file, scanned as text read in text mode and as the raw
+# bytes the interpreter memory-maps, both as Tokens and through a TokenBuffer
+SCAN_BOTH_WAYS: str = """
+import sys
+from scanner import Scanner
+
+path = sys.argv[1]
+with open(path) as file:
+    text = file.read()
+with open(path, "rb") as file:
+    data = file.read()
+for source in (text, data):
+    print([(token.type, token.lexeme, token.literal, token.line) for token in Scanner(source).scan_tokens()])
+    print([(token.type, token.lexeme, token.literal, token.line) for token in Scanner(source).scan_buffer()])
+"""
+
+SOURCE: str = """var a = 1; // one
+print "multi
+line";
+{
+  print a;
+}
+print "done";
+"""
+
+
+@pytest.mark.parametrize(
+    "newlines",
+    [
+        ["\r"],
+        ["\r\n"],
+        ["\r\n", "\r", "\n"],
+    ],
+    ids=["cr", "crlf", "mixed"],
+)
+def test_bytes_scan_like_text(newlines: list[str], tmp_path) -> None:
+    lines: list[str] = SOURCE.split("\n")
+    data: str = "".join(line + newlines[index % len(newlines)] for index, line in enumerate(lines))
+    path = tmp_path / "source.lox"
+    path.write_bytes(data.encode())
+    text_tokens, text_buffer, byte_tokens, byte_buffer = run_python(SCAN_BOTH_WAYS, str(path)).splitlines()
+    assert byte_tokens == text_tokens
+    assert byte_buffer == text_tokens
+    assert text_buffer == text_tokens
+    assert "'multi\\nline'" in text_tokens